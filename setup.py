@@ -64,5 +64,6 @@ setup(
     entry_points={
         'console_scripts': [
             'vro-diff=vro_package_diff.__main__:main',
+            'vro-diff-server=vro_package_diff.server:main',
         ],
     })
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""Generate synthetic vRealize Orchestrator packages for tests and benchmarks."""
+
+# default python modules
+import io
+import random
+import uuid
+import zipfile
+
+# local imports
+from vro_package_diff.config import SUPPORTED_ELEMENT_TYPES
+
+
+ELEMENT_MIX = {
+    "Workflow": 0.3,
+    "ScriptModule": 0.3,
+    "ResourceElement": 0.15,
+    "ConfigurationElement": 0.15,
+    "WebView": 0.1,  # not supported by the diff tool
+}
+"""dict: Default share of each element type in a generated package."""
+
+CHANGES = ["upgrade", "conflict", "new", "removed"]
+"""list: Kinds of changes between the reference and the compared packages."""
+
+INFO_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+    '<!DOCTYPE properties SYSTEM "http://java.sun.com/dtd/properties.dtd">\n'
+    '<properties>\n'
+    '<comment>UTF-16</comment>\n'
+    '<entry key="type">%s</entry>\n'
+    '<entry key="id">%s</entry>\n'
+    '</properties>\n'
+)
+
+META_INF = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+    '<!DOCTYPE properties SYSTEM "http://java.sun.com/dtd/properties.dtd">\n'
+    '<properties>\n'
+    '<entry key="pkg-name">io.vuptime.vrocli.generated</entry>\n'
+    '</properties>\n'
+)
+
+
+def _xml_data(content: str):
+    """Encode an XML content like vRO does (UTF-16 with a BOM)."""
+    return b'\xfe\xff' + ("<?xml version='1.0' encoding='UTF-8'?>\n" + content).encode('utf-16-be')
+
+
+def _script(rng: random.Random, lines: int, revision: int):
+    """Build a script body."""
+    return "\n".join(
+        'System.debug("step %d of revision %d: %08x");' % (line, revision, rng.getrandbits(32))
+        for line in range(lines)
+    )
+
+
+def workflow_data(item_id: str, name: str, item_version: str, rng: random.Random, lines: int, revision: int = 0):
+    """Build the data file of a Workflow."""
+    items = "".join(
+        '  <workflow-item name="item%d" type="task">\n'
+        '    <script encoded="false"><![CDATA[%s]]></script>\n'
+        '  </workflow-item>\n' % (index, _script(rng, 10, revision))
+        for index in range(max(1, lines // 10))
+    )
+    return _xml_data(
+        '<workflow xmlns="http://vmware.com/vco/workflow" root-name="item0" id="%s" version="%s">\n'
+        '  <display-name><![CDATA[%s]]></display-name>\n'
+        '%s</workflow>\n' % (item_id, item_version, name, items)
+    )
+
+
+def action_data(item_id: str, name: str, item_version: str, rng: random.Random, lines: int, revision: int = 0):
+    """Build the data file of an Action (ScriptModule)."""
+    return _xml_data(
+        '<dunes-script-module name="%s" result-type="string" id="%s" version="%s">\n'
+        '  <script encoded="false"><![CDATA[%s]]></script>\n'
+        '</dunes-script-module>\n' % (name, item_id, item_version, _script(rng, lines, revision))
+    )
+
+
+def configuration_data(item_id: str, name: str, item_version: str, rng: random.Random, lines: int,
+                       revision: int = 0, valued: bool = False):
+    """Build the data file of a ConfigurationElement, with values or not."""
+    atts = "".join(
+        '    <att name="att%d" type="string" read-only="false">\n%s'
+        '      <description><![CDATA[Attribute %d, revision %d]]></description>\n'
+        '    </att>\n' % (
+            index,
+            '      <value encoded="n"><![CDATA[value %d]]></value>\n' % index if valued else "",
+            index,
+            revision
+        )
+        for index in range(max(1, lines // 4))
+    )
+    return _xml_data(
+        '<config-element id="%s" version="%s">\n'
+        '  <display-name><![CDATA[%s]]></display-name>\n'
+        '  <atts>\n%s  </atts>\n'
+        '</config-element>\n' % (item_id, item_version, name, atts)
+    )
+
+
+def resource_data(item_id: str, name: str, item_version: str, rng: random.Random, size: int, revision: int = 0):
+    """Build the data file of a ResourceElement: a nested zip with a binary content."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_data:
+        zip_data.writestr('VSO-RESOURCE-INF/attribute_id', item_id)
+        zip_data.writestr('VSO-RESOURCE-INF/attribute_name', name)
+        zip_data.writestr('VSO-RESOURCE-INF/attribute_version', item_version)
+        zip_data.writestr('VSO-RESOURCE-INF/attribute_mimetype', 'application/octet-stream')
+        zip_data.writestr('VSO-RESOURCE-INF/data', rng.getrandbits(size * 8).to_bytes(size, 'little'))
+    return buffer.getvalue()
+
+
+def unsupported_data(item_id: str, name: str, item_version: str, rng: random.Random, lines: int, revision: int = 0):
+    """Build the data file of an element type that is not supported by the diff tool."""
+    return _xml_data('<web-view id="%s" name="%s" version="%s"/>\n' % (item_id, name, item_version))
+
+
+class GeneratedElement():
+    """An element of the generated packages."""
+
+    def __init__(self, rng: random.Random, item_type: str, index: int, lines: int, resource_size: int,
+                 valued: bool = False):
+        """Build a new element.
+
+        Args:
+            rng (random.Random): Random generator.
+            item_type (str): Type of element (as in the ``info`` file).
+            index (int): Index of the element, used in its name.
+            lines (int): Approximate number of lines of script or attributes.
+            resource_size (int): Size of the content of a ResourceElement.
+            valued (bool, optional): Add values to a ConfigurationElement. Defaults to False.
+        """
+        self.id = str(uuid.UUID(int=rng.getrandbits(128)))
+        self.type = item_type
+        self.name = "%s_%d" % (item_type.lower(), index)
+        self.lines = lines
+        self.resource_size = resource_size
+        self.valued = valued
+        self.seed = rng.getrandbits(32)
+
+    def files(self, item_version: str = "1.0.0", revision: int = 0):
+        """Build the files of the element.
+
+        Args:
+            item_version (str, optional): Version of the element. Defaults to "1.0.0".
+            revision (int, optional): Revision of the content. Defaults to 0.
+
+        Returns:
+            dict: the content of each file of the element folder.
+        """
+        rng = random.Random(self.seed + revision)
+        if self.type == "Workflow":
+            data = workflow_data(self.id, self.name, item_version, rng, self.lines, revision)
+        elif self.type == "ScriptModule":
+            data = action_data(self.id, self.name, item_version, rng, self.lines, revision)
+        elif self.type == "ConfigurationElement":
+            data = configuration_data(self.id, self.name, item_version, rng, self.lines, revision, self.valued)
+        elif self.type == "ResourceElement":
+            data = resource_data(self.id, self.name, item_version, rng, self.resource_size, revision)
+        else:
+            data = unsupported_data(self.id, self.name, item_version, rng, self.lines, revision)
+        return {
+            "info": INFO_TEMPLATE % (self.type, self.id),
+            "data": data,
+            "categories": "<categories/>",
+        }
+
+
+def _write_package(path: str, elements: list):
+    """Write a package file from (element, files) tuples."""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr('dunes-meta-inf', META_INF)
+        for element, files in elements:
+            for file_name, content in files.items():
+                zip_ref.writestr('elements/%s/%s' % (element.id, file_name), content)
+
+
+def generate_packages(reference_path: str, compared_path: str, elements: int = 100, mix: dict = None,
+                      change_rate: float = 0.1, values_rate: float = 0.2, lines: int = 40,
+                      resource_size: int = 4096, seed: int = 0):
+    """Generate a reference package and a compared package with some changes.
+
+    Args:
+        reference_path (str): Path of the reference package file.
+        compared_path (str): Path of the compared package file.
+        elements (int, optional): Number of elements in the reference package. Defaults to 100.
+        mix (dict, optional): Share of each element type. Defaults to ELEMENT_MIX.
+        change_rate (float, optional): Share of the elements changed in the compared package (with
+            an upgrade, a conflict, a removal or a new element). Defaults to 0.1.
+        values_rate (float, optional): Share of the ConfigurationElements with values. Defaults to 0.2.
+        lines (int, optional): Approximate number of lines of script or attributes. Defaults to 40.
+        resource_size (int, optional): Size of the content of ResourceElements. Defaults to 4096.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+
+    Returns:
+        dict: expected number of elements of the compared package by import state, with the
+            number of ``removed`` and ``unexpected_values`` elements.
+    """
+    rng = random.Random(seed)
+    mix = mix or ELEMENT_MIX
+    types, weights = list(mix), list(mix.values())
+    expected = dict.fromkeys(
+        ['no_upgrade', 'upgrade', 'conflict', 'new', 'unsupported', 'unexpected_values', 'removed'], 0
+    )
+
+    def new_element(index):
+        item_type = rng.choices(types, weights)[0]
+        return GeneratedElement(rng, item_type, index, lines, resource_size,
+                                valued=item_type == "ConfigurationElement" and rng.random() < values_rate)
+
+    reference, compared = [], []
+    for index in range(elements):
+        element = new_element(index)
+        reference.append((element, element.files()))
+        change = rng.choice(CHANGES) if rng.random() < change_rate else None
+        if change == "removed":
+            expected['removed'] += 1
+            continue
+        if change == "upgrade":
+            compared.append((element, element.files("1.0.1", revision=1)))
+        elif change == "conflict":
+            compared.append((element, element.files("1.0.0", revision=1)))
+        else:
+            compared.append((element, reference[-1][1]))
+        states = [(element, change if change in ('upgrade', 'conflict') else 'no_upgrade')]
+        if change == "new":
+            element = new_element(elements + index)
+            compared.append((element, element.files()))
+            states.append((element, 'new'))
+        for element, state in states:
+            if element.type not in SUPPORTED_ELEMENT_TYPES:
+                state = 'unsupported'
+            elif element.valued:
+                expected['unexpected_values'] += 1
+            expected[state] += 1
+    _write_package(reference_path, reference)
+    _write_package(compared_path, compared)
+    return expected
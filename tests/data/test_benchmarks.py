@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of `vro_package_diff` on synthetic packages.
+
+The package sizes (number of elements) are set by the ``VRO_DIFF_BENCHMARK_SIZES`` environment
+variable, as a comma separated list: only small packages are used by default. Run the benchmarks
+with ``pytest -s tests/data/test_benchmarks.py`` to print the timings.
+"""
+
+import os
+import time
+
+import pytest
+
+from .package_generator import generate_packages
+
+
+SIZES = [int(size) for size in os.environ.get("VRO_DIFF_BENCHMARK_SIZES", "10,200").split(",")]
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda size: "%d-elements" % size)
+def packages(request, tmp_path_factory):
+    """Generate a reference and a compared package for each benchmark size."""
+    folder = tmp_path_factory.mktemp("packages")
+    reference, compared = str(folder / "reference.package"), str(folder / "compared.package")
+    expected = generate_packages(reference, compared, elements=request.param, change_rate=0.2)
+    return reference, compared, expected
+
+
+def _compared_elements(expected: dict):
+    """Get the number of elements of the compared package."""
+    return sum(expected[state] for state in ('no_upgrade', 'upgrade', 'conflict', 'new', 'unsupported'))
+
+
+def _report(name: str, elements: int, duration: float):
+    """Print the timing of a benchmark."""
+    print("\n%-26s %6d elements: %8.1f ms (%6.1f us/element)" % (
+        name, elements, duration * 1e3, duration * 1e6 / max(1, elements)))
+
+
+def test_benchmark_get_vroitems_from_package(packages):
+    """Benchmark the reading of a package."""
+    from vro_package_diff.__main__ import get_vroitems_from_package
+    reference, compared, expected = packages
+    start = time.perf_counter()
+    items = get_vroitems_from_package(compared)
+    _report("get_vroitems_from_package", len(items), time.perf_counter() - start)
+    assert len(items) == _compared_elements(expected)
+
+
+def test_benchmark_diff_vro_items(packages, monkeypatch):
+    """Benchmark the comparison of the items of two packages."""
+    from vro_package_diff import __main__
+    from vro_package_diff.__main__ import diff_vro_items, get_vroitems_from_package
+    monkeypatch.setattr(__main__, "table_pprint", lambda *args, **kwargs: None)
+    reference, compared, expected = packages
+    items_src, items_dst = get_vroitems_from_package(reference), get_vroitems_from_package(compared)
+    start = time.perf_counter()
+    lists_of_items_by_state = diff_vro_items(items_src, items_dst, reference, compared)
+    _report("diff_vro_items", len(items_dst), time.perf_counter() - start)
+    assert {state: len(items) for state, items in lists_of_items_by_state.items()} == expected
+
+
+def _nested_loop_states(items_src: list, items_dst: list):
+    """Classify the items with the nested loops used before the items were indexed by id."""
+    from vro_package_diff.engine import item_state
+    states = {}
+    for idst in items_dst:
+        isrc = None
+        for item in items_src:
+            if item.id == idst.id:
+                isrc = item
+                break
+        states.setdefault(item_state(isrc, idst), []).append(idst.id)
+    for isrc in items_src:
+        if not any(idst.id == isrc.id for idst in items_dst):
+            states.setdefault('removed', []).append(isrc.id)
+    return states
+
+
+def test_benchmark_matching(packages):
+    """Benchmark the matching of the items by id against the former nested loops: both give the same states."""
+    from vro_package_diff.engine import classify_vro_items
+    from vro_package_diff.__main__ import get_vroitems_from_package
+    reference, compared, expected = packages
+    items_src, items_dst = get_vroitems_from_package(reference), get_vroitems_from_package(compared)
+    start = time.perf_counter()
+    nested_states = _nested_loop_states(items_src, items_dst)
+    _report("matching (nested loops)", len(items_dst), time.perf_counter() - start)
+    start = time.perf_counter()
+    lists_of_items_by_state = classify_vro_items(items_src, items_dst, reference, compared, empty_config=False)
+    _report("matching (index by id)", len(items_dst), time.perf_counter() - start)
+    indexed_states = {
+        state: [vro_item.id for vro_item in vro_items]
+        for state, vro_items in lists_of_items_by_state.items() if vro_items and state != 'unexpected_values'
+    }
+    assert indexed_states == nested_states
+
+
+def test_benchmark_create_diff_file(packages, tmp_path):
+    """Benchmark the generation of the diff files of the changed items."""
+    from vro_package_diff.__main__ import create_diff_file, get_vroitems_from_package
+    reference, compared, expected = packages
+    items_src = {item.id: item for item in get_vroitems_from_package(reference)}
+    changed = [
+        (items_src[item.id], item) for item in get_vroitems_from_package(compared)
+        if item.id in items_src and item.checksum != items_src[item.id].checksum
+    ]
+    start = time.perf_counter()
+    for src_elt, dst_elt in changed:
+        create_diff_file(src_elt, dst_elt, reference, compared, str(tmp_path), "conflict")
+    _report("create_diff_file", len(changed), time.perf_counter() - start)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_benchmark_cli(packages, tmp_path, jobs):
+    """Benchmark the full command line, with the diff files generation."""
+    from click.testing import CliRunner
+    from vro_package_diff.__main__ import cli
+    reference, compared, expected = packages
+    start = time.perf_counter()
+    result = CliRunner().invoke(cli, [
+        "-r", reference, "--test", "--empty-config", "--jobs", str(jobs), "--log-level", "off",
+        "--diff", str(tmp_path), compared
+    ])
+    _report("cli (%d jobs)" % jobs, _compared_elements(expected), time.perf_counter() - start)
+    assert result.exit_code == expected['conflict'] + expected['unexpected_values']
@@ -21,3 +21,821 @@ def test_content(response):
     """Sample pytest test function with the pytest fixture as an argument."""
     # from bs4 import BeautifulSoup
     # assert 'GitHub' in BeautifulSoup(response.content).title.string
+
+
+@pytest.fixture(autouse=True)
+def package_logger():
+    """Restore the handlers, level and propagation of the package logger, changed by configure_logging."""
+    import logging
+    logger = logging.getLogger("vro_package_diff")
+    handlers, level, propagate = logger.handlers[:], logger.level, logger.propagate
+    yield logger
+    for handler in logger.handlers[:]:
+        if handler not in handlers:
+            logger.removeHandler(handler)
+            handler.close()
+    for handler in handlers:
+        if handler not in logger.handlers:
+            logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = propagate
+
+
+def _action(item_id: str, item_version: str = "0.0.1", body: str = ""):
+    """Build an Action VROElementMetadata from synthetic content."""
+    from vro_package_diff.vro_element import VROElementMetadata
+    xml_info = b'<properties><entry key="type">ScriptModule</entry></properties>'
+    data = (
+        '<?xml version="1.0" encoding="UTF-16"?>'
+        '<dunes-script-module name="%s" version="%s"><script>%s</script></dunes-script-module>'
+    ) % (item_id, item_version, body)
+    return VROElementMetadata(item_id, xml_info, b'\xfe\xff' + data.encode('utf-16-be'))
+
+
+@pytest.fixture
+def no_table(monkeypatch):
+    """Disable the table output of diff_vro_items."""
+    from vro_package_diff import __main__
+    monkeypatch.setattr(__main__, "table_pprint", lambda *args, **kwargs: None)
+
+
+def test_diff_vro_items_states(no_table):
+    """Check the import state of items, including items only in the reference package."""
+    from vro_package_diff.__main__ import diff_vro_items
+    items_src = [_action("a"), _action("b"), _action("c"), _action("d", "0.0.2"), _action("old")]
+    items_dst = [_action("a"), _action("b", "0.0.2"), _action("c", body="x"), _action("d"), _action("e")]
+    states = diff_vro_items(items_src, items_dst, "ref", "cmp")
+    assert [i.id for i in states['no_upgrade']] == ["a"]
+    assert [i.id for i in states['upgrade']] == ["b"]
+    assert [i.id for i in states['conflict']] == ["c", "d"]
+    assert [i.id for i in states['new']] == ["e"]
+    assert [i.id for i in states['removed']] == ["old"]
+
+
+def test_diff_vro_items_many_items(no_table):
+    """Check the matching of synthetic packages with many items, in both directions."""
+    from vro_package_diff.__main__ import diff_vro_items
+    items_src = [_action("item-%05d" % i) for i in range(2000)]
+    items_dst = [_action("item-%05d" % i) for i in range(1000, 3000)]
+    states = diff_vro_items(items_src, items_dst, "ref", "cmp")
+    assert len(states['no_upgrade']) == 1000
+    assert len(states['new']) == 1000
+    assert len(states['removed']) == 1000
+
+
+def test_table_shows_removed_items(capsys):
+    """Check that the items only in the reference package are shown in the table and in the legend."""
+    from vro_package_diff.__main__ import classify_vro_items, legend_print, table_pprint
+    states = classify_vro_items([_action("a"), _action("old", "0.0.3")], [_action("a")], "ref", "cmp")
+    table_pprint(states, ascii=True, colorized=False)
+    legend_print(ascii=True, colorized=False)
+    output = capsys.readouterr().out
+    row = next(line for line in output.splitlines() if "| old " in line)
+    assert [cell.strip() for cell in row.strip("|").split("|")] == ["old", "old", "Action", "0.0.3", "", "[-]"]
+    assert "[-]  Items only in the reference package" in output
+
+
+def test_package_reader_index():
+    """Check that the package reader groups the zip entries by element id."""
+    import os
+    from vro_package_diff.package import VROPackageReader
+    package = os.path.join(os.path.dirname(__file__), "package_v1.0.package")
+    with VROPackageReader(package) as reader:
+        assert len(reader.entries) == 10
+        assert all('info' in files and 'data' in files for files in reader.entries.values())
+        items = list(reader.iter_elements())
+    assert [item.id for item in items] == list(reader.entries)
+    assert {item.type for item in items} == {"Action", "Workflow", "ConfigurationElement", "ResourceElement"}
+
+
+def test_unsupported_element_data_is_not_read():
+    """Check that the data of unsupported elements is never loaded."""
+    from vro_package_diff.vro_element import VROElementMetadata
+
+    def data_loader():
+        raise AssertionError("data should not be read")
+
+    xml_info = b'<properties><entry key="type">Unknown</entry></properties>'
+    assert VROElementMetadata("x", xml_info, data_loader).type == "Unsupported"
+
+
+def test_package_reader_jobs():
+    """Check that elements built by worker processes match the ones built in the current process."""
+    import os
+    from vro_package_diff.package import iter_vroitems_from_package
+    package = os.path.join(os.path.dirname(__file__), "package_v1.0.package")
+    items = list(iter_vroitems_from_package(package))
+    items_from_pool = list(iter_vroitems_from_package(package, jobs=2))
+    assert [item.summary() for item in items_from_pool] == [item.summary() for item in items]
+    for item, item_from_pool in zip(items, items_from_pool):
+        assert item_from_pool.dec_data_content == item.dec_data_content
+
+
+def test_create_diff_files_jobs(tmp_path, no_table):
+    """Check that diff files generated by worker processes match the serial generation."""
+    import os
+    from vro_package_diff.__main__ import diff_vro_items, get_vroitems_from_package
+    folder = os.path.dirname(__file__)
+    items_src = get_vroitems_from_package(os.path.join(folder, "package_v1.0.package"))
+    items_dst = get_vroitems_from_package(os.path.join(folder, "package_v1.1.package"))
+    outputs = []
+    for jobs in (1, 2):
+        diff_folder = tmp_path / str(jobs)
+        diff_vro_items(items_src, items_dst, "ref", "cmp", diff_folder=str(diff_folder), jobs=jobs)
+        outputs.append({
+            path.relative_to(diff_folder): path.read_text(encoding='utf-8')
+            for path in diff_folder.glob("**/*.diff")
+        })
+    assert len(outputs[0]) == 10
+    assert outputs[0] == outputs[1]
+
+
+def test_identical_elements_are_not_read(monkeypatch, no_table):
+    """Check that elements identical to the reference package are classified without being read."""
+    import os
+    from vro_package_diff.__main__ import diff_vro_items, get_vroitems_from_package
+    from vro_package_diff.package import VROPackageReader
+    package = os.path.join(os.path.dirname(__file__), "package_v1.0.package")
+    items_src = get_vroitems_from_package(package)
+
+    def read(self, item_id, file_name):
+        raise AssertionError("%s should not be read" % item_id)
+
+    monkeypatch.setattr(VROPackageReader, "read", read)
+    items_dst = get_vroitems_from_package(package, reference_items=items_src)
+    assert [item.summary() for item in items_dst] == [item.summary() for item in items_src]
+    states = diff_vro_items(items_src, items_dst, "ref", "cmp", empty_config=False)
+    assert len(states['no_upgrade']) == len(items_src)
+
+
+def test_read_header_stops_early():
+    """Check that the header of an element is read without parsing the rest of its content."""
+    from vro_package_diff.vro_element import VROElementMetadata
+    xml_info = b'<properties><entry key="type">Workflow</entry></properties>'
+    data = (
+        '<?xml version="1.0" encoding="UTF-16"?>'
+        '<workflow xmlns="http://vmware.com/vco/workflow" version="1.2.3">'
+        '<display-name><![CDATA[WF_big]]></display-name>'
+        '<script>%s</script><broken>'
+    ) % ("System.log('x');\n" * 100000)
+    item = VROElementMetadata("wf", xml_info, b'\xfe\xff' + data.encode('utf-16-be'))
+    assert item.name == "WF_big"
+    assert str(item.version) == "1.2.3"
+
+
+def test_detect_encoding():
+    """Check the encoding detection of plain contents."""
+    from vro_package_diff.vro_element import detect_encoding
+    assert detect_encoding(b'\xfe\xff\x00<') == 'utf-16-be'
+    assert detect_encoding(b'\xff\xfe<\x00') == 'utf-16-le'
+    assert detect_encoding('<a/>'.encode('utf-16-be')) == 'utf-16-be'
+    assert detect_encoding(b'<note/>\n') == 'utf-8'
+
+
+def test_decode_released_content():
+    """Check that a content released from memory (maybe by another thread) is read again to be decoded."""
+    from vro_package_diff.vro_element import VROElementMetadata
+    content = _action("a", body="x").data_content
+    item = VROElementMetadata("a", b'<properties><entry key="type">ScriptModule</entry></properties>',
+                              lambda: content)
+    item.release_content()
+    assert item._data_content is None
+    assert "<script>x</script>" in item.u_decode_plain_content()
+
+
+def test_content_memory_budget(monkeypatch):
+    """Check that decoded contents are memoized and released beyond the memory budget."""
+    from vro_package_diff import vro_element
+    monkeypatch.setattr(vro_element, "CONTENT_BUDGET", vro_element.ContentMemoryBudget(4096))
+    items = [_action("item-%d" % i, body="x" * 1000) for i in range(10)]
+    assert items[-1].dec_data_content is items[-1].dec_data_content
+    assert vro_element.CONTENT_BUDGET.size <= 4096
+    # content of the first items was released, and is decoded again on demand
+    assert items[0]._dec_data_content is vro_element._NOT_DECODED
+    assert items[0].dec_data_content == items[1].dec_data_content.replace("item-1", "item-0")
+
+
+def test_package_cache(tmp_path, monkeypatch):
+    """Check that cached package items match the items read from the package."""
+    import os
+    from vro_package_diff.__main__ import get_vroitems_from_package
+    from vro_package_diff.cache import PackageCache
+    from vro_package_diff.package import VROPackageReader
+    package = os.path.join(os.path.dirname(__file__), "package_v1.0.package")
+    cache = PackageCache(str(tmp_path))
+    items = get_vroitems_from_package(package, cache=cache)
+    monkeypatch.setattr(VROPackageReader, "iter_elements", None)
+    cached_items = get_vroitems_from_package(package, cache=cache)
+    assert [item.summary() for item in cached_items] == [item.summary() for item in items]
+    assert [item.fingerprint for item in cached_items] == [item.fingerprint for item in items]
+    assert [item.valued_items for item in cached_items] == [item.valued_items for item in items]
+    assert cached_items[-1].dec_data_content == items[-1].dec_data_content
+    from concurrent.futures import ThreadPoolExecutor
+
+    def use_cache(position):
+        cache.put("thread-%d" % (position % 4), items)
+        return cache.get("thread-%d" % (position % 4))
+    with ThreadPoolExecutor(max_workers=8) as threads:
+        assert all(len(thread_items) == len(items) for thread_items in threads.map(use_cache, range(64)))
+    cache.close()
+    monkeypatch.undo()
+    from click.testing import CliRunner
+    from vro_package_diff.__main__ import cli
+    result = CliRunner().invoke(cli, ["-r", package, "--cache-dir", str(tmp_path), "--test", package,
+                                      "--log-file", str(tmp_path / "diff.log")])
+    assert result.exit_code == 0, result.output
+
+
+def test_cli_many_packages(tmp_path):
+    """Check the aggregated exit code when comparing several packages with the same reference."""
+    import os
+    import shutil
+    import click
+    from click.testing import CliRunner
+    from vro_package_diff.__main__ import cli, expand_packages
+    folder = os.path.dirname(__file__)
+    result = CliRunner().invoke(cli, [
+        "-r", os.path.join(folder, "package_v1.0.package"), "--test", "--ascii", "--no_color",
+        os.path.join(folder, "package_v1.*.package"), os.path.join(folder, "package_v1.1.package"),
+        "--log-file", str(tmp_path / "diff.log")
+    ])
+    assert result.exit_code == 5
+    assert result.output.count("Diff betwenn packages: ") == 2
+    literal = str(tmp_path / "package_v1.1[rc].package")
+    shutil.copyfile(os.path.join(folder, "package_v1.1.package"), literal)
+    assert expand_packages((str(tmp_path / "*.package"), literal)) == [literal]
+    with pytest.raises(click.BadParameter):
+        expand_packages((str(tmp_path / "missing[rc].package"),))
+
+
+def test_directory_reader(tmp_path):
+    """Check that an unpacked package folder gives the same items than the package file."""
+    import os
+    import zipfile
+    from click.testing import CliRunner
+    from vro_package_diff.__main__ import cli, get_vroitems_from_package
+    folder = os.path.dirname(__file__)
+    package = os.path.join(folder, "package_v1.1.package")
+    package_folder = str(tmp_path / "package")
+    with zipfile.ZipFile(package) as zip_ref:
+        zip_ref.extractall(package_folder)
+    items = get_vroitems_from_package(package)
+    items_from_folder = get_vroitems_from_package(package_folder)
+    assert sorted(item.summary() for item in items_from_folder) == sorted(item.summary() for item in items)
+    result = CliRunner().invoke(cli, ["-r", os.path.join(folder, "package_v1.0.package"), "--test", package_folder,
+                                      "--log-file", str(tmp_path / "diff.log")])
+    assert result.exit_code == 5
+
+
+def test_compact_elements(monkeypatch):
+    """Check that elements have no instance dict and read their content again when released."""
+    import os
+    from vro_package_diff import vro_element
+    from vro_package_diff.__main__ import get_vroitems_from_package
+    from vro_package_diff.profiling import MemoryReport, phase
+    monkeypatch.setattr(vro_element, "CONTENT_BUDGET", vro_element.ContentMemoryBudget(0))
+    package = os.path.join(os.path.dirname(__file__), "package_v1.0.package")
+    with MemoryReport() as report:
+        with phase("read"):
+            items = get_vroitems_from_package(package)
+    assert [row[0] for row in report.table_data()[1:2]] == ["read"]
+    with MemoryReport() as report:
+        with phase("outer"):
+            with phase("before"):
+                buffer = bytearray(4 * 1048576)
+                del buffer
+            with phase("inner"):
+                pass
+    peaks = {name: peak for name, current, peak in report.phases}
+    assert peaks["outer"] >= peaks["before"] >= 4 * 1048576 > peaks["inner"]
+    assert not hasattr(items[0], '__dict__')
+    assert sum(item._data_content is not None for item in items) == 1
+    assert items[0].dec_data_content.lstrip('\ufeff').startswith("<?xml")
+
+
+def test_cli_streaming_formats(tmp_path):
+    """Check that the machine-readable formats give one record per compared element."""
+    import csv
+    import io
+    import json
+    import os
+    from click.testing import CliRunner
+    from vro_package_diff.__main__ import cli
+    folder = os.path.dirname(__file__)
+    args = ["-r", os.path.join(folder, "package_v1.0.package"), "--test", os.path.join(folder, "package_v1.1.package"),
+            "--log-file", str(tmp_path / "diff.log")]
+    jsonl = CliRunner().invoke(cli, args + ["--format", "jsonl"])
+    records = [json.loads(line) for line in jsonl.output.splitlines()]
+    assert jsonl.exit_code == 5
+    assert sum(record["state"] == "conflict" for record in records) == 5
+    assert json.loads(CliRunner().invoke(cli, args + ["--format", "json"]).output) == records
+    rows = list(csv.DictReader(io.StringIO(CliRunner().invoke(cli, args + ["--format", "csv"]).output)))
+    assert [row["id"] for row in rows] == [record["id"] for record in records]
+
+
+def test_cli_import_time():
+    """Benchmark the CLI import with ``python -X importtime``, and check that optional modules are deferred."""
+    import subprocess
+    import sys
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import vro_package_diff.__main__"],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True
+    ).stderr
+    imported = {line.split("|")[-1].strip(): int(line.split("|")[1]) for line in output.splitlines()[1:]}
+    print("Import time of vro_package_diff.__main__: %d us" % imported["vro_package_diff.__main__"])
+    deferred = ("colored", "terminaltables", "sqlite3", "concurrent.futures", "concurrent.futures.process",
+                "tracemalloc", "csv", "json", "mmap", "tempfile", "difflib")
+    assert [module for module in deferred if module in imported] == []
+
+
+def test_logging_overhead(tmp_path, monkeypatch):
+    """Benchmark the logging overhead per element, and check that disabled messages are not formatted."""
+    import time
+    from vro_package_diff import vro_element
+    from vro_package_diff.__main__ import classify_vro_items, configure_logging
+    items_src = [_action("item-%d" % i) for i in range(2000)]
+    items_dst = [_action("item-%d" % i, "0.0.2") for i in range(2000)]
+    formatted = []
+    monkeypatch.setattr(vro_element.VROElementMetadata, "__str__", lambda self: formatted.append(self) or self.id)
+    timings = {}
+    for level in ("debug", "off"):
+        configure_logging(level, str(tmp_path / "diff.log"))
+        start = time.perf_counter()
+        classify_vro_items(items_src, items_dst, "a", "b")
+        timings[level] = (time.perf_counter() - start) / len(items_dst)
+        if level == "off":
+            assert not formatted
+        formatted.clear()
+    print("Per element: %.1f us with DEBUG logs, %.1f us without logs" % (
+        timings["debug"] * 1e6, timings["off"] * 1e6))
+    assert "item-0 is IN source package" in (tmp_path / "diff.log").read_text()
+
+
+def test_profiler(tmp_path):
+    """Check the time of each step, the elements by type and the slowest elements of a profiled run."""
+    import os
+    import pstats
+    from vro_package_diff.__main__ import classify_vro_items, get_vroitems_from_package
+    from vro_package_diff.profiling import Profiler, phase
+    folder = os.path.dirname(__file__)
+    reference, compared = os.path.join(folder, "package_v1.0.package"), os.path.join(folder, "package_v1.1.package")
+    with Profiler(slowest=3, pstats_file=str(tmp_path / "run.pstats")) as profiler:
+        with phase("compare"):
+            items_src = get_vroitems_from_package(reference)
+            classify_vro_items(items_src, get_vroitems_from_package(compared), reference, compared,
+                               diff_folder=str(tmp_path))
+    assert [row[0] for row in profiler.table_data()[1:]] == ["compare"]
+    steps = {row[0] for row in profiler.steps_table_data()[1:]}
+    assert steps == {"Zip read", "Element parse", "Matching", "Diff files"}
+    assert dict((row[0], row[1]) for row in profiler.types_table_data()[1:])["Workflow"] == 3
+    slowest = profiler.slowest_table_data()[1:]
+    assert len(slowest) == 3 and all(row[2] for row in slowest)
+    assert [float(row[3]) for row in slowest] == sorted((float(row[3]) for row in slowest), reverse=True)
+    assert pstats.Stats(str(tmp_path / "run.pstats")).total_calls
+
+
+def test_diff_engines(monkeypatch):
+    """Check that the Myers engine finds a diff as short as difflib, and that both can be interrupted."""
+    import difflib
+    import itertools
+    import random
+    import types
+    from vro_package_diff import diff_engine
+    from vro_package_diff.diff_engine import DiffTimeout, difflib_opcodes, myers_opcodes, unified_diff
+    rng = random.Random(0)
+    src = ["line %d\n" % rng.randrange(20) for _ in range(200)]
+    dst = [line for line in src if rng.random() > 0.1] + ["line %d\n" % rng.randrange(20) for _ in range(10)]
+    assert unified_diff(src, dst, "a", "b", engine="difflib") == list(difflib.unified_diff(src, dst, "a", "b"))
+    matched = {}
+    for opcodes_function in (myers_opcodes, difflib_opcodes):
+        opcodes = opcodes_function(src, dst)
+        patched = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal':
+                assert src[i1:i2] == dst[j1:j2]
+            patched.extend(dst[j1:j2])
+        assert patched == dst
+        matched[opcodes_function] = sum(i2 - i1 for tag, i1, i2, j1, j2 in opcodes if tag == 'equal')
+    assert matched[myers_opcodes] >= matched[difflib_opcodes]
+    assert unified_diff(src, src) == []
+    with pytest.raises(DiffTimeout):
+        unified_diff(src, dst, deadline=0)
+    # the deadline expires while difflib searches the matching blocks
+    clock = itertools.count()
+    monkeypatch.setattr(diff_engine, "time", types.SimpleNamespace(monotonic=lambda: next(clock)))
+    with pytest.raises(DiffTimeout):
+        difflib_opcodes(src, dst, deadline=2)
+    assert next(clock) == 4
+
+
+def test_myers_large_edit_distance(tmp_path):
+    """Check that the Myers engine uses linear memory on reordered lines, and stops beyond the edits limit."""
+    import random
+    import tracemalloc
+    from vro_package_diff.diff import write_diff_file
+    from vro_package_diff.diff_engine import DiffTooLarge, myers_opcodes
+    rng = random.Random(0)
+    src = ["line %d\n" % i for i in range(200)]
+    dst = rng.sample(src, len(src))
+    tracemalloc.start()
+    try:
+        opcodes = myers_opcodes(src, dst)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 512 * 1024
+    assert [line for tag, i1, i2, j1, j2 in opcodes for line in dst[j1:j2]] == dst
+    src = ["line %d\n" % i for i in range(5000)]
+    dst = rng.sample(src, len(src))
+    with pytest.raises(DiffTooLarge):
+        myers_opcodes(src, dst, max_edits=1000)
+    diff_file = tmp_path / "element.diff"
+    write_diff_file("".join(src), "".join(dst), "ref", "cmp", str(diff_file), engine="myers", max_edits=1000)
+    assert "no line diff (more than 1000 edited lines)" in diff_file.read_text(encoding='utf-8')
+
+
+def test_diff_file_size_limit(tmp_path):
+    """Check that the diff file of too large contents only tells that they differ."""
+    from vro_package_diff.diff import write_diff_file
+    diff_file = tmp_path / "element.diff"
+    write_diff_file("a\nb\n", "a\nc\nd\n", "ref", "cmp", str(diff_file), max_size=4)
+    assert diff_file.read_text(encoding='utf-8') == (
+        "--- ref\n+++ cmp\n"
+        "Files differ: 2 lines (4 characters) and 3 lines (6 characters); no line diff "
+        "(contents larger than 4 characters)\n"
+    )
+    write_diff_file("a\nb\n", "a\nc\nd\n", "ref", "cmp", str(diff_file), max_size=0)
+    assert "+c\n" in diff_file.read_text(encoding='utf-8')
+
+
+def test_resource_streaming(tmp_path, monkeypatch):
+    """Check that large binary resources are hashed in chunks, and summarized in diff files."""
+    import hashlib
+    import tracemalloc
+    import zipfile
+    from .package_generator import generate_packages
+    from vro_package_diff import vro_element
+    from vro_package_diff.diff import create_diff_file
+    from vro_package_diff.package import iter_vroitems_from_package
+    monkeypatch.setattr(vro_element, "RESOURCE_SPOOL_SIZE", 256 * 1024)
+    size = 4 * 1024 * 1024
+    reference, compared = str(tmp_path / "reference.package"), str(tmp_path / "compared.package")
+    generate_packages(reference, compared, elements=1, mix={"ResourceElement": 1}, change_rate=1, resource_size=size,
+                      seed=1)
+    tracemalloc.start()
+    try:
+        src, = iter_vroitems_from_package(reference)
+        summary = src.resource_summary()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < size / 2
+    with zipfile.ZipFile(reference) as zip_ref:
+        data = zip_ref.read("elements/%s/data" % src.id)
+    assert (src.checksum, src.data_size) == (hashlib.sha1(data).hexdigest(), len(data))
+    assert summary[:2] == ("application/octet-stream", size) and not summary[3]
+    assert src.data_content is None
+    dst = src.copy()
+    dst.checksum, dst._resource = "1" * 40, ("application/octet-stream", 10, "0" * 40, False)
+    create_diff_file(src, dst, "ref", "cmp", str(tmp_path / "diff"), "conflict")
+    diff_file, = (tmp_path / "diff").glob("**/*.diff")
+    assert "%d bytes (application/octet-stream, SHA-1 %s)" % (size, summary[2]) in diff_file.read_text()
+    diff_file.unlink()
+    create_diff_file(src, src.copy(), "ref", "cmp", str(tmp_path / "diff"), "no_upgrade")
+    dst = src.copy()
+    dst.checksum, dst.data_loader = "0" * 40, None  # another nested zip file with the same resource
+    create_diff_file(src, dst, "ref", "cmp", str(tmp_path / "diff"), "no_upgrade")
+    assert not list((tmp_path / "diff").glob("**/*.diff"))
+
+
+def test_prefetch_and_corrupt_packages(tmp_path):
+    """Check that only the elements that differ are prefetched, and that corrupt packages fail clearly."""
+    import os
+    from click.testing import CliRunner
+    from vro_package_diff.__main__ import cli
+    from vro_package_diff.package import open_package
+    from .package_generator import generate_packages
+    reference, compared = str(tmp_path / "reference.package"), str(tmp_path / "compared.package")
+    expected = generate_packages(reference, compared, elements=50, mix={"Workflow": 1, "ScriptModule": 1},
+                                 change_rate=0.3, seed=2)
+    prefetched = open_package(compared).prefetch_elements(reference_reader=open_package(reference))
+    assert len(prefetched) == expected['upgrade'] + expected['conflict'] + expected['new']
+    folder = os.path.dirname(__file__)
+    corrupt = tmp_path / "corrupt.package"
+    with open(os.path.join(folder, "package_v1.1.package"), 'rb') as package_file:
+        corrupt.write_bytes(package_file.read(5000))
+    for args in ([str(corrupt)], ["-j", "2", str(corrupt)]):
+        result = CliRunner().invoke(cli, ["-r", os.path.join(folder, "package_v1.0.package"),
+                                          "--log-file", str(tmp_path / "diff.log")] + args)
+        assert result.exit_code == 1
+        assert "Cannot open package %s" % corrupt in result.output
+
+
+def test_mapped_stored_members(tmp_path, no_table):
+    """Check that members stored without compression are read from the mapped package without a copy."""
+    import os
+    import zipfile
+    from vro_package_diff.__main__ import diff_vro_items, get_vroitems_from_package
+    from vro_package_diff.package import open_package
+    folder = os.path.dirname(__file__)
+    results = []
+    for version in ("1.0", "1.1"):
+        package = os.path.join(folder, "package_v%s.package" % version)
+        stored = str(tmp_path / os.path.basename(package))
+        with zipfile.ZipFile(package) as zip_ref, zipfile.ZipFile(stored, 'w', zipfile.ZIP_STORED) as zip_stored:
+            for zip_info in zip_ref.infolist():
+                content = zip_ref.read(zip_info)
+                zip_info.compress_type = zipfile.ZIP_STORED
+                zip_stored.writestr(zip_info, content)
+        results.append((get_vroitems_from_package(package), get_vroitems_from_package(stored)))
+    for items, stored_items in results:
+        assert [vro_item.summary() for vro_item in items] == [vro_item.summary() for vro_item in stored_items]
+        workflow = next(vro_item for vro_item in stored_items if vro_item.type == "Workflow")
+        assert isinstance(workflow.data_content, memoryview)
+        assert workflow.dec_data_content == next(vro_item for vro_item in items if vro_item.id == workflow.id
+                                                 ).dec_data_content
+    (src, stored_src), (dst, stored_dst) = results
+    states = [
+        {state: [vro_item.id for vro_item in vro_items]
+         for state, vro_items in diff_vro_items(*items, "ref", "cmp").items()}
+        for items in ((src, dst), (stored_src, stored_dst))
+    ]
+    assert states[0] == states[1]
+    with open_package(str(tmp_path / "package_v1.0.package")) as reader:
+        vro_items = list(reader.build_elements(list(reader.entries)))
+    assert all(vro_item.data_content is not None for vro_item in vro_items if vro_item.type == "Action")
+
+
+def test_changed_mapped_package(tmp_path):
+    """Check that a mapped package rewritten while it is read raises an error instead of crashing."""
+    import os
+    import shutil
+    from vro_package_diff.package import open_package, PackageReadError
+    package = str(tmp_path / "package_v1.0.package")
+    shutil.copyfile(os.path.join(os.path.dirname(__file__), "package_v1.0.package"), package)
+    with open_package(package) as reader:
+        vro_item = next(reader.build_elements(list(reader.entries)))
+        vro_item.release_content()
+        with open(package, 'r+b') as package_file:
+            package_file.truncate(100)
+        with pytest.raises(PackageReadError, match="changed while it was read"):
+            vro_item.data_content
+    with open_package(os.path.join(os.path.dirname(__file__), "package_v1.0.package"), map_files=False) as reader:
+        assert reader.mapping is None and next(reader.build_elements(list(reader.entries))).data_content
+
+
+def test_readers_are_closed(monkeypatch, no_table):
+    """Check that the readers only used to decide what to read are closed after use."""
+    import os
+    import zipfile
+    from concurrent.futures import Future
+    from vro_package_diff.engine import check_package, compare_package, get_vroitems_from_package
+    from vro_package_diff.package import PackageReadError, VROPackageReader, iter_vroitems_from_package
+    folder = os.path.dirname(__file__)
+    reference, compared = os.path.join(folder, "package_v1.0.package"), os.path.join(folder, "package_v1.1.package")
+    items_src = get_vroitems_from_package(reference)
+    readers = {}
+    init, close = VROPackageReader.__init__, VROPackageReader.close
+    monkeypatch.setattr(VROPackageReader, "__init__",
+                        lambda self, *args, **kwargs: readers.setdefault(self, False) or init(self, *args, **kwargs))
+    monkeypatch.setattr(VROPackageReader, "close", lambda self: readers.update({self: True}) or close(self))
+    future = Future()
+    future.set_result(items_src)
+    compare_package(future, reference, compared)
+    assert [closed for reader, closed in readers.items() if reader.package == reference] == [True]
+    readers.clear()
+    counts, first_item = check_package(reference, compared, empty_config=True)
+    assert counts['conflict'] and first_item is not None
+    assert list(readers.values()) == [True, True]
+    readers.clear()
+
+    def corrupt_read(self, item_id, file_name):
+        raise zipfile.BadZipFile("Bad CRC-32 for file %s" % file_name)
+
+    monkeypatch.setattr(VROPackageReader, "read", corrupt_read)
+    with pytest.raises(PackageReadError):
+        list(iter_vroitems_from_package(compared))
+    assert list(readers.values()) == [True]
+
+
+def test_package_diff_engine(tmp_path, capsys, monkeypatch):
+    """Check that the engine returns the CLI results without printing, and reuses the reference items."""
+    import os
+    import shutil
+    from vro_package_diff import engine
+    from vro_package_diff.diff import DiffOptions
+    from vro_package_diff.engine import PackageDiffEngine
+    from vro_package_diff.package import ElementFilter
+    folder = os.path.dirname(__file__)
+    reference = str(tmp_path / "package_v1.0.package")
+    shutil.copyfile(os.path.join(folder, "package_v1.0.package"), reference)
+    compared = os.path.join(folder, "package_v1.1.package")
+    reads = []
+    read_reference_package = engine.read_reference_package
+    monkeypatch.setattr(engine, "read_reference_package",
+                        lambda *args, **kwargs: reads.append(args) or read_reference_package(*args, **kwargs))
+    with PackageDiffEngine() as diff_engine:
+        result = diff_engine.compare(reference, compared, diff_folder=str(tmp_path / "diff"))
+        assert result.exit_code(test=True) == 5
+        assert len(result.conflicts) == 5 and not result.safe_to_import
+        assert {conflict.reason for conflict in result.conflicts} <= {
+            "lower version", "same version, different content"}
+        assert sum(result.counts.values()) - result.counts['unexpected_values'] == len(result.records())
+        again = diff_engine.compare(reference, compared)
+        assert again.counts == result.counts and len(reads) == 1
+        os.utime(reference, ns=(0, 0))
+        diff_engine.compare(reference, compared)
+        assert len(reads) == 2
+        workflows = diff_engine.compare(reference, compared, element_filter=ElementFilter(include_types=["Workflow"]),
+                                        diff_options=DiffOptions(max_size=1), diff_folder=str(tmp_path / "small"))
+        assert {record["type"] for record in workflows.records()} == {"Workflow"} and len(reads) == 3
+        assert diff_engine.compare(reference, compared).counts == result.counts
+        diff_files = list((tmp_path / "small").glob("*/*/*"))
+        assert diff_files and all("no line diff" in diff_file.read_text() for diff_file in diff_files)
+    captured = capsys.readouterr()
+    assert captured.out == "" and captured.err == ""
+    assert os.listdir(str(tmp_path / "diff"))
+
+
+def test_comparison_server(tmp_path, monkeypatch):
+    """Check that the server compares packages with a cached reference and reports its metrics."""
+    import http.client
+    import json
+    import os
+    import threading
+    import urllib.error
+    import urllib.request
+    from vro_package_diff.engine import PackageDiffEngine
+    from vro_package_diff.server import make_server
+    folder = os.path.dirname(__file__)
+    request = json.dumps({
+        "reference": os.path.join(folder, "package_v1.0.package"),
+        "packages": [os.path.join(folder, "package_v1.1.package")],
+    }).encode('utf-8')
+    with PackageDiffEngine(max_references=2) as engine:
+        server = make_server("127.0.0.1:0", engine, diff_root=str(tmp_path))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:%d" % server.server_address[1]
+        try:
+            for _ in range(3):
+                with urllib.request.urlopen(url + "/compare", data=request) as response:
+                    result = json.loads(response.read().decode('utf-8'))["results"][0]
+                assert result["counts"]["conflict"] == 5 and len(result["conflicts"]) == 5
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url + "/compare", data=b'{"reference": "missing.package", "package": "x"}')
+            assert error.value.code == 422
+            for headers, status in (({}, 411), ({"Content-Length": "many"}, 400)):
+                connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+                connection.putrequest("POST", "/compare")
+                for name, value in headers.items():
+                    connection.putheader(name, value)
+                connection.endheaders()
+                response = connection.getresponse()
+                assert response.status == status and "Content-Length" in json.loads(response.read())["error"]
+                connection.close()
+            compare = json.loads(request.decode('utf-8'))
+            with urllib.request.urlopen(url + "/compare", data=json.dumps(
+                    dict(compare, include_types=["Workflow"], records=True)).encode('utf-8')) as response:
+                records = json.loads(response.read().decode('utf-8'))["results"][0]["records"]
+            assert records and {record["type"] for record in records} == {"Workflow"}
+            for diff_folder in ("../outside", str(tmp_path.parent), ""):
+                with pytest.raises(urllib.error.HTTPError) as error:
+                    urllib.request.urlopen(url + "/compare", data=json.dumps(
+                        dict(compare, diff_folder=diff_folder)).encode('utf-8'))
+                assert error.value.code == 400
+            with urllib.request.urlopen(url + "/compare", data=json.dumps(
+                    dict(compare, diff_folder="diff")).encode('utf-8')):
+                assert os.listdir(str(tmp_path / "diff"))
+            monkeypatch.setattr(engine, "compare_many", lambda *args, **kwargs: 1 / 0)
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url + "/compare", data=request)
+            assert error.value.code == 500
+            with urllib.request.urlopen(url + "/metrics") as response:
+                metrics = json.loads(response.read().decode('utf-8'))
+        finally:
+            server.shutdown()
+            server.server_close()
+    assert metrics["reference_cache"] == {"hits": 3, "misses": 3, "references": 2}
+    assert metrics["requests"] == 12 and metrics["errors"] == 7
+    assert not os.path.exists(str(tmp_path.parent / "outside"))
+    assert metrics["latency_ms"]["max"] >= metrics["latency_ms"]["p50"] > 0
+
+
+def test_package_watcher(tmp_path, monkeypatch):
+    """Check that the watch mode only reads the changed elements and writes their diff files again."""
+    import os
+    import zipfile
+    from vro_package_diff.engine import get_vroitems_from_package, PackageWatcher
+    from vro_package_diff.package import VROPackageReader
+    from .package_generator import generate_packages
+    reference, compared = str(tmp_path / "reference.package"), str(tmp_path / "compared.package")
+    expected = generate_packages(reference, compared, elements=30, mix={"ScriptModule": 1}, change_rate=0.3, seed=4)
+    folder, diff_folder = str(tmp_path / "compared"), str(tmp_path / "diff")
+    with zipfile.ZipFile(compared) as zip_ref:
+        zip_ref.extractall(folder)
+    read_ids = []
+    build_elements = VROPackageReader.build_elements
+    monkeypatch.setattr(VROPackageReader, "build_elements",
+                        lambda self, items_id: read_ids.extend(items_id) or build_elements(self, items_id))
+    watcher = PackageWatcher(get_vroitems_from_package(reference), reference, folder, diff_folder=diff_folder)
+    states = watcher.update()
+    assert {state: len(states[state]) for state in expected} == expected
+    assert watcher.update() is None
+    item = states['no_upgrade'][0]
+    data_path = os.path.join(folder, "elements", item.id, "data")
+    with open(data_path, 'rb') as data_file:
+        data = data_file.read()
+    with open(data_path, 'wb') as data_file:
+        data_file.write(data.replace('version="1.0.0"'.encode('utf-16-be'), 'version="1.1.0"'.encode('utf-16-be')))
+    os.utime(data_path, ns=(0, 0))  # the file may be written within the resolution of its modification time
+    assert os.path.exists(os.path.join(diff_folder, "no_upgrade", "action", item.id + ".diff"))
+    del read_ids[:]
+    states = watcher.update()
+    assert watcher.changed == [item.id] and read_ids == [item.id]
+    assert [vro_item.id for vro_item in states['upgrade'] if vro_item.id == item.id] == [item.id]
+    assert os.path.exists(os.path.join(diff_folder, "upgrade", "action", item.id + ".diff"))
+    assert not os.path.exists(os.path.join(diff_folder, "no_upgrade", "action", item.id + ".diff"))
+
+
+def test_gate_modes(tmp_path, monkeypatch):
+    """Check that the gate modes give the exit status of a full run while reading fewer elements."""
+    from click.testing import CliRunner
+    from vro_package_diff.__main__ import cli
+    from vro_package_diff.package import open_package, VROPackageReader
+    from .package_generator import generate_packages
+    reference, compared = str(tmp_path / "reference.package"), str(tmp_path / "compared.package")
+    expected = generate_packages(reference, compared, elements=60, change_rate=0.2, seed=6)
+    read_ids = []
+    build_elements = VROPackageReader.build_elements
+    monkeypatch.setattr(VROPackageReader, "build_elements",
+                        lambda self, items_id: read_ids.extend(items_id) or build_elements(self, items_id))
+    args = ["-r", reference, compared, "--log-file", ""]
+    result = CliRunner().invoke(cli, args + ["-t", "-e"])
+    assert result.exit_code == expected['conflict'] + expected['unexpected_values']
+    full_reads = len(read_ids)
+    del read_ids[:]
+    result = CliRunner().invoke(cli, args + ["-t", "-e", "-g", "counts"])
+    assert result.exit_code == expected['conflict'] + expected['unexpected_values']
+    assert result.output == "%s: %d conflicts, %d ConfigurationElements with values\n" % (
+        compared, expected['conflict'], expected['unexpected_values'])
+    # with --empty-config, only the data of the changed elements and of the ConfigurationElements is read
+    with open_package(reference) as reference_reader, open_package(compared) as reader:
+        unchanged = {item_id for item_id in reader.entries
+                     if item_id in reference_reader.entries
+                     and reader.fingerprint(item_id) == reference_reader.fingerprint(item_id)}
+        unchanged_workflows = {item_id for item_id in unchanged if reader.item_type(item_id) == "Workflow"}
+        unchanged_configurations = {item_id for item_id in unchanged
+                                    if reader.item_type(item_id) == "ConfigurationElement"}
+    assert unchanged_workflows and unchanged_configurations
+    del read_ids[:]
+    result = CliRunner().invoke(cli, args + ["-e", "-g", "counts"])
+    assert result.exit_code == expected['unexpected_values']
+    assert not unchanged_workflows & set(read_ids) and unchanged_configurations <= set(read_ids)
+    del read_ids[:]
+    result = CliRunner().invoke(cli, args + ["-t", "-g", "counts"])
+    assert result.exit_code == expected['conflict'] and len(read_ids) < full_reads / 2
+    result = CliRunner().invoke(cli, args + ["-t", "-g", "first-error"])
+    assert result.exit_code == 1 and "Conflict on item" in result.output
+    assert CliRunner().invoke(cli, args + ["-g", "counts"]).exit_code == 2
+
+
+def test_element_filters(monkeypatch):
+    """Check that the elements filtered out by type or id are never read, in both packages."""
+    import json
+    import os
+    from click.testing import CliRunner
+    from vro_package_diff import package
+    from vro_package_diff.__main__ import cli
+    from vro_package_diff.vro_element import VROElementMetadata
+    folder = os.path.dirname(__file__)
+    args = ["-r", os.path.join(folder, "package_v1.0.package"), os.path.join(folder, "package_v1.1.package"),
+            "--format", "jsonl", "--log-file", ""]
+    read_types = []
+    read_data = VROElementMetadata.read_data
+    monkeypatch.setattr(VROElementMetadata, "read_data",
+                        lambda self, *args: read_types.append(self.type) or read_data(self, *args))
+
+    def records(*options):
+        del read_types[:]
+        result = CliRunner().invoke(cli, args + list(options))
+        return [json.loads(line) for line in result.output.splitlines()]
+
+    all_records = records()
+    parsed_types = []
+    read_item_type = package.read_item_type
+    monkeypatch.setattr(package, "read_item_type",
+                        lambda xml_info: parsed_types.append(xml_info) or read_item_type(xml_info))
+    workflows = records("--include-type", "workflow")
+    assert {record["type"] for record in workflows} == set(read_types) == {"Workflow"}
+    # each package is opened twice, but the type of each element is only parsed once
+    entries = sum(len(package.open_package(os.path.join(folder, name)).entries)
+                  for name in ("package_v1.0.package", "package_v1.1.package"))
+    assert 0 < len(parsed_types) <= entries
+    assert workflows == [record for record in all_records if record["type"] == "Workflow"]
+    others = records("--exclude-type", "Workflow", "--exclude-type", "Action")
+    assert "Workflow" not in read_types and "Action" not in read_types
+    assert len(others) == len(all_records) - len(workflows) - sum(record["type"] == "Action" for record in all_records)
+    item_id = all_records[0]["id"]
+    assert records("--id", item_id) == all_records[:1] and len(read_types) <= 2
+    named = records("--name-glob", "this_is_action_[ab]")
+    assert sorted(record["name"] for record in named) == ["this_is_action_a", "this_is_action_b"]
@@ -4,15 +4,27 @@
 
 """
 
+import logging
 import sys
 if sys.version_info < (3, 5):
     raise Exception('vRO package diff tool requires Python versions 3.5 or later.')
 
 __all__ = [
-    'config'
+    'cache',
+    'config',
+    'diff',
+    'diff_engine',
+    'engine',
+    'formats',
+    'package',
+    'profiling',
+    'server',
     'vro_element',
 ]
 
+# the library does not print its log records when the application does not configure logging
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
 __version__ = "2.2.3"
 """Define the version of the package.
 """
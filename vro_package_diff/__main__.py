@@ -2,85 +2,95 @@
 """Provide a table-formated diff of two VMware vRealize Orchestrator packages."""
 
 # default python modules
+import glob
 import logging
 import os
-import platform
-import zipfile
-from difflib import unified_diff
+import sys
+import time
 
 # external modules
 import click
 
-from terminaltables import AsciiTable, SingleTable
-
 # local imports
 from . import __version__
-from .config import CLI_CONTEXT_SETTINGS, LOGGING_FILE, LOGGING_LEVEL_FILE, OUTPUT_SETUP, SUPPORTED_ELEMENT_TYPES
-from .vro_element import VROElementMetadata
+from .config import (CACHE_MAX_SIZE, CLI_CONTEXT_SETTINGS, CONTENT_MEMORY_BUDGET, DIFF_ENGINE, DIFF_MAX_EDITS,
+                     DIFF_MAX_SIZE, DIFF_TIMEOUT, LOGGING_FILE, LOGGING_LEVEL_FILE, OUTPUT_SETUP)
+from .diff import create_diff_file, create_diff_files, DiffOptions  # noqa: F401
+from .diff_engine import DIFF_ENGINES
+from .engine import (check_package, classify_vro_items, compare_package, compare_packages,  # noqa: F401
+                     get_vroitems_from_package, PackageWatcher, read_reference_package, start_process_pool)
+from .formats import WRITERS
+from .package import ELEMENT_TYPES, ElementFilter, PackageReadError
+from .profiling import MemoryReport, phase, Profiler, step
+from .vro_element import set_content_memory_budget
 
-# Windows trick: no colored output
-if platform.system().lower() == "windows":
-    def stylize(text: str, color: str):
-        """No color for windows users: sorry.
+logger = logging.getLogger(__package__ + ".__main__")  # __name__ is "__main__" with python -m
 
-        Args:
-            text (str): Text to print
-            color (str): Unused color for text
+LOG_LEVELS = ['debug', 'info', 'warning', 'error', 'critical', 'off']
+"""list: Choices of the ``--log-level`` option."""
 
-        Returns:
-            str: Text from input
-        """
-        return text
-else:
-    from colored import stylize
 
-# Configure logger
-logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s',
-                    datefmt='%Y/%m/%d %H:%M:%S',
-                    filename=LOGGING_FILE,
-                    filemode='w',
-                    level=LOGGING_LEVEL_FILE)
-logger = logging.getLogger(__name__)
+def configure_logging(level: str = logging.getLevelName(LOGGING_LEVEL_FILE).lower(), log_file: str = LOGGING_FILE):
+    """Configure the file logger of the package.
+
+    When logging is off, the level of the package logger is set above all the messages: they are
+    skipped before being formatted.
+
+    Args:
+        level (str, optional): Name of the log level, or ``off``. Defaults to LOGGING_LEVEL_FILE.
+        log_file (str, optional): Log file location (no log file if empty). Defaults to LOGGING_FILE.
+    """
+    package_logger = logging.getLogger(__package__)
+    for handler in package_logger.handlers[:]:
+        package_logger.removeHandler(handler)
+        handler.close()
+    package_logger.propagate = False
+    if level == 'off' or not log_file:
+        package_logger.addHandler(logging.NullHandler())
+        package_logger.setLevel(logging.CRITICAL + 1)
+        return
+    try:
+        handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
+    except OSError as error:
+        click.echo("Cannot write the log file (%s): logging is disabled" % error, err=True)
+        configure_logging('off')
+        return
+    handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y/%m/%d %H:%M:%S'))
+    package_logger.addHandler(handler)
+    package_logger.setLevel(getattr(logging, level.upper()))
 
 
 def _stylize(text: str, color: str = "", colorized: bool = True):
     """Print colored or uncolored text.
 
+    The colored module is only imported when colors are used. No color for windows users: sorry.
+
     Args:
         text (str): Text to print
-        color (str): Color to use
+        color (str): Name of the color to use
         colorized (bool, optional): Use color or not?. Defaults to True.
     """
-    if not colorized:
+    if not colorized or sys.platform.startswith("win"):
         return text
-    else:
-        return stylize(text, color)
+    from colored import fg, stylize
+    return stylize(text, fg(color))
 
 
-def get_vroitems_from_package(package):
-    """Get all the items from the vRO Package.
+def _render_table(data: list, title: str = None, ascii: bool = False):
+    """Render a table with ASCII or box-drawing characters.
 
     Args:
-        package (str): Path to a package file.
+        data (list): Rows of the table.
+        title (str, optional): Title of the table. Defaults to None.
+        ascii (bool): Use ASCII for output or not? Defaults to False.
 
     Returns:
-        VROElementMetadata[]: a list of VROElementMetadata.
+        str: the rendered table.
     """
-    vro_items_id, vro_items = [], []
-    with zipfile.ZipFile(package, 'r') as zip_ref:
-        for x in zip_ref.namelist():
-            if x.startswith("elements"):
-                item_id = os.path.basename(os.path.split(x)[0])
-                if item_id not in vro_items_id:
-                    with zip_ref.open('elements/' + item_id + '/info', 'r') as xml_info_file:
-                        xml_info = xml_info_file.read()
-                    with zip_ref.open('elements/' + item_id + '/data', 'r') as data_file:
-                        data = data_file.read()
-                    vro_item = VROElementMetadata(item_id, xml_info, data)
-                    vro_items.append(vro_item)
-                    vro_items_id.append(item_id)
-                    logger.info("New item %s" % vro_item)
-    return vro_items
+    from terminaltables import AsciiTable, SingleTable
+    if ascii:
+        return AsciiTable(data, title).table
+    return SingleTable(data, title).table
 
 
 def legend_print(ascii: bool = False, colorized: bool = True):
@@ -90,8 +100,6 @@ def legend_print(ascii: bool = False, colorized: bool = True):
         ascii (bool): Use ASCII for output or not? Defaults to False.
         colorized (bool, optional): Use color or not?. Defaults to True.
     """
-    data = [["Legend", '']]
-    pretty_table = SingleTable(data)
     legend = ""
     symbol_mode = "symbol_utf8"
     if ascii:
@@ -111,11 +119,11 @@ def legend_print(ascii: bool = False, colorized: bool = True):
     legend += "   ‣ Version in package file is lower than in the reference package.\n"
     legend += "   ‣ If versions are the same, the content is not. Upgrade version on\n"
     legend += "     compared package to overwrite item during the import process.\n"
-    pretty_table.table_data[0][1] = legend
-    print("\n%s" % pretty_table.table)
+    print("\n%s" % _render_table([["Legend", legend]]))
 
 
-def table_pprint(lists_of_items_by_state: dict, ascii: bool = False, colorized: bool = True):
+def table_pprint(lists_of_items_by_state: dict, ascii: bool = False, colorized: bool = True,
+                 title: str = "Diff betwenn packages"):
     """Generate and print a pretty table for output information.
 
     Args:
@@ -123,9 +131,9 @@ def table_pprint(lists_of_items_by_state: dict, ascii: bool = False, colorized:
             import state
         ascii (bool): Use ASCII for output or not? Defaults to False.
         colorized (bool, optional): Use color or not?. Defaults to True.
+        title (str, optional): Title of the table. Defaults to "Diff betwenn packages".
     """
     data = []
-    title = "Diff betwenn packages"
     # Headers
     data.append(["ID", "Name", "Type", "Reference", "Package", "Result"])
     symbol_mode = "symbol_utf8"
@@ -133,37 +141,35 @@ def table_pprint(lists_of_items_by_state: dict, ascii: bool = False, colorized:
         symbol_mode = "symbol_ascii"
     for loi in OUTPUT_SETUP.keys():
         for element in lists_of_items_by_state.get(loi, []):
+            removed = loi == 'removed'  # items of the reference package
             data.append([
                 element.id,
                 element.name,
                 element.type,
-                element.comp_version,  # Reference version
-                element.version,  # Package version
+                element.version if removed else element.comp_version,  # Reference version
+                "" if removed else element.version,  # Package version
                 _stylize(
                     OUTPUT_SETUP[loi].get(symbol_mode),
                     OUTPUT_SETUP[loi].get('color'),
                     colorized
                 )
             ])
-    if ascii:
-        print(AsciiTable(data, title).table)
-    else:
-        print(SingleTable(data, title).table)
+    print(_render_table(data, title, ascii=ascii))
 
 
-def unexpected_values_pprint(lists_of_items_by_state: dict, ascii: bool = False):
+def unexpected_values_pprint(lists_of_items_by_state: dict, ascii: bool = False,
+                             title: str = "Unexpected values in configurationElements"):
     """Generate and print a pretty table for output information.
 
     Args:
         lists_of_items_by_state (dict of VROElementMetadata[]): A dict of items, stored by
             import state
         ascii (bool): Use ASCII for output or not? Defaults to False.
-        colorized (bool, optional): Use color or not?. Defaults to True.
+        title (str, optional): Title of the table. Defaults to "Unexpected values in configurationElements".
     """
     if not lists_of_items_by_state['unexpected_values']:
         return
     data = []
-    title = "Unexpected values in configurationElements"
     # Headers
     data.append(["ID", "Name", "Type", "Package", "Nb values"])
     for element in lists_of_items_by_state.get('unexpected_values', []):
@@ -174,42 +180,7 @@ def unexpected_values_pprint(lists_of_items_by_state: dict, ascii: bool = False)
             element.version,
             element.valued_items
         ])
-    if ascii:
-        print("\n" + AsciiTable(data, title).table)
-    else:
-        print("\n" + SingleTable(data, title).table)
-
-
-def create_diff_file(src_elt: bytes, dst_elt: bytes, src_name: str, dst_name: str, diff_folder: str, state: str):
-    """Create a diff file between two versions of element data_content.
-
-    Args:
-        src_elt (VROElementMetadata): Primary content.
-        dst_elt (VROElementMetadata): Destination content.
-        src_name (str): Name of the source content.
-        dst_name (str): Name of the destination content.
-        diff_folder (str): Destination folder to store diff files.
-        state (str): State of the current item (used for sub folder)
-    """
-    if not (src_elt.dec_data_content and dst_elt.dec_data_content):
-        logger.info("Ignoring (binary?) content for element with ID: %s" % src_elt.id)
-        return
-    logger.info("Creating a new diff file for element ID: %s" % src_elt.id)
-    new_file_name = src_elt.id + ".diff"
-    diff_folder_target = os.path.join(diff_folder, state, src_elt.type.lower())
-    if not os.path.isdir(diff_folder_target):
-        logger.debug("Creating a missing diff target folder: %s" % diff_folder_target)
-        os.makedirs(diff_folder_target, exist_ok=True)
-    with open(os.path.join(diff_folder_target, new_file_name), 'w', encoding='utf-8') as output_f:
-        for line in unified_diff(
-                src_elt.dec_data_content.splitlines(keepends=True),
-                dst_elt.dec_data_content.splitlines(keepends=True),
-                fromfile="%s - %s: %s (%s)" % (src_name, src_elt.type, src_elt.name, src_elt.version),
-                tofile="%s - %s: %s (%s)" % (dst_name, dst_elt.type, dst_elt.name, dst_elt.version),
-                n=3,
-                lineterm='\n'):
-            output_f.write(line)
-    logger.info("End of diff file generation for the element with ID: %s" % src_elt.id)
+    print("\n" + _render_table(data, title, ascii=ascii))
 
 
 def diff_vro_items(items_src,
@@ -219,8 +190,9 @@ def diff_vro_items(items_src,
                    ascii: bool = False,
                    colorized: bool = True,
                    diff_folder: bool = None,
-                   empty_config: bool = True):
-    """Compare two vRO items lists.
+                   empty_config: bool = True,
+                   jobs: int = 1):
+    """Compare two vRO items lists and print the result table.
 
     Args:
         items_src (VROElementMetadata[]): Original list of vRO items.
@@ -230,82 +202,186 @@ def diff_vro_items(items_src,
         ascii (bool): Use ASCII for output or not? Defaults to False.
         colorized (bool, optional): Use color or not?. Defaults to True.
         diff_folder (str, optional): Generate unified diff files output. Defaults to None.
+        jobs (int, optional): Number of processes used to generate diff files. Defaults to 1.
+
+    Returns:
+        dict of VROElementMetadata[]: A dict of items, stored by import state. Items that are only
+            in the reference package are stored under the ``removed`` key.
     """
-    lists_of_items_by_state = {
-        'no_upgrade': [],
-        'upgrade': [],
-        'conflict': [],
-        'new': [],
-        'unsupported': [],
-        'unexpected_values': []
-    }
-    for idst in items_dst:
-        found = False
-        if idst.type not in SUPPORTED_ELEMENT_TYPES:
-            state = 'unsupported'
-        else:
-            for isrc in items_src:
-                if isrc.id == idst.id:
-                    logger.debug("%s is IN source package" % idst)
-                    found = True
-                    idst.comp_version = isrc.version
-                    if idst.version == "n/a":
-                        state = 'unsupported'
-                    elif idst.version > isrc.version:
-                        state = 'upgrade'
-                    elif idst.version < isrc.version:
-                        state = 'conflict'
-                        logger.warning("Conflict detected on item: %s" % idst)
-                    elif idst.version == isrc.version:
-                        if idst.checksum == isrc.checksum:
-                            state = 'no_upgrade'
-                        else:
-                            state = 'conflict'
-                            logger.warning("Conflict detected on item: %s" % idst)
-                    if diff_folder:
-                        create_diff_file(
-                            isrc,
-                            idst,
-                            src_name=reference_package,
-                            dst_name=compared_package,
-                            diff_folder=diff_folder,
-                            state=state
-                        )
-            if (not found) and (idst.type in SUPPORTED_ELEMENT_TYPES):
-                logger.debug("%s is NOT IN source package" % idst)
-                state = 'new'
-            if idst.type == "ConfigurationElement" and empty_config:
-                if idst.count_values_from_configuration_elt():
-                    lists_of_items_by_state['unexpected_values'].append(idst)
-        lists_of_items_by_state[state].append(idst)
-    logger.info("File A: %d elements" % len(items_src))
-    logger.info("File B: %d elements" % len(items_dst))
-    logger.info("Items to upgrade:\t\t%d" % len(lists_of_items_by_state['upgrade']))
-    logger.info("Items without upgrade:\t%d" % len(lists_of_items_by_state['no_upgrade']))
-    logger.info("Items in upgrade conflict:\t%d" % len(lists_of_items_by_state['conflict']))
-    logger.info("New items:\t\t\t%d" % len(lists_of_items_by_state['new']))
-    logger.info("ConfigurationElements with values:\t\t\t%d" % len(lists_of_items_by_state['unexpected_values']))
-    logger.warning("Unsupported items:\t\t%d" % len(lists_of_items_by_state['unsupported']))
-    total = (
-        len(lists_of_items_by_state['unsupported'])
-        + len(lists_of_items_by_state['upgrade'])
-        + len(lists_of_items_by_state['no_upgrade'])
-        + len(lists_of_items_by_state['conflict'])
-        + len(lists_of_items_by_state['new'])
+    lists_of_items_by_state = classify_vro_items(
+        items_src,
+        items_dst,
+        reference_package=reference_package,
+        compared_package=compared_package,
+        diff_folder=diff_folder,
+        empty_config=empty_config,
+        jobs=jobs
     )
-    logger.info("Total items:\t\t\t%s" % total)
     table_pprint(lists_of_items_by_state, ascii=ascii, colorized=colorized)
     return lists_of_items_by_state
 
 
+def expand_packages(patterns: tuple):
+    """Expand the glob patterns of the compared packages.
+
+    A path that matches no file as a pattern (e.g. with brackets in its name) is used as is if it exists.
+
+    Args:
+        patterns (str[]): Paths or glob patterns of packages.
+
+    Raises:
+        click.BadParameter: a path does not exist, or a pattern does not match any file.
+
+    Returns:
+        str[]: Paths of the packages.
+    """
+    packages = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or ([pattern] if os.path.exists(pattern) else [])
+        if not matches:
+            raise click.BadParameter("No package found for: %s" % pattern, param_hint="COMPARED_PACKAGE")
+        packages += [match for match in matches if match not in packages]
+    return packages
+
+
+def gate_packages(reference_package: str, compared_packages: list, test: bool = False, empty_config: bool = False,
+                  first_error: bool = False, jobs: int = 1, element_filter: ElementFilter = None):
+    """Only compute the exit status of [-t/--test] and [-e/--empty-config], without tables nor diff files.
+
+    The reference package is not read as a whole, so the cache is not used.
+
+    Args:
+        reference_package (str): package to use as source.
+        compared_packages (str[]): packages to compare with reference one.
+        test (bool, optional): Count the conflicts. Defaults to False.
+        empty_config (bool, optional): Count the ConfigurationElements with values. Defaults to False.
+        first_error (bool, optional): Stop at the first error. Defaults to False.
+        jobs (int, optional): Number of processes used to read items. Defaults to 1.
+        element_filter (ElementFilter, optional): Filter of the items. Defaults to None: all the items.
+
+    Raises:
+        click.ClickException: a package is missing or corrupt.
+
+    Returns:
+        int: the number of errors (1 at most with ``first_error``).
+    """
+    executor = start_process_pool(jobs) if jobs > 1 else None
+    exit_code = 0
+    try:
+        with phase("Check packages"):
+            for package in compared_packages:
+                logger.info("Checking the package: %s", package)
+                counts, first_item = check_package(reference_package, package, test=test, empty_config=empty_config,
+                                                   first_error=first_error, jobs=jobs, executor=executor,
+                                                   element_filter=element_filter)
+                if first_error:
+                    if first_item is not None:
+                        kind = "Conflict" if counts['conflict'] else "Values"
+                        click.echo("%s: %s on item %s" % (package, kind, first_item))
+                        return 1
+                    click.echo("%s: OK" % package)
+                    continue
+                results = []
+                if test:
+                    results.append("%d conflicts" % counts['conflict'])
+                    exit_code += counts['conflict']
+                if empty_config:
+                    results.append("%d ConfigurationElements with values" % counts['unexpected_values'])
+                    exit_code += counts['unexpected_values']
+                click.echo("%s: %s" % (package, ", ".join(results)))
+    except PackageReadError as error:
+        logger.error("%s", error)
+        raise click.ClickException(str(error))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return exit_code
+
+
+def watch_package(reference_package: str, compared_package: str, diff_folder: str = None, test: bool = False,
+                  empty_config: bool = False, jobs: int = 1, cache=None, interval: float = 1.0, ascii: bool = False,
+                  colorized: bool = True, element_filter: ElementFilter = None, diff_options: DiffOptions = None):
+    """Compare a package with the reference package each time it changes, until interrupted.
+
+    The reference package is read once, and only the changed elements of the compared package are
+    read again.
+
+    Args:
+        reference_package (str): package to use as source.
+        compared_package (str): package to watch and compare with reference one.
+        diff_folder (str, optional): Generate unified diff files output. Defaults to None.
+        test (bool, optional): Count the conflicts in the exit status. Defaults to False.
+        empty_config (bool, optional): Print and count the values of the ConfigurationElements. Defaults to False.
+        jobs (int, optional): Number of processes used to read items and to generate diff files. Defaults to 1.
+        cache (PackageCache, optional): Persistent cache of the reference package items. Defaults to None.
+        interval (float, optional): Time (seconds) between two checks of the compared package. Defaults to 1.0.
+        ascii (bool): Use ASCII for output or not? Defaults to False.
+        colorized (bool, optional): Use color or not?. Defaults to True.
+        element_filter (ElementFilter, optional): Filter of the items. Defaults to None: all the items.
+        diff_options (DiffOptions, optional): Engine and limits of the diff files. Defaults to None: the
+            default options.
+
+    Raises:
+        click.ClickException: the reference package is missing or corrupt.
+
+    Returns:
+        int: the exit status of the last comparison.
+    """
+    executor = start_process_pool(jobs) if jobs > 1 else None
+    exit_code = 0
+    last_error = None
+    try:
+        try:
+            items_src = read_reference_package(reference_package, jobs=jobs, cache=cache, executor=executor,
+                                               element_filter=element_filter, map_files=False)
+        except PackageReadError as error:
+            logger.error("%s", error)
+            raise click.ClickException(str(error))
+        watcher = PackageWatcher(items_src, reference_package, compared_package, diff_folder=diff_folder,
+                                 empty_config=empty_config, jobs=jobs, executor=executor,
+                                 element_filter=element_filter, diff_options=diff_options)
+        while True:
+            start = time.perf_counter()
+            try:
+                lists_of_items_by_state = watcher.update()
+            except PackageReadError as error:
+                # the package may be being written: it is read again at the next check
+                if str(error) != last_error:
+                    logger.warning("%s", error)
+                    click.echo("%s (waiting for the next change)" % error, err=True)
+                last_error = str(error)
+                lists_of_items_by_state = None
+            duration = time.perf_counter() - start
+            if lists_of_items_by_state is not None:
+                last_error = None
+                table_pprint(lists_of_items_by_state, ascii=ascii, colorized=colorized)
+                if empty_config:
+                    unexpected_values_pprint(lists_of_items_by_state, ascii=ascii)
+                exit_code = 0
+                if test:
+                    exit_code += len(lists_of_items_by_state['conflict'])
+                if empty_config:
+                    exit_code += len(lists_of_items_by_state['unexpected_values'])
+                click.echo("%d changed elements compared in %.1f ms. Watching %s for changes (Ctrl+C to stop)" % (
+                    len(watcher.changed), duration * 1e3, compared_package), err=True)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logger.info("End of the watch mode")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return exit_code
+
+
 @click.command(context_settings=CLI_CONTEXT_SETTINGS)
 @click.version_option(__version__)
 @click.option('-r', '--reference_package',
-              help="Reference package to compare your package with.",
-              type=click.File('rb'),
+              help="Reference package (or unpacked package folder) to compare your package with.",
+              type=click.Path(exists=True),
               required=True)
 @click.argument('compared_package',
-                type=click.File('rb'))
+                nargs=-1,
+                required=True)
 @click.option('-l', '--legend',
               is_flag=True,
               help="Display the legend after the diff table")
@@ -321,51 +397,254 @@ def diff_vro_items(items_src,
 @click.option('-d', '--diff',
               type=click.Path(dir_okay=True, resolve_path=True),
               help="A folder where to generate unified diff files output")
+@click.option('--diff-engine',
+              type=click.Choice(sorted(DIFF_ENGINES)),
+              default=DIFF_ENGINE,
+              show_default=True,
+              help="Engine used to compute the unified diff files")
+@click.option('--diff-max-size',
+              type=click.IntRange(min=0),
+              default=DIFF_MAX_SIZE // (1024 * 1024),
+              show_default=True,
+              help="Maximum size (MB) of an element for a line-by-line diff file, beyond which the diff file "
+                   "only tells that the contents differ (0 for no limit)")
+@click.option('--diff-max-edits',
+              type=click.IntRange(min=0),
+              default=DIFF_MAX_EDITS,
+              show_default=True,
+              help="Maximum number of inserted and deleted lines of an element for a line-by-line diff file with "
+                   "the myers engine, beyond which the diff file only tells that the contents differ (0 for no limit)")
+@click.option('--diff-timeout',
+              type=click.IntRange(min=0),
+              default=DIFF_TIMEOUT,
+              show_default=True,
+              help="Maximum time (seconds) to compute the diff file of an element, beyond which the diff file "
+                   "only tells that the contents differ (0 for no limit)")
 @click.option('-e', '--empty-config',
               is_flag=True,
               help="Check for values in the configuration elements: if so, exit with failure status.")
-def cli(reference_package: str, compared_package: str, legend: bool = False,
+@click.option('-j', '--jobs',
+              type=click.IntRange(min=0),
+              default=1,
+              show_default=True,
+              help="Number of processes used to read the packages elements and to generate diff files, "
+                   "and number of packages compared at the same time (0 to use all the CPUs)")
+@click.option('-m', '--memory-budget',
+              type=click.IntRange(min=0),
+              default=CONTENT_MEMORY_BUDGET // (1024 * 1024),
+              show_default=True,
+              help="Memory (MB) used to keep the content of the elements (0 to read it again when needed)")
+@click.option('--memory-report',
+              is_flag=True,
+              help="Print the peak memory usage of each phase")
+@click.option('-c', '--cache-dir',
+              type=click.Path(file_okay=False, resolve_path=True),
+              help="A folder where to cache the items read from the reference package")
+@click.option('--cache-max-size',
+              type=click.IntRange(min=1),
+              default=CACHE_MAX_SIZE // (1024 * 1024),
+              show_default=True,
+              help="Maximum size (MB) of the cache")
+@click.option('--include-type',
+              type=click.Choice(ELEMENT_TYPES, case_sensitive=False),
+              metavar='TYPE',
+              multiple=True,
+              help="Only compare the elements of this type (can be repeated): %s" % ", ".join(ELEMENT_TYPES))
+@click.option('--exclude-type',
+              type=click.Choice(ELEMENT_TYPES, case_sensitive=False),
+              metavar='TYPE',
+              multiple=True,
+              help="Do not compare the elements of this type (can be repeated)")
+@click.option('--id', 'item_ids',
+              metavar='ID',
+              multiple=True,
+              help="Only compare the element with this ID (can be repeated)")
+@click.option('--name-glob',
+              metavar='PATTERN',
+              multiple=True,
+              help="Only compare the elements whose name matches this glob pattern (can be repeated)")
+@click.option('-f', '--format', 'output_format',
+              type=click.Choice(['table'] + sorted(WRITERS)),
+              default='table',
+              show_default=True,
+              help="Output format: machine-readable formats stream one record per element")
+@click.option('-g', '--gate',
+              type=click.Choice(['counts', 'first-error']),
+              help="Only compute the exit status of --test and --empty-config, without tables nor diff files: "
+                   "count the errors, or stop at the first one (and exit with 1)")
+@click.option('-w', '--watch',
+              is_flag=True,
+              help="Compare the package again each time it changes, reading only the changed elements")
+@click.option('--watch-interval',
+              type=click.FloatRange(min=0.1),
+              default=1.0,
+              show_default=True,
+              help="Time (seconds) between two checks of the package in --watch mode")
+@click.option('--log-level',
+              type=click.Choice(LOG_LEVELS),
+              default=logging.getLevelName(LOGGING_LEVEL_FILE).lower(),
+              show_default=True,
+              help="Level of the messages written to the log file (off to disable logging)")
+@click.option('--log-file',
+              type=click.Path(dir_okay=False),
+              default=LOGGING_FILE,
+              show_default=True,
+              help="Log file location (an empty value to disable logging)")
+@click.option('--profile',
+              is_flag=True,
+              help="Print the wall and CPU time of each phase, the elements by type and the slowest elements")
+@click.option('--profile-slowest',
+              type=click.IntRange(min=0),
+              default=10,
+              show_default=True,
+              help="Number of slowest elements printed by --profile")
+@click.option('--profile-dump',
+              type=click.Path(dir_okay=False, writable=True),
+              help="A file where to write a cProfile dump (pstats format) of the run")
+def cli(reference_package: str, compared_package: tuple, legend: bool = False,
         test: bool = False, ascii: bool = False, no_color: bool = False, diff: str = None,
-        empty_config: bool = False):
-    """Compare two vRealize Orchestrator packages.
+        diff_engine: str = DIFF_ENGINE, diff_max_size: int = 16, diff_max_edits: int = DIFF_MAX_EDITS,
+        diff_timeout: int = DIFF_TIMEOUT,
+        empty_config: bool = False, jobs: int = 1, memory_budget: int = 256, memory_report: bool = False,
+        cache_dir: str = None, cache_max_size: int = 64, include_type: tuple = (), exclude_type: tuple = (),
+        item_ids: tuple = (), name_glob: tuple = (), output_format: str = 'table', gate: str = None,
+        watch: bool = False, watch_interval: float = 1.0, log_level: str = 'debug', log_file: str = LOGGING_FILE,
+        profile: bool = False, profile_slowest: int = 10, profile_dump: str = None):
+    """Compare vRealize Orchestrator packages.
 
-    Use the [-r/--reference_package] option to specify the reference package.
+    Use the [-r/--reference_package] option to specify the reference package. Several packages
+    (or glob patterns) can be compared with the same reference package. Unpacked package folders
+    can be used instead of package files.
+
+    With a machine-readable [-f/--format], the records are written on the standard output while
+    the packages are compared, and the tables are not printed.
+
+    With [-g/--gate], only the exit status of [-t/--test] and [-e/--empty-config] is computed,
+    for CI gates.
+
+    With [-w/--watch], a single package is compared again each time it changes.
+
+    Elements can be selected by type, id and name: the other elements of both packages are not
+    compared, and are not read at all when selected by type or id.
     """
-    logger.info("Reading items from the source package")
-    vro_items_src = get_vroitems_from_package(reference_package)
-    logger.info("Reading items from the destination package")
-    vro_items_dst = get_vroitems_from_package(compared_package)
-    logger.info("Starting the comparison of both contents")
-    lists_of_items_by_state = diff_vro_items(
-        vro_items_src,
-        vro_items_dst,
-        ascii=ascii,
-        colorized=not no_color,
-        diff_folder=diff,
-        reference_package=reference_package.name,
-        compared_package=compared_package.name
-    )
-    if legend:
-        logger.info("Legend display was requested.")
-        legend_print(ascii=ascii, colorized=not no_color)
-    if diff:
-        logger.info("Unified diff files are stored in: %s" % diff)
-        print("Unified diff files are stored in: %s" % diff)
-    exit_code = 0
+    configure_logging(log_level, log_file)
+    logger.info("Starting the diff tool for vRO packages.")
+    compared_packages = expand_packages(compared_package)
+    multiple = len(compared_packages) > 1
+    if watch and (multiple or output_format != 'table' or memory_report or profile or profile_dump):
+        raise click.UsageError("--watch needs a single compared package and the table format, without profiling")
+    if gate and not (test or empty_config):
+        raise click.UsageError("--gate needs --test or --empty-config")
+    if gate and (watch or diff or output_format != 'table' or memory_report or profile or profile_dump):
+        raise click.UsageError("--gate only computes the exit status: no diff files, records, watch or profiling")
+    set_content_memory_budget(memory_budget * 1024 * 1024)
+    diff_options = DiffOptions(diff_engine, max_size=diff_max_size * 1024 * 1024, timeout=diff_timeout,
+                               max_edits=diff_max_edits)
+    element_filter = ElementFilter(include_types=include_type, exclude_types=exclude_type, ids=item_ids,
+                                   name_globs=name_glob)
+    cache = None
+    if cache_dir:
+        from .cache import PackageCache
+        cache = PackageCache(cache_dir, max_size=cache_max_size * 1024 * 1024)
+    if not jobs:
+        jobs = os.cpu_count() or 1
+    if gate:
+        exit(gate_packages(reference_package, compared_packages, test=test, empty_config=empty_config,
+                           first_error=gate == 'first-error', jobs=jobs, element_filter=element_filter))
+    if watch:
+        exit(watch_package(reference_package, compared_packages[0], diff_folder=diff, test=test,
+                           empty_config=empty_config, jobs=jobs, cache=cache, interval=watch_interval, ascii=ascii,
+                           colorized=not no_color, element_filter=element_filter, diff_options=diff_options))
+    report = MemoryReport() if memory_report else None
+    if report is not None:
+        report.start()
+    profiler = None
+    if profile or profile_dump:
+        profiler = Profiler(slowest=profile_slowest, pstats_file=profile_dump)
+        profiler.start()
+    writer = None
+    if output_format != 'table':
+        writer = WRITERS[output_format](sys.stdout)
+    executor = None
+    if jobs > 1:
+        # started before the reader threads: forking them while another thread holds a lock could deadlock them
+        executor = start_process_pool(jobs)
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=1) as reference_reader, phase("Read and compare packages"):
+            # the compared packages are read while the reference package is read
+            vro_items_src = reference_reader.submit(read_reference_package, reference_package, jobs=jobs,
+                                                    cache=cache, executor=executor, element_filter=element_filter)
+            results = compare_packages(
+                vro_items_src,
+                reference_package=reference_package,
+                compared_packages=compared_packages,
+                diff_folder=diff,
+                jobs=jobs,
+                executor=executor,
+                writer=writer,
+                element_filter=element_filter,
+                diff_options=diff_options
+            )
+    except PackageReadError as error:
+        logger.error("%s", error)
+        raise click.ClickException(str(error))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if writer is not None:
+        writer.close()
+    with phase("Render output"), step("Rendering"):
+        for package, lists_of_items_by_state in zip(compared_packages, results):
+            if writer is not None:
+                continue  # records were already streamed
+            if multiple:
+                table_pprint(lists_of_items_by_state, ascii=ascii, colorized=not no_color,
+                             title="Diff betwenn packages: %s" % package)
+            else:
+                table_pprint(lists_of_items_by_state, ascii=ascii, colorized=not no_color)
+        if legend and writer is None:
+            logger.info("Legend display was requested.")
+            legend_print(ascii=ascii, colorized=not no_color)
+        if diff:
+            logger.info("Unified diff files are stored in: %s", diff)
+            click.echo("Unified diff files are stored in: %s" % diff, err=writer is not None)
+        exit_code = 0
+        for package, lists_of_items_by_state in zip(compared_packages, results):
+            if test:
+                logger.info("Number of conflicts in %s: %d", package, len(lists_of_items_by_state['conflict']))
+                exit_code += len(lists_of_items_by_state['conflict'])
+            if empty_config and writer is None:
+                if multiple:
+                    unexpected_values_pprint(lists_of_items_by_state, ascii=ascii,
+                                             title="Unexpected values in configurationElements: %s" % package)
+                else:
+                    unexpected_values_pprint(lists_of_items_by_state, ascii=ascii)
+            if empty_config:
+                exit_code += len(lists_of_items_by_state['unexpected_values'])
+    if report is not None:
+        report.stop()
+        click.echo("\n" + _render_table(report.table_data(), "Memory usage", ascii=True), err=True)
+    if profiler is not None:
+        profiler.stop()
+        if profile:
+            click.echo("\n" + _render_table(profiler.table_data(), "Time by phase", ascii=True), err=True)
+            click.echo("\n" + _render_table(profiler.steps_table_data(), "Time by step", ascii=True), err=True)
+            click.echo("\n" + _render_table(profiler.types_table_data(), "Compared elements by type", ascii=True),
+                       err=True)
+            if profile_slowest:
+                click.echo("\n" + _render_table(profiler.slowest_table_data(), "Slowest elements", ascii=True),
+                           err=True)
     if test:
-        logger.info("Exiting with number of conflicts:" + str(len(lists_of_items_by_state['conflict'])))
-        exit_code += len(lists_of_items_by_state['conflict'])
+        logger.info("Exiting with number of conflicts")
     if empty_config:
-        unexpected_values_pprint(lists_of_items_by_state, ascii=ascii)
         logger.info("Exiting with number of values in configurationElements")
-        exit_code += len(lists_of_items_by_state['unexpected_values'])
     logger.info("End of execution of the diff tool for vRO packages.")
     exit(exit_code)
 
 
 def main():
     """Start the main diff process."""
-    logger.info("Starting the diff tool for vRO packages.")
     cli(obj={})
 
 
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""Define PackageCache object class."""
+
+# default python modules
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# third Party
+from packaging import version
+
+# local imports
+from . import __version__
+from .config import CACHE_DB_NAME, CACHE_MAX_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+"""int: Size of the chunks read to compute the content hash of a package file."""
+
+ROW_OVERHEAD = 64
+"""int: Estimated size (bytes) of a cached element, in addition to its text values."""
+
+
+def package_key(package):
+    """Compute the cache key of a package, from its content and from the tool version.
+
+    Args:
+        package (str or file): Path to a package file or folder, or a binary file object.
+
+    Returns:
+        str: the cache key.
+    """
+    sha256 = hashlib.sha256()
+    if isinstance(package, str) and os.path.isdir(package):
+        for folder, folders, files in os.walk(package):
+            folders.sort()
+            for file_name in sorted(files):
+                file_path = os.path.join(folder, file_name)
+                sha256.update(os.path.relpath(file_path, package).encode('utf-8'))
+                with open(file_path, 'rb') as package_file:
+                    for chunk in iter(lambda: package_file.read(HASH_CHUNK_SIZE), b''):
+                        sha256.update(chunk)
+    elif isinstance(package, str):
+        with open(package, 'rb') as package_file:
+            for chunk in iter(lambda: package_file.read(HASH_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+    else:
+        package.seek(0)
+        for chunk in iter(lambda: package.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+        package.seek(0)
+    return "%s-%s" % (sha256.hexdigest(), __version__)
+
+
+class PackageCache():
+    """Persistent cache of the elements read from packages, stored in an SQLite database.
+
+    The cache can be used from several threads: they share a connection, used by one thread at a time.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = CACHE_MAX_SIZE):
+        """Open (or create) a cache in a folder.
+
+        Args:
+            cache_dir (str): Folder of the cache database.
+            max_size (int, optional): Maximum size (bytes) of the cached data: least recently used
+                packages are evicted beyond this size. Defaults to CACHE_MAX_SIZE.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_size = max_size
+        # the connection is created by the main thread and used by the threads reading the reference packages
+        self.connection = sqlite3.connect(os.path.join(cache_dir, CACHE_DB_NAME), timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS packages "
+                "(key TEXT PRIMARY KEY, size INTEGER, last_used REAL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS elements "
+                "(package_key TEXT, position INTEGER, id TEXT, type TEXT, name TEXT, version TEXT, "
+                "checksum TEXT, data_size INTEGER, valued_items INTEGER, fingerprint TEXT, "
+                "PRIMARY KEY (package_key, position))"
+            )
+
+    def close(self):
+        """Close the cache database."""
+        with self.lock:
+            self.connection.close()
+
+    def get(self, key: str):
+        """Get the elements of a package from the cache.
+
+        Args:
+            key (str): The package key, from `package_key`.
+
+        Returns:
+            list of tuple: (summary, valued_items, fingerprint) of each element, in the order of the
+                package file, or None if the package is not in the cache.
+        """
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE packages SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            if not cursor.rowcount:
+                logger.info("Package %s is not in the cache", key)
+                return None
+            rows = self.connection.execute(
+                "SELECT id, type, name, version, checksum, data_size, valued_items, fingerprint "
+                "FROM elements WHERE package_key = ? ORDER BY position", (key,)
+            ).fetchall()
+        logger.info("Package %s found in the cache (%d elements)", key, len(rows))
+        return [
+            (
+                (item_id, item_type, name, _version if _version == "n/a" else version.parse(_version),
+                 checksum, data_size),
+                valued_items,
+                tuple(tuple(entry) for entry in json.loads(fingerprint)) if fingerprint else None
+            )
+            for item_id, item_type, name, _version, checksum, data_size, valued_items, fingerprint in rows
+        ]
+
+    def put(self, key: str, vro_items: list):
+        """Store the elements of a package in the cache.
+
+        The values of the ConfigurationElements are counted before being stored.
+
+        Args:
+            key (str): The package key, from `package_key`.
+            vro_items (VROElementMetadata[]): The package elements.
+        """
+        rows = []
+        for position, vro_item in enumerate(vro_items):
+            if vro_item.type == "ConfigurationElement":
+                vro_item.count_values_from_configuration_elt()
+            rows.append((
+                key, position, vro_item.id, vro_item.type, vro_item.name, str(vro_item.version),
+                vro_item.checksum, vro_item.data_size, vro_item.valued_items,
+                json.dumps(vro_item.fingerprint) if vro_item.fingerprint else None
+            ))
+        size = sum(ROW_OVERHEAD + sum(len(str(value)) for value in row) for row in rows)
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM elements WHERE package_key = ?", (key,))
+            self.connection.executemany("INSERT INTO elements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO packages VALUES (?, ?, ?)", (key, size, time.time())
+            )
+        logger.info("Package %s stored in the cache (%d elements)", key, len(rows))
+        self.evict()
+
+    def evict(self):
+        """Evict the least recently used packages beyond the maximum size of the cache.
+
+        The most recently used package is always kept.
+        """
+        with self.lock, self.connection:
+            packages = self.connection.execute(
+                "SELECT key, size FROM packages ORDER BY last_used DESC"
+            ).fetchall()
+            total_size = 0
+            for position, (key, size) in enumerate(packages):
+                total_size += size
+                if total_size > self.max_size and position:
+                    logger.info("Evicting package %s from the cache", key)
+                    self.connection.execute("DELETE FROM elements WHERE package_key = ?", (key,))
+                    self.connection.execute("DELETE FROM packages WHERE key = ?", (key,))
@@ -4,15 +4,39 @@
 # default python modules
 import logging
 
-# external modules
-import colored
-
 LOGGING_LEVEL_FILE = logging.DEBUG
 """int: Log level to use."""
 
 LOGGING_FILE = "diff.log"
 """str: Log file location."""
 
+CONTENT_MEMORY_BUDGET = 256 * 1024 * 1024
+"""int: Memory budget (bytes) for the content of the elements kept in memory."""
+
+CACHE_DB_NAME = "vro-package-diff.sqlite"
+"""str: File name of the cache database, in the cache folder."""
+
+CACHE_MAX_SIZE = 64 * 1024 * 1024
+"""int: Maximum size (bytes) of the packages data stored in the cache."""
+
+REFERENCE_CACHE_SIZE = 4
+"""int: Number of reference packages whose items are kept in memory by the comparison server."""
+
+SERVER_ADDRESS = "127.0.0.1:8642"
+"""str: Default address of the comparison server (``host:port`` or ``unix:<path>``)."""
+
+DIFF_ENGINE = "difflib"
+"""str: Default engine used to compute the diff files."""
+
+DIFF_MAX_EDITS = 2000
+"""int: Maximum number of inserted and deleted lines of an element for a line-by-line diff file (Myers engine)."""
+
+DIFF_MAX_SIZE = 16 * 1024 * 1024
+"""int: Maximum size (characters) of the two contents of an element for a line-by-line diff file."""
+
+DIFF_TIMEOUT = 30
+"""int: Maximum time (seconds) to compute the diff file of an element."""
+
 SUPPORTED_ELEMENT_TYPES = [
     "Workflow",
     "ScriptModule",
@@ -27,35 +51,41 @@ OUTPUT_SETUP = {
     'no_upgrade': {
         'symbol_utf8': ' ⇄ ',
         'symbol_ascii': '<->',
-        'color': colored.fg("turquoise_2"),
+        'color': "turquoise_2",
         'legend': "Items with no upgrade required"
     },
     'upgrade': {
         'symbol_utf8': ' ⇉ ',
         'symbol_ascii': '==>',
-        'color': colored.fg("chartreuse_2a"),
+        'color': "chartreuse_2a",
         'legend': "Items that will be upgraded in import process"
     },
     'new': {
         'symbol_utf8': ' ⊕ ',
         'symbol_ascii': '[+]',
-        'color': colored.fg("yellow_1"),
+        'color': "yellow_1",
         'legend': "New items (will be imported)"
     },
     'unsupported': {
         'symbol_utf8': ' ⇄ ',
         'symbol_ascii': ' ? ',
-        'color': colored.fg("grey_78"),
+        'color': "grey_78",
         'legend': "Items ignored in the vRO merge process"
     },
     'conflict': {
         'symbol_utf8': ' ≠ ',
         'symbol_ascii': '=/=',
-        'color': colored.fg("red_1"),
+        'color': "red_1",
         'legend': "Items with a version conflict"
     },
+    'removed': {
+        'symbol_utf8': ' ⊖ ',
+        'symbol_ascii': '[-]',
+        'color': "orange_1",
+        'legend': "Items only in the reference package (will be kept)"
+    },
 }
-"""dict: Define the configuration of output display (color and symbols)"""
+"""dict: Define the configuration of output display (color name and symbols)"""
 
 CLI_CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 """dict: Click module settings to add two way to get help."""
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""Generate unified diff files between two versions of vRO elements."""
+
+# default python modules
+import logging
+import os
+import time
+
+# local imports
+from .config import DIFF_ENGINE, DIFF_MAX_EDITS, DIFF_MAX_SIZE, DIFF_TIMEOUT
+from .diff_engine import DiffTimeout, DiffTooLarge, unified_diff
+from .profiling import step
+
+
+logger = logging.getLogger(__name__)
+
+PENDING_DIFFS_PER_JOB = 2
+"""int: Maximum number of diff files waiting for each worker process."""
+
+
+class DiffOptions():
+    """Engine and limits used to write the diff files."""
+
+    __slots__ = ('engine', 'max_size', 'timeout', 'max_edits')
+
+    def __init__(self, engine: str = DIFF_ENGINE, max_size: int = DIFF_MAX_SIZE, timeout: float = DIFF_TIMEOUT,
+                 max_edits: int = DIFF_MAX_EDITS):
+        """Build a new DiffOptions object.
+
+        Args:
+            engine (str, optional): Name of the diff engine (see `diff_engine.DIFF_ENGINES`). Defaults
+                to DIFF_ENGINE.
+            max_size (int, optional): Maximum size (characters) of the two contents of an element for a
+                line-by-line diff (0 for no limit). Defaults to DIFF_MAX_SIZE.
+            timeout (float, optional): Maximum time (seconds) to compute a diff (0 for no limit).
+                Defaults to DIFF_TIMEOUT.
+            max_edits (int, optional): Maximum number of inserted and deleted lines of an element for a
+                line-by-line diff with the Myers engine (0 for no limit). Defaults to DIFF_MAX_EDITS.
+        """
+        self.engine = engine
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_edits = max_edits
+
+
+def prepare_diff_file(src_elt, dst_elt, src_name: str, dst_name: str, diff_folder: str, state: str,
+                      options: DiffOptions = None):
+    """Prepare the generation of a diff file between two versions of element data_content.
+
+    Args:
+        src_elt (VROElementMetadata): Primary content.
+        dst_elt (VROElementMetadata): Destination content.
+        src_name (str): Name of the source content.
+        dst_name (str): Name of the destination content.
+        diff_folder (str): Destination folder to store diff files.
+        state (str): State of the current item (used for sub folder)
+        options (DiffOptions, optional): Engine and limits of the diff. Defaults to None: the default
+            options.
+
+    ResourceElements with the same content are skipped: first from the checksums of their nested
+    zip files, without reading them, then from the size and SHA-1 of the resources. Binary
+    ResourceElements, or ResourceElements beyond the diff size limit, are not loaded: the diff file
+    only summarizes their sizes and checksums, and is written right away.
+
+    Returns:
+        tuple: arguments for `write_diff_file` (including the diff options), or None if there is no
+            text content to compare.
+    """
+    options = options or DiffOptions()
+    fromfile = "%s - %s: %s (%s)" % (src_name, src_elt.type, src_elt.name, src_elt.version)
+    tofile = "%s - %s: %s (%s)" % (dst_name, dst_elt.type, dst_elt.name, dst_elt.version)
+    if src_elt.type == "ResourceElement" and dst_elt.type == "ResourceElement":
+        if src_elt.checksum is not None and src_elt.checksum == dst_elt.checksum:
+            logger.debug("Same resource file for element with ID: %s", src_elt.id)
+            return None
+        src_summary, dst_summary = src_elt.resource_summary(), dst_elt.resource_summary()
+        if src_summary[1:3] == dst_summary[1:3]:
+            logger.debug("Same resource content for element with ID: %s", src_elt.id)
+            return None
+        reason = None
+        if not (src_summary[3] and dst_summary[3]):
+            reason = "binary content"
+        elif options.max_size and src_summary[1] + dst_summary[1] > options.max_size:
+            reason = "contents larger than %d bytes" % options.max_size
+        if reason:
+            logger.info("Summarizing the resource content for element with ID: %s (%s)", src_elt.id, reason)
+            with open(_diff_file_path(src_elt, diff_folder, state), 'w', encoding='utf-8') as output_f:
+                output_f.writelines(_resources_differ(src_summary, dst_summary, fromfile, tofile, reason))
+            return None
+    if not (src_elt.dec_data_content and dst_elt.dec_data_content):
+        logger.info("Ignoring (binary?) content for element with ID: %s", src_elt.id)
+        return None
+    return (
+        src_elt.dec_data_content,
+        dst_elt.dec_data_content,
+        fromfile,
+        tofile,
+        _diff_file_path(src_elt, diff_folder, state),
+        options.engine,
+        options.max_size,
+        options.timeout,
+        options.max_edits
+    )
+
+
+def write_diff_file(src_content: str, dst_content: str, fromfile: str, tofile: str, file_path: str,
+                    engine: str = DIFF_ENGINE, max_size: int = DIFF_MAX_SIZE, timeout: float = DIFF_TIMEOUT,
+                    max_edits: int = DIFF_MAX_EDITS):
+    """Write a unified diff file between two contents.
+
+    Beyond the size, time or edits limits, the diff file only tells that the contents differ.
+
+    Args:
+        src_content (str): Primary content.
+        dst_content (str): Destination content.
+        fromfile (str): Header for the primary content.
+        tofile (str): Header for the destination content.
+        file_path (str): Path of the diff file.
+        engine (str, optional): Name of the diff engine. Defaults to DIFF_ENGINE.
+        max_size (int, optional): Maximum size (characters) of the two contents (0 for no limit).
+            Defaults to DIFF_MAX_SIZE.
+        timeout (float, optional): Maximum time (seconds) to compute the diff (0 for no limit).
+            Defaults to DIFF_TIMEOUT.
+        max_edits (int, optional): Maximum number of inserted and deleted lines, for the Myers engine
+            (0 for no limit). Defaults to DIFF_MAX_EDITS.
+    """
+    src_lines = src_content.splitlines(keepends=True)
+    dst_lines = dst_content.splitlines(keepends=True)
+    if max_size and len(src_content) + len(dst_content) > max_size:
+        logger.warning("Contents are too large for a diff: %s", file_path)
+        lines = _files_differ(src_lines, dst_lines, fromfile, tofile, "contents larger than %d characters" % max_size)
+    else:
+        try:
+            lines = unified_diff(src_lines, dst_lines, fromfile=fromfile, tofile=tofile, n=3, engine=engine,
+                                 deadline=time.monotonic() + timeout if timeout else None,
+                                 max_edits=max_edits or None)
+        except DiffTimeout:
+            logger.warning("Diff computation timed out: %s", file_path)
+            lines = _files_differ(src_lines, dst_lines, fromfile, tofile, "diff longer than %s seconds" % timeout)
+        except DiffTooLarge:
+            logger.warning("Contents have too many different lines for a diff: %s", file_path)
+            lines = _files_differ(src_lines, dst_lines, fromfile, tofile, "more than %d edited lines" % max_edits)
+    with open(file_path, 'w', encoding='utf-8') as output_f:
+        output_f.writelines(lines)
+
+
+def _files_differ(src_lines: list, dst_lines: list, fromfile: str, tofile: str, reason: str):
+    """Summarize the difference between two contents without comparing their lines.
+
+    Args:
+        src_lines (str[]): Lines of the primary content.
+        dst_lines (str[]): Lines of the destination content.
+        fromfile (str): Header for the primary content.
+        tofile (str): Header for the destination content.
+        reason (str): Why the lines are not compared.
+
+    Returns:
+        str[]: the lines of the summary.
+    """
+    return [
+        "--- %s\n" % fromfile,
+        "+++ %s\n" % tofile,
+        "Files differ: %d lines (%d characters) and %d lines (%d characters); no line diff (%s)\n" % (
+            len(src_lines), sum(map(len, src_lines)), len(dst_lines), sum(map(len, dst_lines)), reason)
+    ]
+
+
+def _diff_file_path(src_elt, diff_folder: str, state: str):
+    """Get the path of the diff file of an element, and create its folder.
+
+    Args:
+        src_elt (VROElementMetadata): Primary content.
+        diff_folder (str): Destination folder to store diff files.
+        state (str): State of the current item (used for sub folder)
+
+    Returns:
+        str: the path of the diff file.
+    """
+    diff_folder_target = os.path.join(diff_folder, state, src_elt.type.lower())
+    if not os.path.isdir(diff_folder_target):
+        logger.debug("Creating a missing diff target folder: %s", diff_folder_target)
+        os.makedirs(diff_folder_target, exist_ok=True)
+    return os.path.join(diff_folder_target, src_elt.id + ".diff")
+
+
+def remove_diff_file(item_id: str, item_type: str, diff_folder: str, state: str):
+    """Remove the diff file of an element, if it exists.
+
+    Args:
+        item_id (str): ID of the element.
+        item_type (str): Type of the element.
+        diff_folder (str): Folder of the diff files.
+        state (str): State of the element when its diff file was written.
+    """
+    file_path = os.path.join(diff_folder, state, item_type.lower(), item_id + ".diff")
+    if os.path.exists(file_path):
+        logger.debug("Removing the diff file: %s", file_path)
+        os.remove(file_path)
+
+
+def _resources_differ(src_summary: tuple, dst_summary: tuple, fromfile: str, tofile: str, reason: str):
+    """Summarize the difference between two resource contents from their sizes and checksums.
+
+    Args:
+        src_summary (tuple): Summary of the primary resource, from `VROElementMetadata.resource_summary`.
+        dst_summary (tuple): Summary of the destination resource.
+        fromfile (str): Header for the primary content.
+        tofile (str): Header for the destination content.
+        reason (str): Why the contents are not compared.
+
+    Returns:
+        str[]: the lines of the summary.
+    """
+    return [
+        "--- %s\n" % fromfile,
+        "+++ %s\n" % tofile,
+        "Resources differ: %d bytes (%s, SHA-1 %s) and %d bytes (%s, SHA-1 %s); no line diff (%s)\n" % (
+            src_summary[1], src_summary[0] or "unknown type", src_summary[2],
+            dst_summary[1], dst_summary[0] or "unknown type", dst_summary[2], reason)
+    ]
+
+
+def create_diff_file(src_elt, dst_elt, src_name: str, dst_name: str, diff_folder: str, state: str,
+                     options: DiffOptions = None):
+    """Create a diff file between two versions of element data_content.
+
+    Args:
+        src_elt (VROElementMetadata): Primary content.
+        dst_elt (VROElementMetadata): Destination content.
+        src_name (str): Name of the source content.
+        dst_name (str): Name of the destination content.
+        diff_folder (str): Destination folder to store diff files.
+        state (str): State of the current item (used for sub folder)
+        options (DiffOptions, optional): Engine and limits of the diff. Defaults to None: the default
+            options.
+    """
+    diff_args = prepare_diff_file(src_elt, dst_elt, src_name, dst_name, diff_folder, state, options)
+    if diff_args is None:
+        return
+    logger.info("Creating a new diff file for element ID: %s", src_elt.id)
+    write_diff_file(*diff_args)
+    logger.info("End of diff file generation for the element with ID: %s", src_elt.id)
+
+
+def create_diff_files(diff_items: list, src_name: str, dst_name: str, diff_folder: str, jobs: int = 1,
+                      executor=None, options: DiffOptions = None):
+    """Create the diff files for a list of elements.
+
+    Largest elements are scheduled first, so that a huge element does not delay the end of the
+    generation. With more than one job, files are written by a pool of worker processes, fed with
+    a bounded number of pending diffs.
+
+    Args:
+        diff_items (list of tuple): (source element, destination element, state) to compare.
+        src_name (str): Name of the source content.
+        dst_name (str): Name of the destination content.
+        diff_folder (str): Destination folder to store diff files.
+        jobs (int, optional): Number of worker processes. Defaults to 1.
+        executor (concurrent.futures.Executor, optional): Pool of processes. Defaults to None: a pool
+            is created if jobs > 1.
+        options (DiffOptions, optional): Engine and limits of the diffs. Defaults to None: the default
+            options.
+    """
+    diff_items = sorted(diff_items, key=lambda item: item[0].data_size + item[1].data_size, reverse=True)
+    if jobs <= 1:
+        for src_elt, dst_elt, state in diff_items:
+            with step("Diff files", src_elt.id):
+                create_diff_file(src_elt, dst_elt, src_name, dst_name, diff_folder, state, options)
+        return
+    if executor is None:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            create_diff_files(diff_items, src_name, dst_name, diff_folder, jobs, executor, options)
+        return
+    from concurrent.futures import FIRST_COMPLETED, wait
+    logger.info("Creating %d diff files with %d processes", len(diff_items), jobs)
+    pending = set()
+    for src_elt, dst_elt, state in diff_items:
+        with step("Diff files", src_elt.id):
+            diff_args = prepare_diff_file(src_elt, dst_elt, src_name, dst_name, diff_folder, state, options)
+            if diff_args is None:
+                continue
+            if len(pending) >= jobs * PENDING_DIFFS_PER_JOB:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            logger.debug("Scheduling a new diff file for element ID: %s", src_elt.id)
+            pending.add(executor.submit(write_diff_file, *diff_args))
+    with step("Diff files"):
+        for future in pending:
+            future.result()
+    logger.info("End of diff files generation")
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+"""Compute line-based differences between two texts, with pluggable engines."""
+
+# default python modules
+import time
+
+
+class DiffTimeout(Exception):
+    """The computation of a diff was longer than its time limit."""
+
+
+class DiffTooLarge(Exception):
+    """The two texts of a diff need more edits than its limit."""
+
+
+def _check_deadline(deadline: float):
+    """Raise DiffTimeout if a deadline is over.
+
+    Args:
+        deadline (float): Deadline, as a `time.monotonic` value, or None.
+
+    Raises:
+        DiffTimeout: the deadline is over.
+    """
+    if deadline is not None and time.monotonic() > deadline:
+        raise DiffTimeout()
+
+
+def hash_lines(a: list, b: list):
+    """Replace the lines of two texts by integers, equal for equal lines.
+
+    Args:
+        a (str[]): Lines of the first text.
+        b (str[]): Lines of the second text.
+
+    Returns:
+        tuple: the integer lists of the first and second texts.
+    """
+    ids = {}
+    return [ids.setdefault(line, len(ids)) for line in a], [ids.setdefault(line, len(ids)) for line in b]
+
+
+def myers_matching_blocks(a: list, b: list, deadline: float = None, max_edits: int = None):
+    """Find the longest common subsequence of two sequences with the Myers O(ND) algorithm.
+
+    The linear space variant of the algorithm is used: memory grows with the length of the
+    sequences, not with the number of edits.
+
+    Args:
+        a (list): First sequence (of hashable and cheaply comparable items).
+        b (list): Second sequence.
+        deadline (float, optional): Deadline, as a `time.monotonic` value. Defaults to None.
+        max_edits (int, optional): Maximum number of inserted and deleted items. Defaults to None:
+            no limit.
+
+    Raises:
+        DiffTimeout: the deadline is over.
+        DiffTooLarge: the sequences need more than max_edits edits.
+
+    Returns:
+        list of tuple: (i, j, n) matching blocks, like `difflib.SequenceMatcher.get_matching_blocks`.
+    """
+    n, m = len(a), len(b)
+    # common prefix and suffix are matched without running the algorithm
+    prefix = 0
+    while prefix < n and prefix < m and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and suffix < m - prefix and a[n - 1 - suffix] == b[m - 1 - suffix]:
+        suffix += 1
+    # items that are only in one sequence cannot match: they are removed before running the algorithm
+    common = set(a[prefix:n - suffix]).intersection(b[prefix:m - suffix])
+    a_index = [i for i in range(prefix, n - suffix) if a[i] in common]
+    b_index = [j for j in range(prefix, m - suffix) if b[j] in common]
+    if max_edits is not None:
+        # the removed items are edits too
+        max_edits -= (n - prefix - suffix - len(a_index)) + (m - prefix - suffix - len(b_index))
+        if max_edits < 0:
+            raise DiffTooLarge()
+    matches = []
+    _myers_matches([a[i] for i in a_index], [b[j] for j in b_index], matches, deadline, max_edits)
+    blocks = []
+    if prefix:
+        blocks.append([0, 0, prefix])
+    for i, j in matches:
+        i, j = a_index[i], b_index[j]
+        if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1][2] += 1
+        else:
+            blocks.append([i, j, 1])
+    if suffix:
+        if blocks and blocks[-1][0] + blocks[-1][2] == n - suffix and blocks[-1][1] + blocks[-1][2] == m - suffix:
+            blocks[-1][2] += suffix
+        else:
+            blocks.append([n - suffix, m - suffix, suffix])
+    return [tuple(block) for block in blocks] + [(n, m, 0)]
+
+
+def _myers_matches(a: list, b: list, matches: list, deadline: float = None, max_edits: int = None,
+                   a_offset: int = 0, b_offset: int = 0):
+    """Find the matching items of two sequences with the linear space Myers algorithm.
+
+    The sequences are split at the middle of an optimal edit path, found by running the algorithm
+    from both ends at the same time, and both halves are compared recursively: the recursion depth
+    grows with the logarithm of the number of edits.
+
+    Args:
+        a (list): First sequence.
+        b (list): Second sequence.
+        matches (list of tuple): (i, j) indexes of the matching items, extended in order.
+        deadline (float, optional): Deadline, as a `time.monotonic` value. Defaults to None.
+        max_edits (int, optional): Maximum number of inserted and deleted items. Defaults to None:
+            no limit.
+        a_offset (int, optional): Index of the first item of a in the whole first sequence. Defaults to 0.
+        b_offset (int, optional): Index of the first item of b in the whole second sequence. Defaults to 0.
+
+    Raises:
+        DiffTimeout: the deadline is over.
+        DiffTooLarge: the sequences need more than max_edits edits.
+    """
+    n, m = len(a), len(b)
+    prefix = 0
+    while prefix < n and prefix < m and a[prefix] == b[prefix]:
+        matches.append((a_offset + prefix, b_offset + prefix))
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and suffix < m - prefix and a[n - 1 - suffix] == b[m - 1 - suffix]:
+        suffix += 1
+    if prefix < n - suffix and prefix < m - suffix:
+        a_middle, b_middle = a[prefix:n - suffix], b[prefix:m - suffix]
+        x, y = _myers_middle(a_middle, b_middle, deadline, max_edits)
+        if x is not None:
+            _myers_matches(a_middle[:x], b_middle[:y], matches, deadline, None, a_offset + prefix, b_offset + prefix)
+            _myers_matches(a_middle[x:], b_middle[y:], matches, deadline, None, a_offset + prefix + x,
+                           b_offset + prefix + y)
+    elif max_edits is not None and (n - prefix - suffix) + (m - prefix - suffix) > max_edits:
+        raise DiffTooLarge()
+    matches.extend((a_offset + n - suffix + i, b_offset + m - suffix + i) for i in range(suffix))
+
+
+def _myers_middle(a: list, b: list, deadline: float = None, max_edits: int = None):
+    """Find the middle of an optimal edit path between two sequences.
+
+    The furthest reaching paths are followed from the start and from the end of both sequences
+    until they overlap. Only the furthest position on each diagonal is kept, for each direction.
+
+    Args:
+        a (list): First sequence, not empty, without common prefix and suffix with b.
+        b (list): Second sequence, not empty.
+        deadline (float, optional): Deadline, as a `time.monotonic` value. Defaults to None.
+        max_edits (int, optional): Maximum number of inserted and deleted items. Defaults to None:
+            no limit.
+
+    Raises:
+        DiffTimeout: the deadline is over.
+        DiffTooLarge: the sequences need more than max_edits edits.
+
+    Returns:
+        tuple: (x, y) position where to split the sequences, or (None, None) if they have no
+            common item.
+    """
+    n, m = len(a), len(b)
+    max_d = (n + m + 1) // 2
+    offset = max_d
+    forward = [-1] * (2 * max_d + 2)
+    backward = [-1] * (2 * max_d + 2)
+    forward[offset + 1] = backward[offset + 1] = 0
+    delta = n - m
+    odd = delta % 2 != 0
+    # diagonals beyond the end of a sequence are skipped
+    k1_start = k1_end = k2_start = k2_end = 0
+    for d in range(max_d):
+        _check_deadline(deadline)
+        if max_edits is not None and 2 * d - 1 > max_edits:
+            raise DiffTooLarge()
+        for k1 in range(-d + k1_start, d + 1 - k1_end, 2):
+            if k1 == -d or (k1 != d and forward[offset + k1 - 1] < forward[offset + k1 + 1]):
+                x1 = forward[offset + k1 + 1]
+            else:
+                x1 = forward[offset + k1 - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[x1] == b[y1]:
+                x1 += 1
+                y1 += 1
+            forward[offset + k1] = x1
+            if x1 > n:
+                k1_end += 2
+            elif y1 > m:
+                k1_start += 2
+            elif odd:
+                k2 = offset + delta - k1
+                if 0 <= k2 < len(backward) and backward[k2] != -1 and x1 >= n - backward[k2]:
+                    return x1, y1
+        for k2 in range(-d + k2_start, d + 1 - k2_end, 2):
+            if k2 == -d or (k2 != d and backward[offset + k2 - 1] < backward[offset + k2 + 1]):
+                x2 = backward[offset + k2 + 1]
+            else:
+                x2 = backward[offset + k2 - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[n - x2 - 1] == b[m - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            backward[offset + k2] = x2
+            if x2 > n:
+                k2_end += 2
+            elif y2 > m:
+                k2_start += 2
+            elif not odd:
+                k1 = offset + delta - k2
+                if 0 <= k1 < len(forward) and forward[k1] != -1:
+                    x1 = forward[k1]
+                    if x1 >= n - x2:
+                        if max_edits is not None and 2 * d > max_edits:
+                            raise DiffTooLarge()
+                        return x1, x1 - (k1 - offset)
+    if max_edits is not None and n + m > max_edits:
+        raise DiffTooLarge()
+    return None, None
+
+
+def opcodes_from_blocks(blocks: list):
+    """Convert matching blocks to opcodes, like `difflib.SequenceMatcher.get_opcodes`.
+
+    Args:
+        blocks (list of tuple): (i, j, n) matching blocks, ending with a (len(a), len(b), 0) block.
+
+    Returns:
+        list of tuple: (tag, i1, i2, j1, j2) opcodes.
+    """
+    i = j = 0
+    opcodes = []
+    for ai, bj, size in blocks:
+        tag = ''
+        if i < ai and j < bj:
+            tag = 'replace'
+        elif i < ai:
+            tag = 'delete'
+        elif j < bj:
+            tag = 'insert'
+        if tag:
+            opcodes.append((tag, i, ai, j, bj))
+        i, j = ai + size, bj + size
+        if size:
+            opcodes.append(('equal', ai, i, bj, j))
+    return opcodes
+
+
+def myers_opcodes(a: list, b: list, deadline: float = None, max_edits: int = None):
+    """Compute the opcodes between two lists of lines with the Myers algorithm on hashed lines.
+
+    Args:
+        a (str[]): Lines of the first text.
+        b (str[]): Lines of the second text.
+        deadline (float, optional): Deadline, as a `time.monotonic` value. Defaults to None.
+        max_edits (int, optional): Maximum number of inserted and deleted lines. Defaults to None:
+            no limit.
+
+    Raises:
+        DiffTimeout: the deadline is over.
+        DiffTooLarge: the texts need more than max_edits edits.
+
+    Returns:
+        list of tuple: (tag, i1, i2, j1, j2) opcodes.
+    """
+    a_ids, b_ids = hash_lines(a, b)
+    return opcodes_from_blocks(myers_matching_blocks(a_ids, b_ids, deadline, max_edits))
+
+
+def difflib_opcodes(a: list, b: list, deadline: float = None, max_edits: int = None):
+    """Compute the opcodes between two lists of lines with `difflib.SequenceMatcher`.
+
+    The deadline is checked before each search of the longest matching block, so a slow
+    computation is interrupted between two searches. The number of edits is not limited:
+    SequenceMatcher does not grow with it.
+
+    Args:
+        a (str[]): Lines of the first text.
+        b (str[]): Lines of the second text.
+        deadline (float, optional): Deadline, as a `time.monotonic` value. Defaults to None.
+        max_edits (int, optional): Unused. Defaults to None.
+
+    Raises:
+        DiffTimeout: the deadline is over.
+
+    Returns:
+        list of tuple: (tag, i1, i2, j1, j2) opcodes.
+    """
+    from difflib import SequenceMatcher
+
+    class DeadlineSequenceMatcher(SequenceMatcher):
+        """SequenceMatcher checking the deadline before each search of a matching block."""
+
+        def find_longest_match(self, *args):
+            _check_deadline(deadline)
+            return super().find_longest_match(*args)
+
+    _check_deadline(deadline)
+    return DeadlineSequenceMatcher(None, a, b).get_opcodes()
+
+
+DIFF_ENGINES = {
+    "myers": myers_opcodes,
+    "difflib": difflib_opcodes,
+}
+"""dict: Diff engines by name: functions computing the opcodes between two lists of lines."""
+
+
+def group_opcodes(opcodes: list, n: int = 3):
+    """Group the opcodes in hunks with up to n lines of context, like `SequenceMatcher.get_grouped_opcodes`.
+
+    Args:
+        opcodes (list of tuple): (tag, i1, i2, j1, j2) opcodes.
+        n (int, optional): Number of context lines. Defaults to 3.
+
+    Yields:
+        list of tuple: the opcodes of each hunk.
+    """
+    codes = list(opcodes) or [("equal", 0, 1, 0, 1)]
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > n * 2:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def _format_range(start: int, stop: int):
+    """Format a range of lines for a unified diff hunk header."""
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return '%d' % beginning
+    if not length:
+        beginning -= 1
+    return '%d,%d' % (beginning, length)
+
+
+def unified_diff(a: list, b: list, fromfile: str = '', tofile: str = '', n: int = 3, engine: str = "difflib",
+                 deadline: float = None, max_edits: int = None):
+    """Compute a unified diff between two lists of lines, like `difflib.unified_diff`.
+
+    Args:
+        a (str[]): Lines of the first text (with their line endings).
+        b (str[]): Lines of the second text.
+        fromfile (str, optional): Header for the first text. Defaults to ''.
+        tofile (str, optional): Header for the second text. Defaults to ''.
+        n (int, optional): Number of context lines. Defaults to 3.
+        engine (str, optional): Name of the diff engine, in DIFF_ENGINES. Defaults to "difflib".
+        deadline (float, optional): Deadline, as a `time.monotonic` value. Defaults to None.
+        max_edits (int, optional): Maximum number of inserted and deleted lines, for the engines
+            that grow with it. Defaults to None: no limit.
+
+    Raises:
+        DiffTimeout: the deadline is over.
+        DiffTooLarge: the texts need more than max_edits edits.
+
+    Returns:
+        str[]: the lines of the unified diff (empty if both texts are equal).
+    """
+    lines = []
+    for group in group_opcodes(DIFF_ENGINES[engine](a, b, deadline, max_edits), n):
+        if not lines:
+            lines.append('--- %s\n' % fromfile)
+            lines.append('+++ %s\n' % tofile)
+        first, last = group[0], group[-1]
+        lines.append('@@ -%s +%s @@\n' % (_format_range(first[1], last[2]), _format_range(first[3], last[4])))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                lines.extend(' ' + line for line in a[i1:i2])
+                continue
+            if tag in ('replace', 'delete'):
+                lines.extend('-' + line for line in a[i1:i2])
+            if tag in ('replace', 'insert'):
+                lines.extend('+' + line for line in b[j1:j2])
+    return lines
@@ -0,0 +1,884 @@
+#!/usr/bin/env python
+"""Compare vRO packages without printing anything, from the command line or from a long-lived process."""
+
+# default python modules
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+# local imports
+from .config import SUPPORTED_ELEMENT_TYPES
+from .diff import create_diff_files, DiffOptions, remove_diff_file
+from .formats import element_record, StreamWriter
+from .package import ElementFilter, iter_vroitems_from_package, open_package
+from .profiling import phase, record_element, step
+
+
+logger = logging.getLogger(__name__)
+
+STATES = ['no_upgrade', 'upgrade', 'conflict', 'new', 'unsupported', 'unexpected_values', 'removed']
+"""list: Import states of the compared items (``unexpected_values`` items are also in another state)."""
+
+
+def start_process_pool(jobs: int):
+    """Start a pool of worker processes.
+
+    The processes are started right away: forking them later from a thread, while another thread
+    holds a lock, could deadlock them.
+
+    Args:
+        jobs (int): Number of worker processes.
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: the pool.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    executor = ProcessPoolExecutor(max_workers=jobs)
+    executor.submit(os.getpid).result()
+    return executor
+
+
+def get_vroitems_from_package(package, jobs: int = 1, reference_items: list = None, cache=None,
+                              executor=None, element_filter: ElementFilter = None, map_files: bool = True):
+    """Get all the items from the vRO Package.
+
+    Args:
+        package (str): Path to a package file or folder.
+        jobs (int, optional): Number of worker processes used to read the items. Defaults to 1.
+        reference_items (VROElementMetadata[], optional): Items of the reference package: items with
+            the same files are copied from them instead of being read. Defaults to None.
+        cache (PackageCache, optional): Persistent cache of the package items, only filled when all
+            the elements are selected by the element filter. Defaults to None.
+        executor (concurrent.futures.Executor, optional): Pool of processes used to read the items.
+            Defaults to None: a pool is created if jobs > 1.
+        element_filter (ElementFilter, optional): Filter of the items. Defaults to None: all the items.
+        map_files (bool, optional): Memory-map the package files. Defaults to True.
+
+    Returns:
+        VROElementMetadata[]: a list of VROElementMetadata.
+    """
+    if cache is None:
+        return list(iter_vroitems_from_package(package, jobs=jobs, reference_items=reference_items,
+                                               executor=executor, element_filter=element_filter,
+                                               map_files=map_files))
+    from .cache import package_key
+    key = package_key(package)
+    cached_items = cache.get(key)
+    if cached_items is not None:
+        return list(open_package(package, element_filter=element_filter, map_files=map_files
+                                 ).iter_cached_elements(cached_items))
+    vro_items = list(iter_vroitems_from_package(package, jobs=jobs, reference_items=reference_items,
+                                                executor=executor, element_filter=element_filter,
+                                                map_files=map_files))
+    if element_filter is None or not element_filter.active:
+        # the cache only stores all the items of a package, as they are filtered when read from it
+        cache.put(key, vro_items)
+    return vro_items
+
+
+def read_reference_package(package, jobs: int = 1, cache=None, executor=None, element_filter: ElementFilter = None,
+                           map_files: bool = True):
+    """Get all the items from the reference package, in the "Read reference package" phase.
+
+    Args:
+        package (str): Path to a package file or folder.
+        jobs (int, optional): Number of worker processes used to read the items. Defaults to 1.
+        cache (PackageCache, optional): Persistent cache of the package items. Defaults to None.
+        executor (concurrent.futures.Executor, optional): Pool of processes used to read the items.
+            Defaults to None: a pool is created if jobs > 1.
+        element_filter (ElementFilter, optional): Filter of the items. Defaults to None: all the items.
+        map_files (bool, optional): Memory-map the package files. Defaults to True.
+
+    Returns:
+        VROElementMetadata[]: a list of VROElementMetadata.
+    """
+    with phase("Read reference package"):
+        logger.info("Reading items from the source package")
+        return get_vroitems_from_package(package, jobs=jobs, cache=cache, executor=executor,
+                                         element_filter=element_filter, map_files=map_files)
+
+
+def item_state(isrc, idst):
+    """Get the import state of an item of the compared package.
+
+    Args:
+        isrc (VROElementMetadata): Item of the reference package, or None if it is not in it.
+        idst (VROElementMetadata): Item of the compared package.
+
+    Returns:
+        str: the import state: ``no_upgrade``, ``upgrade``, ``conflict``, ``new`` or ``unsupported``.
+    """
+    if idst.type not in SUPPORTED_ELEMENT_TYPES:
+        return 'unsupported'
+    if isrc is None:
+        return 'new'
+    if idst.version == "n/a":
+        return 'unsupported'
+    if idst.version > isrc.version:
+        return 'upgrade'
+    if idst.version < isrc.version or idst.checksum != isrc.checksum:
+        return 'conflict'
+    return 'no_upgrade'
+
+
+def classify_vro_items(items_src,
+                       items_dst,
+                       reference_package: str,
+                       compared_package: str,
+                       diff_folder: bool = None,
+                       empty_config: bool = True,
+                       jobs: int = 1,
+                       executor=None,
+                       writer: StreamWriter = None,
+                       diff_ids: set = None,
+                       diff_options: DiffOptions = None):
+    """Compare two vRO items lists, without printing the result.
+
+    Items of the destination list are classified as they come, so it can be an iterator that reads
+    them from the package.
+
+    Args:
+        items_src (VROElementMetadata[]): Original list of vRO items.
+        items_dst (VROElementMetadata[] or iterator): Destination vRO items.
+        reference_package (str): package to use as source.
+        compared_package (str): package to compare with reference one.
+        diff_folder (str, optional): Generate unified diff files output. Defaults to None.
+        empty_config (bool, optional): Count the values of the ConfigurationElements. Defaults to True.
+        jobs (int, optional): Number of processes used to generate diff files. Defaults to 1.
+        executor (concurrent.futures.Executor, optional): Pool of processes used to generate diff
+            files. Defaults to None: a pool is created if jobs > 1.
+        writer (StreamWriter, optional): Writer of the element records, written as soon as each
+            item is classified. Defaults to None.
+        diff_ids (set of str, optional): IDs of the items whose diff file is created. Defaults to
+            None: all the items.
+        diff_options (DiffOptions, optional): Engine and limits of the diff files. Defaults to None:
+            the default options.
+
+    Returns:
+        dict of VROElementMetadata[]: A dict of items, stored by import state. Items that are only
+            in the reference package are stored under the ``removed`` key.
+    """
+    lists_of_items_by_state = {
+        'no_upgrade': [],
+        'upgrade': [],
+        'conflict': [],
+        'new': [],
+        'unsupported': [],
+        'unexpected_values': [],
+        'removed': []
+    }
+    # index the reference items by id to match them in a single pass
+    items_src_by_id = {isrc.id: isrc for isrc in items_src}
+    items_dst_ids = set()
+    diff_items = []
+    for idst in items_dst:
+        with step("Matching", idst.id):
+            items_dst_ids.add(idst.id)
+            isrc = items_src_by_id.get(idst.id)
+            state = item_state(isrc, idst)
+            if idst.type in SUPPORTED_ELEMENT_TYPES:
+                if isrc is not None:
+                    logger.debug("%s is IN source package", idst)
+                    idst.comp_version = isrc.version
+                    if state == 'conflict':
+                        logger.warning("Conflict detected on item: %s", idst)
+                    if diff_folder and (diff_ids is None or idst.id in diff_ids):
+                        diff_items.append((isrc, idst, state))
+                else:
+                    logger.debug("%s is NOT IN source package", idst)
+                if idst.type == "ConfigurationElement" and empty_config:
+                    if idst.count_values_from_configuration_elt():
+                        lists_of_items_by_state['unexpected_values'].append(idst)
+            lists_of_items_by_state[state].append(idst)
+            if writer is not None:
+                writer.write_element(compared_package, state, idst, isrc)
+            record_element(idst)
+    for isrc in items_src:
+        if isrc.id not in items_dst_ids:
+            logger.debug("%s is ONLY IN source package", isrc)
+            lists_of_items_by_state['removed'].append(isrc)
+            if writer is not None:
+                writer.write_element(compared_package, 'removed', None, isrc)
+    if diff_folder:
+        create_diff_files(
+            diff_items,
+            src_name=reference_package,
+            dst_name=compared_package,
+            diff_folder=diff_folder,
+            jobs=jobs,
+            executor=executor,
+            options=diff_options
+        )
+    logger.info("File A: %d elements", len(items_src))
+    logger.info("File B: %d elements", len(items_dst_ids))
+    logger.info("Items to upgrade:\t\t%d", len(lists_of_items_by_state['upgrade']))
+    logger.info("Items without upgrade:\t%d", len(lists_of_items_by_state['no_upgrade']))
+    logger.info("Items in upgrade conflict:\t%d", len(lists_of_items_by_state['conflict']))
+    logger.info("New items:\t\t\t%d", len(lists_of_items_by_state['new']))
+    logger.info("ConfigurationElements with values:\t\t\t%d", len(lists_of_items_by_state['unexpected_values']))
+    if lists_of_items_by_state['unsupported']:
+        logger.info("Unsupported items:\t\t%d", len(lists_of_items_by_state['unsupported']))
+    if lists_of_items_by_state['removed']:
+        logger.info("Items missing from package:\t%d", len(lists_of_items_by_state['removed']))
+    total = (
+        len(lists_of_items_by_state['unsupported'])
+        + len(lists_of_items_by_state['upgrade'])
+        + len(lists_of_items_by_state['no_upgrade'])
+        + len(lists_of_items_by_state['conflict'])
+        + len(lists_of_items_by_state['new'])
+    )
+    logger.info("Total items:\t\t\t%s", total)
+    return lists_of_items_by_state
+
+
+def check_package(reference_package, compared_package, test: bool = True, empty_config: bool = False,
+                  first_error: bool = False, jobs: int = 1, executor=None, element_filter: ElementFilter = None):
+    """Count the errors of a package for a gate: the conflicts and the ConfigurationElements with values.
+
+    Nothing else is done: no records, tables or diff files, and only what is needed to decide is read.
+    Elements with the same fingerprint in both zip central directories cannot be in conflict: only
+    the other ones are read from the reference package. From the compared package, the data of the
+    other ones is only read for the ConfigurationElements with ``empty_config``, found from their
+    ``info`` file. With ``first_error``, the compared package is not read further than the first error.
+
+    Args:
+        reference_package (str): package to use as source.
+        compared_package (str): package to compare with reference one.
+        test (bool, optional): Count the items in conflict. Defaults to True.
+        empty_config (bool, optional): Count the ConfigurationElements with values. Defaults to False.
+        first_error (bool, optional): Stop at the first error. Defaults to False.
+        jobs (int, optional): Number of processes used to read items. Defaults to 1.
+        executor (concurrent.futures.Executor, optional): Shared pool of processes. Defaults to None.
+        element_filter (ElementFilter, optional): Filter of the items. Defaults to None: all the items.
+
+    Raises:
+        PackageReadError: a package is missing or corrupt.
+
+    Returns:
+        tuple: the number of items in ``conflict`` and with ``unexpected_values`` (dict), and the
+            first item in error (VROElementMetadata, or None).
+    """
+    counts = {'conflict': 0, 'unexpected_values': 0}
+    first_item = None
+    element_filter = element_filter or ElementFilter()
+    # the returned first item only needs its metadata: both readers can be closed
+    with open_package(compared_package, element_filter=element_filter) as reader, \
+            open_package(reference_package, element_filter=element_filter) as reference_reader:
+        differing = set()
+        for item_id in reader.entries:
+            fingerprint = reader.fingerprint(item_id)
+            if (fingerprint is None or item_id not in reference_reader.entries
+                    or fingerprint != reference_reader.fingerprint(item_id)):
+                differing.add(item_id)
+        logger.info("%d elements differ from the reference package", len(differing))
+        reference = {}
+        if test:
+            reference_ids = [item_id for item_id in reference_reader.entries if item_id in differing]
+            reference = {
+                vro_item.id: vro_item for vro_item in reference_reader.read_elements(reference_ids, jobs, executor)
+                if element_filter.match_name(vro_item.name)
+            }
+        items_id = [
+            item_id for item_id in reader.entries
+            if item_id in differing or (empty_config and reader.item_type(item_id) == "ConfigurationElement")
+        ]
+        items_dst = reader.read_elements(items_id, jobs, executor)
+        try:
+            for idst in items_dst:
+                if not element_filter.match_name(idst.name):
+                    continue
+                with step("Matching", idst.id):
+                    error = False
+                    if test and idst.id in differing and item_state(reference.get(idst.id), idst) == 'conflict':
+                        logger.warning("Conflict detected on item: %s", idst)
+                        counts['conflict'] += 1
+                        error = True
+                    if (empty_config and idst.type == "ConfigurationElement"
+                            and idst.count_values_from_configuration_elt()):
+                        counts['unexpected_values'] += 1
+                        error = True
+                if error and first_item is None:
+                    first_item = idst
+                    if first_error:
+                        logger.info("Stopping at the first error: %s", idst)
+                        break
+        finally:
+            # with a pool of processes, the pending elements are cancelled
+            items_dst.close()
+    return counts, first_item
+
+
+def compare_package(items_src,
+                    reference_package: str,
+                    compared_package: str,
+                    diff_folder: str = None,
+                    jobs: int = 1,
+                    executor=None,
+                    writer: StreamWriter = None,
+                    element_filter: ElementFilter = None,
+                    diff_options: DiffOptions = None,
+                    map_files: bool = True):
+    """Read a package and compare its items with the reference ones.
+
+    Items are compared while the package is read.
+
+    Args:
+        items_src (VROElementMetadata[] or concurrent.futures.Future): Items of the reference package,
+            or the future result of their reading.
+        reference_package (str): package to use as source.
+        compared_package (str): package to compare with reference one.
+        diff_folder (str, optional): Generate unified diff files output. Defaults to None.
+        jobs (int, optional): Number of processes used to read items and to generate diff files.
+            Defaults to 1.
+        executor (concurrent.futures.Executor, optional): Shared pool of processes. Defaults to None.
+        writer (StreamWriter, optional): Writer of the element records. Defaults to None.
+        element_filter (ElementFilter, optional): Filter of the items. Defaults to None: all the items.
+        diff_options (DiffOptions, optional): Engine and limits of the diff files. Defaults to None:
+            the default options.
+        map_files (bool, optional): Memory-map the package files. Defaults to True.
+
+    Raises:
+        PackageReadError: a package is missing or corrupt.
+
+    Returns:
+        dict of VROElementMetadata[]: A dict of items, stored by import state.
+    """
+    from concurrent.futures import Future
+    prefetched = None
+    if isinstance(items_src, Future):
+        # the items that differ from the reference package are read while it is being read
+        logger.info("Reading items from the destination package: %s", compared_package)
+        # the reference reader is only used for the fingerprints of its elements
+        with open_package(reference_package, element_filter=element_filter, map_files=map_files) as reference_reader:
+            prefetched = open_package(compared_package, element_filter=element_filter, map_files=map_files
+                                      ).prefetch_elements(reference_reader=reference_reader, jobs=jobs,
+                                                          executor=executor)
+        items_src = items_src.result()
+    logger.info("Reading and comparing items from the destination package: %s", compared_package)
+    items_dst = iter_vroitems_from_package(compared_package, jobs=jobs, reference_items=items_src,
+                                           executor=executor, prefetched=prefetched, element_filter=element_filter,
+                                           map_files=map_files)
+    return classify_vro_items(
+        items_src,
+        items_dst,
+        diff_folder=diff_folder,
+        jobs=jobs,
+        executor=executor,
+        reference_package=reference_package,
+        compared_package=compared_package,
+        writer=writer,
+        diff_options=diff_options
+    )
+
+
+def compare_packages(items_src,
+                     reference_package: str,
+                     compared_packages: list,
+                     diff_folder: str = None,
+                     jobs: int = 1,
+                     executor=None,
+                     writer: StreamWriter = None,
+                     element_filter: ElementFilter = None,
+                     diff_options: DiffOptions = None,
+                     map_files: bool = True):
+    """Compare several packages with the reference items, up to ``jobs`` packages at the same time.
+
+    Args:
+        items_src (VROElementMetadata[] or concurrent.futures.Future): Items of the reference package,
+            or the future result of their reading.
+        reference_package (str): package to use as source.
+        compared_packages (str[]): packages to compare with reference one.
+        diff_folder (str, optional): Generate unified diff files output, in a sub folder for each
+            package if there are several ones. Defaults to None.
+        jobs (int, optional): Number of processes used to read items and to generate diff files.
+            Defaults to 1.
+        executor (concurrent.futures.Executor, optional): Shared pool of processes. Defaults to None.
+        writer (StreamWriter, optional): Writer of the element records. Defaults to None.
+        element_filter (ElementFilter, optional): Filter of the items. Defaults to None: all the items.
+        diff_options (DiffOptions, optional): Engine and limits of the diff files. Defaults to None:
+            the default options.
+        map_files (bool, optional): Memory-map the package files. Defaults to True.
+
+    Returns:
+        list of dict: A dict of items, stored by import state, for each compared package.
+    """
+    if len(compared_packages) == 1:
+        return [compare_package(items_src, reference_package, compared_packages[0], diff_folder=diff_folder,
+                                jobs=jobs, executor=executor, writer=writer, element_filter=element_filter,
+                                diff_options=diff_options, map_files=map_files)]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(jobs, len(compared_packages))) as threads:
+        futures = [
+            threads.submit(
+                compare_package,
+                items_src,
+                reference_package=reference_package,
+                compared_package=package,
+                diff_folder=os.path.join(diff_folder, os.path.basename(package)) if diff_folder else None,
+                jobs=jobs,
+                executor=executor,
+                writer=writer,
+                element_filter=element_filter,
+                diff_options=diff_options,
+                map_files=map_files
+            )
+            for package in compared_packages
+        ]
+        return [future.result() for future in futures]
+
+
+class ConflictDetail():
+    """Details of an item in conflict with the reference package."""
+
+    __slots__ = ('id', 'name', 'type', 'reference_version', 'version', 'reference_checksum', 'checksum', 'reason')
+
+    def __init__(self, reference_item, vro_item):
+        """Build a new ConflictDetail object.
+
+        Args:
+            reference_item (VROElementMetadata): Item of the reference package.
+            vro_item (VROElementMetadata): Item of the compared package.
+        """
+        self.id = vro_item.id
+        self.name = vro_item.name
+        self.type = vro_item.type
+        self.reference_version = reference_item.version
+        self.version = vro_item.version
+        self.reference_checksum = reference_item.checksum
+        self.checksum = vro_item.checksum
+        if vro_item.version < reference_item.version:
+            self.reason = "lower version"
+        else:
+            self.reason = "same version, different content"
+
+    def __repr__(self):
+        """Define the representation of a ConflictDetail.
+
+        Returns:
+            str: the representation.
+        """
+        return "<ConflictDetail %s %s (%s -> %s): %s>" % (
+            self.type, self.id, self.reference_version, self.version, self.reason
+        )
+
+
+class ComparisonResult():
+    """The result of the comparison of a package with a reference package."""
+
+    __slots__ = ('reference_package', 'compared_package', 'items_by_state', 'reference_items', 'conflicts')
+
+    def __init__(self, reference_package, compared_package, items_by_state: dict, reference_items: list):
+        """Build a new ComparisonResult object.
+
+        Args:
+            reference_package (str): The reference package.
+            compared_package (str): The compared package.
+            items_by_state (dict of VROElementMetadata[]): The compared items, stored by import state,
+                as returned by `classify_vro_items`.
+            reference_items (VROElementMetadata[]): Items of the reference package.
+        """
+        self.reference_package = reference_package
+        self.compared_package = compared_package
+        self.items_by_state = items_by_state
+        self.reference_items = {vro_item.id: vro_item for vro_item in reference_items}
+        self.conflicts = [
+            ConflictDetail(self.reference_items[vro_item.id], vro_item) for vro_item in items_by_state['conflict']
+        ]
+
+    def __getitem__(self, state: str):
+        """Get the items of an import state.
+
+        Args:
+            state (str): The import state (see STATES).
+
+        Returns:
+            VROElementMetadata[]: the items.
+        """
+        return self.items_by_state[state]
+
+    @property
+    def counts(self):
+        """dict: Number of items of each import state."""
+        return {state: len(self.items_by_state[state]) for state in STATES}
+
+    @property
+    def safe_to_import(self):
+        """bool: True if no item is in conflict with the reference package."""
+        return not self.conflicts
+
+    def exit_code(self, test: bool = False, empty_config: bool = False):
+        """Get the exit status of the command line for this result.
+
+        Args:
+            test (bool, optional): Count the items in conflict. Defaults to False.
+            empty_config (bool, optional): Count the ConfigurationElements with values. Defaults to False.
+
+        Returns:
+            int: the exit status.
+        """
+        exit_code = 0
+        if test:
+            exit_code += len(self.items_by_state['conflict'])
+        if empty_config:
+            exit_code += len(self.items_by_state['unexpected_values'])
+        return exit_code
+
+    def records(self):
+        """Get the records of the compared items, like the machine-readable output formats.
+
+        Returns:
+            list of dict: one record per item (see `formats.element_record`).
+        """
+        records = []
+        for state in STATES:
+            if state == 'unexpected_values':
+                continue  # these items are also in another state
+            for vro_item in self.items_by_state[state]:
+                if state == 'removed':
+                    records.append(element_record(self.compared_package, state, None, vro_item))
+                else:
+                    records.append(element_record(self.compared_package, state, vro_item,
+                                                  self.reference_items.get(vro_item.id)))
+        return records
+
+
+class PackageDiffEngine():
+    """Compare vRO packages from a long-lived process, without printing anything.
+
+    The pool of worker processes and the package cache are shared by all the comparisons, and the
+    items of the most recently used reference packages are kept until their file changes.
+    Comparisons can run from several threads, each with its own element filter and diff options.
+    Package files are not memory-mapped, as they can be rewritten while their items are kept.
+    """
+
+    def __init__(self, jobs: int = 1, cache=None, max_references: int = 1, element_filter: ElementFilter = None,
+                 diff_options: DiffOptions = None):
+        """Build a new PackageDiffEngine object.
+
+        Args:
+            jobs (int, optional): Number of worker processes used to read the packages and to
+                generate diff files. Defaults to 1.
+            cache (PackageCache, optional): Persistent cache of the reference package items. Defaults
+                to None.
+            max_references (int, optional): Number of reference packages whose items are kept.
+                Defaults to 1.
+            element_filter (ElementFilter, optional): Default filter of the items. Defaults to None:
+                all the items.
+            diff_options (DiffOptions, optional): Default engine and limits of the diff files. Defaults
+                to None: the default options.
+        """
+        self.jobs = jobs
+        self.cache = cache
+        self.max_references = max_references
+        self.element_filter = element_filter or ElementFilter()
+        self.diff_options = diff_options or DiffOptions()
+        self.executor = start_process_pool(jobs) if jobs > 1 else None
+        self.references = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        """Use the engine as a context manager.
+
+        Returns:
+            PackageDiffEngine: the current engine.
+        """
+        return self
+
+    def __exit__(self, *args):
+        """Close the engine at the end of the context."""
+        self.close()
+
+    def close(self):
+        """Stop the worker processes and forget the reference items."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        with self.lock:
+            self.references.clear()
+
+    def _reference_future(self, package, element_filter: ElementFilter):
+        """Get the future items of a reference package, and tell if the caller must read them.
+
+        Packages being read by another comparison with the same element filter are not read again:
+        their future items are shared.
+
+        Args:
+            package (str): Path to a package file or folder.
+            element_filter (ElementFilter): Filter of the items.
+
+        Returns:
+            tuple: the future items (concurrent.futures.Future) and True if they must be read.
+        """
+        from concurrent.futures import Future
+        signature = package_signature(package)
+        key = (os.path.abspath(package) if isinstance(package, str) else id(package), element_filter.key)
+        with self.lock:
+            entry = self.references.get(key)
+            if entry is not None and signature is not None and entry[0] == signature:
+                self.references.move_to_end(key)
+                self.hits += 1
+                logger.debug("Reusing the items of the reference package %s", package)
+                return entry[1], False
+            self.misses += 1
+            future = Future()
+            if signature is not None and self.max_references:
+                self.references[key] = (signature, future)
+                self.references.move_to_end(key)
+                while len(self.references) > self.max_references:
+                    self.references.popitem(last=False)
+            else:
+                self.references.pop(key, None)
+            return future, True
+
+    def _read_reference(self, package, future, element_filter: ElementFilter):
+        """Read the items of a reference package into their future.
+
+        Args:
+            package (str): Path to a package file or folder.
+            future (concurrent.futures.Future): The future items.
+            element_filter (ElementFilter): Filter of the items.
+
+        Raises:
+            PackageReadError: the package is missing or corrupt.
+
+        Returns:
+            VROElementMetadata[]: the package items.
+        """
+        try:
+            vro_items = read_reference_package(package, jobs=self.jobs, cache=self.cache, executor=self.executor,
+                                               element_filter=element_filter, map_files=False)
+        except BaseException as error:
+            with self.lock:
+                # a failed read is not kept: the next comparison reads the package again
+                for key, (_, cached_future) in list(self.references.items()):
+                    if cached_future is future:
+                        del self.references[key]
+            future.set_exception(error)
+            raise
+        future.set_result(vro_items)
+        return vro_items
+
+    def reference_items(self, package, element_filter: ElementFilter = None):
+        """Get the items of a reference package, read again only if the package changed.
+
+        Args:
+            package (str): Path to a package file or folder.
+            element_filter (ElementFilter, optional): Filter of the items. Defaults to None: the filter
+                of the engine.
+
+        Raises:
+            PackageReadError: the package is missing or corrupt.
+
+        Returns:
+            VROElementMetadata[]: the package items.
+        """
+        element_filter = element_filter or self.element_filter
+        future, read = self._reference_future(package, element_filter)
+        if read:
+            return self._read_reference(package, future, element_filter)
+        return future.result()
+
+    def stats(self):
+        """Get the statistics of the reference items cache.
+
+        Returns:
+            dict: the number of ``hits``, ``misses`` and kept ``references``.
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "references": len(self.references)}
+
+    def compare(self, reference_package, compared_package, diff_folder: str = None, writer: StreamWriter = None,
+                element_filter: ElementFilter = None, diff_options: DiffOptions = None):
+        """Compare a package with a reference package.
+
+        Args:
+            reference_package (str): Path to the reference package file or folder.
+            compared_package (str): Path to the compared package file or folder.
+            diff_folder (str, optional): Generate unified diff files output. Defaults to None.
+            writer (StreamWriter, optional): Writer of the element records. Defaults to None.
+            element_filter (ElementFilter, optional): Filter of the items. Defaults to None: the filter
+                of the engine.
+            diff_options (DiffOptions, optional): Engine and limits of the diff files. Defaults to None:
+                the options of the engine.
+
+        Raises:
+            PackageReadError: a package is missing or corrupt.
+
+        Returns:
+            ComparisonResult: the result of the comparison.
+        """
+        return self.compare_many(reference_package, [compared_package], diff_folder=diff_folder, writer=writer,
+                                 element_filter=element_filter, diff_options=diff_options)[0]
+
+    def compare_many(self, reference_package, compared_packages: list, diff_folder: str = None,
+                     writer: StreamWriter = None, element_filter: ElementFilter = None,
+                     diff_options: DiffOptions = None):
+        """Compare several packages with the same reference package.
+
+        When the reference items are not known yet, the compared packages are read while the
+        reference package is read.
+
+        Args:
+            reference_package (str): Path to the reference package file or folder.
+            compared_packages (str[]): Paths to the compared package files or folders.
+            diff_folder (str, optional): Generate unified diff files output, in a sub folder for each
+                package if there are several ones. Defaults to None.
+            writer (StreamWriter, optional): Writer of the element records. Defaults to None.
+            element_filter (ElementFilter, optional): Filter of the items. Defaults to None: the filter
+                of the engine.
+            diff_options (DiffOptions, optional): Engine and limits of the diff files. Defaults to None:
+                the options of the engine.
+
+        Raises:
+            PackageReadError: a package is missing or corrupt.
+
+        Returns:
+            ComparisonResult[]: the result of each comparison.
+        """
+        element_filter = element_filter or self.element_filter
+        compare_options = dict(diff_folder=diff_folder, jobs=self.jobs, executor=self.executor, writer=writer,
+                               element_filter=element_filter, diff_options=diff_options or self.diff_options,
+                               map_files=False)
+        future, read = self._reference_future(reference_package, element_filter)
+        if read:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=1) as reference_reader:
+                reference_reader.submit(self._read_reference, reference_package, future, element_filter)
+                results = compare_packages(future, reference_package, compared_packages, **compare_options)
+        else:
+            # the reference items are known, or being read by another comparison
+            items_src = future.result() if future.done() else future
+            results = compare_packages(items_src, reference_package, compared_packages, **compare_options)
+        return [
+            ComparisonResult(reference_package, package, items_by_state, future.result())
+            for package, items_by_state in zip(compared_packages, results)
+        ]
+
+
+class PackageWatcher():
+    """Compare a package with the reference items again each time it changes.
+
+    Only the elements whose files changed (CRC, size or modification time) since the previous
+    update are read again, and only their diff files are written again. The package is not
+    memory-mapped, as it is rewritten while its elements are kept.
+    """
+
+    def __init__(self, items_src: list, reference_package, compared_package, diff_folder: str = None,
+                 empty_config: bool = True, jobs: int = 1, executor=None, element_filter: ElementFilter = None,
+                 diff_options: DiffOptions = None):
+        """Build a new PackageWatcher object.
+
+        Args:
+            items_src (VROElementMetadata[]): Items of the reference package.
+            reference_package (str): package to use as source.
+            compared_package (str): Path to the watched package file or folder.
+            diff_folder (str, optional): Generate unified diff files output. Defaults to None.
+            empty_config (bool, optional): Count the values of the ConfigurationElements. Defaults to True.
+            jobs (int, optional): Number of processes used to read items and to generate diff files.
+                Defaults to 1.
+            executor (concurrent.futures.Executor, optional): Shared pool of processes. Defaults to None.
+            element_filter (ElementFilter, optional): Filter of the items, also used to read the
+                reference items. Defaults to None: all the items.
+            diff_options (DiffOptions, optional): Engine and limits of the diff files. Defaults to None:
+                the default options.
+        """
+        self.items_src = items_src
+        self.reference = {vro_item.id: vro_item for vro_item in items_src}
+        self.reference_package = reference_package
+        self.compared_package = compared_package
+        self.diff_folder = diff_folder
+        self.empty_config = empty_config
+        self.jobs = jobs
+        self.executor = executor
+        self.element_filter = element_filter
+        self.diff_options = diff_options
+        self.signature = None
+        self.entries = {}
+        self.states = {}
+        self.changed = []
+
+    def update(self):
+        """Compare the package again if it changed since the last update.
+
+        Raises:
+            PackageReadError: the package is missing or corrupt, maybe because it is being written:
+                the next update reads it again.
+
+        Returns:
+            dict of VROElementMetadata[]: A dict of items, stored by import state, or None if the
+                package did not change.
+        """
+        signature = package_signature(self.compared_package)
+        if signature is not None and signature == self.signature:
+            return None
+        with phase("Read and compare packages"):
+            reader = open_package(self.compared_package, element_filter=self.element_filter, map_files=False)
+            signatures, unchanged = {}, {}
+            for item_id in reader.entries:
+                signatures[item_id] = reader.entry_signature(item_id)
+                previous = self.entries.get(item_id)
+                if previous is not None and previous[0] == signatures[item_id]:
+                    unchanged[item_id] = reader.reuse_element(previous[1])
+            changed = [item_id for item_id in signatures if item_id not in unchanged]
+            changed += [item_id for item_id in self.entries if item_id not in signatures]
+            logger.info("%d elements changed in %s", len(changed), self.compared_package)
+            vro_items = list(reader.iter_elements(jobs=self.jobs, reference=self.reference, executor=self.executor,
+                                                  prefetched=unchanged))
+            if self.diff_folder:
+                for item_id in changed:
+                    if item_id in self.states:
+                        state, item_type = self.states[item_id]
+                        remove_diff_file(item_id, item_type, self.diff_folder, state)
+            lists_of_items_by_state = classify_vro_items(
+                self.items_src,
+                vro_items,
+                reference_package=self.reference_package,
+                compared_package=self.compared_package,
+                diff_folder=self.diff_folder,
+                empty_config=self.empty_config,
+                jobs=self.jobs,
+                executor=self.executor,
+                diff_ids=set(changed),
+                diff_options=self.diff_options
+            )
+        self.signature = signature
+        self.entries = {vro_item.id: (signatures[vro_item.id], vro_item) for vro_item in vro_items}
+        self.states = {
+            vro_item.id: (state, vro_item.type)
+            for state, state_items in lists_of_items_by_state.items()
+            if state not in ('unexpected_values', 'removed')
+            for vro_item in state_items
+        }
+        self.changed = changed
+        return lists_of_items_by_state
+
+
+def package_signature(package):
+    """Get a signature of a package that changes when the package is modified.
+
+    Args:
+        package (str or file): Path to a package file or folder, or a binary file object.
+
+    Returns:
+        tuple: the path, size and modification time of the package file (or of each file of the
+            package folder), or None for a file object or a missing package.
+    """
+    if not isinstance(package, str):
+        return None
+    try:
+        if not os.path.isdir(package):
+            stat = os.stat(package)
+            return (os.path.abspath(package), stat.st_size, stat.st_mtime_ns)
+        files = []
+        for folder, folders, file_names in os.walk(package):
+            folders.sort()
+            for file_name in sorted(file_names):
+                stat = os.stat(os.path.join(folder, file_name))
+                files.append((os.path.relpath(os.path.join(folder, file_name), package), stat.st_size,
+                              stat.st_mtime_ns))
+        return (os.path.abspath(package), tuple(files))
+    except OSError:
+        return None
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Stream the comparison results in machine-readable formats."""
+
+# default python modules
+import threading
+
+
+RECORD_FIELDS = [
+    "package", "id", "name", "type", "state", "reference_version", "version",
+    "reference_checksum", "checksum", "valued_items"
+]
+"""list: Fields of an element record, in output order."""
+
+
+def element_record(package: str, state: str, vro_item, reference_item):
+    """Build the record of a compared element.
+
+    Args:
+        package (str): Name of the compared package.
+        state (str): Import state of the element.
+        vro_item (VROElementMetadata): Element of the compared package (None if it is only in the
+            reference package).
+        reference_item (VROElementMetadata): Element of the reference package (None if it is only in
+            the compared package).
+
+    Returns:
+        dict: the element record.
+    """
+    item = vro_item if vro_item is not None else reference_item
+    return {
+        "package": package,
+        "id": item.id,
+        "name": item.name,
+        "type": item.type,
+        "state": state,
+        "reference_version": None if reference_item is None else str(reference_item.version),
+        "version": None if vro_item is None else str(vro_item.version),
+        "reference_checksum": None if reference_item is None else reference_item.checksum,
+        "checksum": None if vro_item is None else vro_item.checksum,
+        "valued_items": None if vro_item is None else vro_item.valued_items,
+    }
+
+
+class StreamWriter():
+    """Abstract class to write element records to a stream, one at a time.
+
+    Records can be written from several threads.
+    """
+
+    def __init__(self, stream):
+        """Build a new StreamWriter object and write the beginning of the output.
+
+        Args:
+            stream (file): A text stream.
+        """
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.count = 0
+        self.write_header()
+
+    def write_header(self):
+        """Write the beginning of the output."""
+
+    def write_footer(self):
+        """Write the end of the output."""
+
+    def write_record(self, record: dict):
+        """Write a record.
+
+        Args:
+            record (dict): The element record.
+        """
+        raise NotImplementedError
+
+    def write_element(self, package: str, state: str, vro_item, reference_item):
+        """Write the record of a compared element.
+
+        Args:
+            package (str): Name of the compared package.
+            state (str): Import state of the element.
+            vro_item (VROElementMetadata): Element of the compared package, or None.
+            reference_item (VROElementMetadata): Element of the reference package, or None.
+        """
+        record = element_record(package, state, vro_item, reference_item)
+        with self.lock:
+            self.write_record(record)
+            self.count += 1
+            self.stream.flush()
+
+    def close(self):
+        """Write the end of the output."""
+        with self.lock:
+            self.write_footer()
+            self.stream.flush()
+
+
+class JSONLinesWriter(StreamWriter):
+    """Write one JSON object per line."""
+
+    def write_record(self, record: dict):
+        """Write a record as a JSON line.
+
+        Args:
+            record (dict): The element record.
+        """
+        import json
+        self.stream.write(json.dumps(record) + "\n")
+
+
+class JSONWriter(StreamWriter):
+    """Write a JSON array of objects, one object per line."""
+
+    def write_header(self):
+        """Open the JSON array."""
+        self.stream.write("[")
+
+    def write_footer(self):
+        """Close the JSON array."""
+        self.stream.write("\n]\n")
+
+    def write_record(self, record: dict):
+        """Write a record as an item of the JSON array.
+
+        Args:
+            record (dict): The element record.
+        """
+        import json
+        self.stream.write(("\n" if not self.count else ",\n") + json.dumps(record))
+
+
+class CSVWriter(StreamWriter):
+    """Write CSV rows, with a header row."""
+
+    def write_header(self):
+        """Write the header row."""
+        import csv
+        self.csv_writer = csv.DictWriter(self.stream, fieldnames=RECORD_FIELDS, lineterminator="\n")
+        self.csv_writer.writeheader()
+
+    def write_record(self, record: dict):
+        """Write a record as a CSV row.
+
+        Args:
+            record (dict): The element record.
+        """
+        self.csv_writer.writerow(record)
+
+
+WRITERS = {
+    "jsonl": JSONLinesWriter,
+    "json": JSONWriter,
+    "csv": CSVWriter,
+}
+"""dict: Stream writers by output format name."""
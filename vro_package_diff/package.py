@@ -0,0 +1,837 @@
+#!/usr/bin/env python
+"""Define VROPackageReader and VRODirectoryReader object classes."""
+
+# default python modules
+import fnmatch
+import functools
+import io
+import logging
+import os
+import struct
+import xml.etree.ElementTree as Etree
+import zipfile
+import zlib
+from itertools import repeat
+
+# local imports
+from .config import SUPPORTED_ELEMENT_TYPES
+from .profiling import step
+from .vro_element import BufferReader, read_item_type, VROElementMetadata
+
+
+logger = logging.getLogger(__name__)
+
+ELEMENTS_FOLDER = "elements"
+"""str: Folder of the package file that contains the vRO elements."""
+
+CHUNKS_PER_JOB = 4
+"""int: Number of chunks of elements sent to each worker process when reading a package."""
+
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+"""struct.Struct: Local file header of a zip member, followed by its file name and extra field."""
+
+READ_ERRORS = (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile, zlib.error, Etree.ParseError)
+"""tuple: Exceptions raised when reading a missing or corrupt package."""
+
+ELEMENT_TYPES = sorted(set(SUPPORTED_ELEMENT_TYPES) - {"ScriptModule"}) + ["Unsupported"]
+"""str[]: Element types, as shown in the tables, that can be selected by an ElementFilter."""
+
+ITEM_TYPES_CACHE_SIZE = 100000
+"""int: Maximum number of element types kept by an ElementFilter, so they are not parsed again."""
+
+
+class ElementFilter():
+    """Select the elements of the packages by type, id and name.
+
+    Ids are matched with the paths of the zip central directory, before anything is decompressed,
+    and types with the small ``info`` file, before the ``data`` file is read: the other elements are
+    never read. The name of an element is only written in its ``data`` file, so it is matched once
+    the header of the element is read.
+
+    A filter can be shared by several readers and threads: it keeps the type of the elements it
+    checked, so the ``info`` files of a package opened several times are only parsed once.
+    """
+
+    def __init__(self, include_types: list = None, exclude_types: list = None, ids: list = None,
+                 name_globs: list = None):
+        """Build a new ElementFilter object: without any criteria, all the elements are selected.
+
+        Args:
+            include_types (str[], optional): Only select the elements of these types (see
+                ELEMENT_TYPES, case insensitive). Defaults to None: all the types.
+            exclude_types (str[], optional): Do not select the elements of these types. Defaults to None.
+            ids (str[], optional): Only select the elements with these ids. Defaults to None: all the ids.
+            name_globs (str[], optional): Only select the elements whose name matches one of these
+                glob patterns. Defaults to None: all the names.
+        """
+        self.include_types = {item_type.lower() for item_type in include_types or ()}
+        self.exclude_types = {item_type.lower() for item_type in exclude_types or ()}
+        self.ids = set(ids or ())
+        self.name_globs = list(name_globs or ())
+        self.item_types = {}
+
+    @property
+    def filters_types(self):
+        """bool: Elements are selected by type."""
+        return bool(self.include_types or self.exclude_types)
+
+    @property
+    def active(self):
+        """bool: Some elements may not be selected."""
+        return bool(self.filters_types or self.ids or self.name_globs)
+
+    @property
+    def key(self):
+        """tuple: The criteria of the filter, to tell apart the elements read with different filters."""
+        return (frozenset(self.include_types), frozenset(self.exclude_types), frozenset(self.ids),
+                tuple(self.name_globs))
+
+    def match_id(self, item_id: str):
+        """Check the id of an element.
+
+        Args:
+            item_id (str): Element ID.
+
+        Returns:
+            bool: the element may be selected.
+        """
+        return not self.ids or item_id in self.ids
+
+    def match_type(self, item_type: str):
+        """Check the type of an element.
+
+        Args:
+            item_type (str): Element type, as shown in the tables.
+
+        Returns:
+            bool: the element may be selected.
+        """
+        item_type = (item_type or "").lower()
+        return (not self.include_types or item_type in self.include_types) and item_type not in self.exclude_types
+
+    def item_type(self, reader, item_id: str):
+        """Get the type of an element from its ``info`` file, only parsed the first time.
+
+        Args:
+            reader (VROPackageReader): Reader of the package.
+            item_id (str): Element ID.
+
+        Returns:
+            str: the element type (None if unknown).
+        """
+        key = reader.info_key(item_id)
+        if key in self.item_types:
+            return self.item_types[key]
+        item_type = read_item_type(reader.read(item_id, 'info'))[0]
+        if len(self.item_types) >= ITEM_TYPES_CACHE_SIZE:
+            self.item_types.clear()
+        self.item_types[key] = item_type
+        return item_type
+
+    def match_name(self, name: str):
+        """Check the name of an element.
+
+        Args:
+            name (str): Element name (None if unknown).
+
+        Returns:
+            bool: the element may be selected.
+        """
+        if not self.name_globs:
+            return True
+        return name is not None and any(fnmatch.fnmatchcase(name, name_glob) for name_glob in self.name_globs)
+
+
+class PackageReadError(Exception):
+    """A package cannot be read: it is missing or corrupt."""
+
+
+class VROPackageReader():
+    """Read the elements of a vRealize Orchestrator package file."""
+
+    def __init__(self, package, element_filter: ElementFilter = None, map_files: bool = True):
+        """Open a package file and index its elements.
+
+        The package is memory-mapped when possible (a file on disk, or an io.BytesIO object): the zip
+        file is read from the mapping, and the members stored without compression are given to the
+        elements as memoryview slices, without any copy. A mapped file must not be truncated or
+        rewritten while it is read: packages that can change (watched or served ones) should not be
+        mapped.
+
+        Args:
+            package (str or file): Path to a package file or a binary file object.
+            element_filter (ElementFilter, optional): Filter of the elements names (see `select_elements`
+                for their types and ids). Defaults to None: all the elements.
+            map_files (bool, optional): Memory-map the package file. Defaults to True.
+        """
+        self.package = package
+        self.element_filter = element_filter or ElementFilter()
+        self.map_files = map_files
+        self.mapped_stat = file_stat(package) if map_files else None
+        self.mapping = map_file(package) if map_files else None
+        self.buffer = None
+        if self.mapping is not None:
+            self.buffer = memoryview(self.mapping)
+        elif isinstance(package, io.BytesIO):
+            self.buffer = package.getbuffer()
+        self.zip_ref = zipfile.ZipFile(package if self.buffer is None else BufferReader(self.buffer), 'r')
+        self.entries = self.index_elements()
+
+    def __enter__(self):
+        """Use the reader as a context manager.
+
+        Returns:
+            VROPackageReader: the current reader.
+        """
+        return self
+
+    def __exit__(self, *args):
+        """Close the reader at the end of the context."""
+        self.close()
+
+    def close(self):
+        """Close the underlying package file.
+
+        A memory mapping still used by some elements is only closed with them.
+        """
+        self.zip_ref.close()
+        if self.buffer is not None:
+            self.buffer.release()
+        if self.mapping is not None:
+            try:
+                self.mapping.close()
+            except BufferError:
+                logger.debug("Package mapping is still used by some elements: %s", package_name(self.package))
+
+    def index_elements(self):
+        """Group the entries of the zip central directory by element id in a single pass.
+
+        Returns:
+            dict: ZipInfo objects by file name (``info``, ``data``...), stored by element id.
+        """
+        entries = {}
+        for zip_info in self.zip_ref.infolist():
+            path = zip_info.filename.split('/')
+            if path[0] == ELEMENTS_FOLDER and len(path) > 2:
+                entries.setdefault(path[-2], {})[path[-1]] = zip_info
+        logger.debug("Found %d elements in package", len(entries))
+        return entries
+
+    def select_elements(self):
+        """Only keep the entries of the elements selected by the element filter.
+
+        Ids are checked first, from the entries only. Then, if the filter checks the types, only the
+        ``info`` file of the remaining elements is read, unless the filter already knows their type.
+
+        Raises:
+            PackageReadError: the ``info`` file of an element is missing or corrupt.
+        """
+        element_filter = self.element_filter
+        entries = {item_id: files for item_id, files in self.entries.items() if element_filter.match_id(item_id)}
+        if element_filter.filters_types:
+            for item_id in list(entries):
+                if not element_filter.match_type(self.item_type(item_id)):
+                    del entries[item_id]
+        logger.debug("Selected %d elements out of %d", len(entries), len(self.entries))
+        self.entries = entries
+
+    def item_type(self, item_id: str):
+        """Get the type of an element from its ``info`` file only, parsed once by the element filter.
+
+        Args:
+            item_id (str): Element ID.
+
+        Raises:
+            PackageReadError: the ``info`` file of the element is missing or corrupt.
+
+        Returns:
+            str: the element type (None if unknown).
+        """
+        try:
+            return self.element_filter.item_type(self, item_id)
+        except READ_ERRORS as error:
+            raise PackageReadError(
+                "Cannot read element %s of package %s: %s" % (item_id, package_name(self.package), error)
+            ) from error
+
+    def check_mapping(self):
+        """Check that the mapped package file did not change since it was mapped.
+
+        Reading a mapped file after it was truncated would kill the process (SIGBUS).
+
+        Raises:
+            PackageReadError: the package file changed.
+        """
+        if self.mapping is not None and file_stat(self.package) != self.mapped_stat:
+            raise PackageReadError("Package %s changed while it was read" % package_name(self.package))
+
+    def open(self, item_id: str, file_name: str):
+        """Open a file from an element folder, to read it in chunks.
+
+        Args:
+            item_id (str): Element ID.
+            file_name (str): Name of the file in the element folder (``info``, ``data``...).
+
+        Raises:
+            PackageReadError: the mapped package file changed.
+
+        Returns:
+            file: a binary file object.
+        """
+        self.check_mapping()
+        return self.zip_ref.open(self.entries[item_id][file_name], 'r')
+
+    def stored_view(self, zip_info: zipfile.ZipInfo):
+        """Get a member stored without compression as a slice of the mapped package file.
+
+        Args:
+            zip_info (zipfile.ZipInfo): The member.
+
+        Returns:
+            memoryview: the member content, or None if it is compressed, encrypted or if the package
+                is not mapped.
+        """
+        if self.buffer is None or zip_info.compress_type != zipfile.ZIP_STORED or zip_info.flag_bits & 0x1:
+            return None
+        header = LOCAL_HEADER.unpack_from(self.buffer, zip_info.header_offset)
+        if header[0] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile("Bad magic number for file header: %s" % zip_info.filename)
+        start = zip_info.header_offset + LOCAL_HEADER.size + header[-2] + header[-1]
+        view = self.buffer[start:start + zip_info.file_size]
+        if len(view) != zip_info.file_size:
+            raise zipfile.BadZipFile("Truncated file: %s" % zip_info.filename)
+        return view
+
+    def load(self, item_id: str, file_name: str):
+        """Get a file from an element folder, without copying it when possible.
+
+        Args:
+            item_id (str): Element ID.
+            file_name (str): Name of the file in the element folder (``info``, ``data``...).
+
+        Raises:
+            PackageReadError: the mapped package file changed.
+
+        Returns:
+            memoryview or file: a slice of the mapped package file for a member stored without
+                compression, or else a binary file object.
+        """
+        self.check_mapping()
+        view = self.stored_view(self.entries[item_id][file_name])
+        if view is not None:
+            return view
+        return self.open(item_id, file_name)
+
+    def read(self, item_id: str, file_name: str):
+        """Read a file from an element folder.
+
+        Args:
+            item_id (str): Element ID.
+            file_name (str): Name of the file in the element folder (``info``, ``data``...).
+
+        Returns:
+            bytes: the file content.
+        """
+        with step("Zip read"), self.open(item_id, file_name) as element_file:
+            return element_file.read()
+
+    def info_key(self, item_id: str):
+        """Get a key of the ``info`` file of an element, that changes with its content.
+
+        Args:
+            item_id (str): Element ID.
+
+        Returns:
+            tuple: the element ID, and the CRC and size of its ``info`` file.
+        """
+        zip_info = self.entries[item_id]['info']
+        return (item_id, zip_info.CRC, zip_info.file_size)
+
+    def fingerprint(self, item_id: str):
+        """Get the fingerprint of an element from the zip central directory.
+
+        Args:
+            item_id (str): Element ID.
+
+        Returns:
+            tuple: CRC and size of the element ``info`` and ``data`` files.
+        """
+        return tuple(
+            (file_name, zip_info.CRC, zip_info.file_size)
+            for file_name, zip_info in sorted(self.entries[item_id].items())
+            if file_name in ('info', 'data')
+        )
+
+    def entry_signature(self, item_id: str):
+        """Get a signature of the files of an element, that changes when the element is modified.
+
+        Unlike the fingerprint, it is only meant to be compared with a previous version of the
+        same package.
+
+        Args:
+            item_id (str): Element ID.
+
+        Returns:
+            tuple: CRC, size and modification time of the element ``info`` and ``data`` files.
+        """
+        return tuple(
+            (file_name, zip_info.CRC, zip_info.file_size, zip_info.date_time)
+            for file_name, zip_info in sorted(self.entries[item_id].items())
+            if file_name in ('info', 'data')
+        )
+
+    def reuse_element(self, vro_item):
+        """Read the data of an element from this reader, when it was read from a previous version of the package.
+
+        The content kept in memory is released, as it may belong to the previous package file.
+
+        Args:
+            vro_item (VROElementMetadata): An element whose files did not change.
+
+        Returns:
+            VROElementMetadata: the element.
+        """
+        vro_item.data_loader = functools.partial(self.load, vro_item.id, 'data')
+        vro_item.release_content()
+        return vro_item
+
+    def find_identical_elements(self, reference: dict):
+        """Find the elements with the same ``info`` and ``data`` files than in a reference package.
+
+        Files are considered identical when their CRC and size are the same in both zip central
+        directories, so nothing needs to be decompressed.
+
+        Args:
+            reference (dict of VROElementMetadata): reference elements, stored by id.
+
+        Returns:
+            dict of VROElementMetadata: reference elements that are identical, stored by id.
+        """
+        identical = {}
+        for item_id in self.entries:
+            reference_item = reference.get(item_id)
+            if reference_item is None or reference_item.fingerprint is None:
+                continue
+            if reference_item.fingerprint == self.fingerprint(item_id):
+                identical[item_id] = reference_item
+        logger.info("%d elements are identical to the reference package", len(identical))
+        return identical
+
+    def iter_elements(self, jobs: int = 1, reference: dict = None, executor=None, prefetched: dict = None):
+        """Iterate over the elements of the package.
+
+        The ``data`` file of an element is only read if its type is supported. Elements that are
+        identical to the reference ones are copied from them instead of being read. Elements whose
+        name does not match the element filter are not yielded.
+
+        Args:
+            jobs (int, optional): Number of worker processes used to build the elements. Defaults to 1.
+            reference (dict of VROElementMetadata, optional): reference elements, stored by id.
+                Defaults to None.
+            executor (concurrent.futures.Executor, optional): Pool of processes used to build the
+                elements. Defaults to None: a pool is created if jobs > 1.
+            prefetched (dict of VROElementMetadata, optional): elements already read, stored by id (see
+                `prefetch_elements`). Defaults to None.
+
+        Yields:
+            VROElementMetadata: the package elements, in the order of the package file.
+        """
+        identical = self.find_identical_elements(reference) if reference else {}
+        prefetched = prefetched or {}
+        items_id = [item_id for item_id in self.entries if item_id not in identical and item_id not in prefetched]
+        vro_items = self.read_elements(items_id, jobs, executor)
+        for item_id in self.entries:
+            if item_id in identical:
+                vro_item = identical[item_id].copy()
+            elif item_id in prefetched:
+                vro_item = prefetched[item_id]
+            else:
+                vro_item = next(vro_items)
+                vro_item.fingerprint = self.fingerprint(item_id)
+            if self.element_filter.match_name(vro_item.name):
+                yield vro_item
+        vro_items.close()
+
+    def prefetch_elements(self, reference_reader=None, jobs: int = 1, executor=None):
+        """Read the elements that differ from a reference package, before the reference elements are read.
+
+        Elements are compared with the reference package from the fingerprints of both zip central
+        directories, so this can run while the reference package is read.
+
+        Args:
+            reference_reader (VROPackageReader, optional): Reader of the reference package. Defaults to
+                None: all the elements are read.
+            jobs (int, optional): Number of worker processes used to build the elements. Defaults to 1.
+            executor (concurrent.futures.Executor, optional): Pool of processes used to build the
+                elements. Defaults to None: a pool is created if jobs > 1.
+
+        Returns:
+            dict of VROElementMetadata: the elements read, stored by id.
+        """
+        items_id = []
+        for item_id in self.entries:
+            fingerprint = self.fingerprint(item_id)
+            if (fingerprint is None or reference_reader is None or item_id not in reference_reader.entries
+                    or fingerprint != reference_reader.fingerprint(item_id)):
+                items_id.append(item_id)
+        logger.debug("Prefetching %d elements", len(items_id))
+        prefetched = {}
+        for vro_item in self.read_elements(items_id, jobs, executor):
+            vro_item.fingerprint = self.fingerprint(vro_item.id)
+            prefetched[vro_item.id] = vro_item
+        return prefetched
+
+    def read_elements(self, items_id: list, jobs: int = 1, executor=None):
+        """Build some elements of the package, in the current process or in a pool of processes.
+
+        Args:
+            items_id (str[]): IDs of the elements to build.
+            jobs (int, optional): Number of worker processes used to build the elements. Defaults to 1.
+            executor (concurrent.futures.Executor, optional): Pool of processes used to build the
+                elements. Defaults to None: a pool is created if jobs > 1.
+
+        Yields:
+            VROElementMetadata: the package elements, in the order of items_id.
+        """
+        package_path = package_name(self.package)
+        if jobs > 1 and not (isinstance(package_path, str) and os.path.exists(package_path)):
+            logger.warning("Package is not a file on disk: elements are read in the current process")
+            jobs = 1
+        if jobs > 1:
+            yield from self.iter_elements_from_pool(package_path, items_id, jobs, executor)
+        else:
+            yield from self.build_elements(items_id)
+
+    def build_elements(self, items_id: list):
+        """Build some elements of the package in the current process.
+
+        Args:
+            items_id (str[]): IDs of the elements to build.
+
+        Yields:
+            VROElementMetadata: the package elements.
+        """
+        for item_id in items_id:
+            with step("Element parse", item_id):
+                try:
+                    xml_info = self.read(item_id, 'info')
+                    vro_item = VROElementMetadata(item_id, xml_info, functools.partial(self.load, item_id, 'data'))
+                except READ_ERRORS as error:
+                    raise PackageReadError(
+                        "Cannot read element %s of package %s: %s" % (item_id, package_name(self.package), error)
+                    ) from error
+            yield vro_item
+
+    def iter_cached_elements(self, cached_items: list):
+        """Build the elements of the package from cached values, without reading them.
+
+        Only the elements of the package entries, whose name matches the element filter, are built.
+
+        Args:
+            cached_items (list of tuple): (summary, valued_items, fingerprint) of each element, as
+                returned by `PackageCache.get`.
+
+        Yields:
+            VROElementMetadata: the package elements.
+        """
+        for summary, valued_items, fingerprint in cached_items:
+            if summary[0] not in self.entries or not self.element_filter.match_name(summary[2]):
+                continue
+            vro_item = VROElementMetadata.from_summary(summary, functools.partial(self.load, summary[0], 'data'))
+            vro_item.valued_items = valued_items
+            vro_item.fingerprint = fingerprint
+            yield vro_item
+
+    def iter_elements_from_pool(self, package_path: str, items_id: list, jobs: int, executor=None):
+        """Build some elements of the package in a pool of worker processes.
+
+        Workers only send back a summary of each element: the data content is read again on
+        demand, from the current reader.
+
+        Args:
+            package_path (str): Path to the package file.
+            items_id (str[]): IDs of the elements to build.
+            jobs (int): Number of worker processes.
+            executor (concurrent.futures.Executor, optional): Pool of processes. Defaults to None: a
+                pool is created for the package.
+
+        Yields:
+            VROElementMetadata: the package elements.
+        """
+        if executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                yield from self.iter_elements_from_pool(package_path, items_id, jobs, executor)
+            return
+        chunk_size = max(1, -(-len(items_id) // (jobs * CHUNKS_PER_JOB)))
+        chunks = [items_id[i:i + chunk_size] for i in range(0, len(items_id), chunk_size)]
+        logger.debug("Reading %d elements with %d processes", len(items_id), jobs)
+        for summaries in executor.map(_summarize_elements, repeat(package_path), chunks, repeat(self.map_files)):
+            for summary in summaries:
+                yield VROElementMetadata.from_summary(
+                    summary,
+                    functools.partial(self.load, summary[0], 'data')
+                )
+
+
+class VRODirectoryReader(VROPackageReader):
+    """Read the elements of an unpacked vRealize Orchestrator package folder."""
+
+    def __init__(self, package: str, element_filter: ElementFilter = None, map_files: bool = True):
+        """Index the elements of a package folder.
+
+        Args:
+            package (str): Path to a folder with the ``elements/<id>/{info,data}`` files.
+            element_filter (ElementFilter, optional): Filter of the elements names. Defaults to None: all
+                the elements.
+            map_files (bool, optional): Memory-map the files of the elements. Defaults to True.
+        """
+        self.package = package
+        self.element_filter = element_filter or ElementFilter()
+        self.map_files = map_files
+        self.entries = self.index_elements()
+
+    def close(self):
+        """Nothing to close: files are only opened while they are read."""
+
+    def index_elements(self):
+        """Group the files of the elements folder by element id.
+
+        Elements are sorted by id, as a folder has no natural order.
+
+        Returns:
+            dict: paths by file name (``info``, ``data``...), stored by element id.
+        """
+        entries = {}
+        elements_folder = os.path.join(self.package, ELEMENTS_FOLDER)
+        for item_id in sorted(os.listdir(elements_folder)):
+            item_folder = os.path.join(elements_folder, item_id)
+            if os.path.isdir(item_folder):
+                entries[item_id] = {
+                    entry.name: entry.path for entry in os.scandir(item_folder) if entry.is_file()
+                }
+        logger.debug("Found %d elements in package folder", len(entries))
+        return entries
+
+    def open(self, item_id: str, file_name: str):
+        """Open a file from an element folder, to read it in chunks.
+
+        Args:
+            item_id (str): Element ID.
+            file_name (str): Name of the file in the element folder (``info``, ``data``...).
+
+        Returns:
+            file: a binary file object.
+        """
+        return open(self.entries[item_id][file_name], 'rb')
+
+    def load(self, item_id: str, file_name: str):
+        """Get a file from an element folder, through a memory-mapped file without copying it.
+
+        Args:
+            item_id (str): Element ID.
+            file_name (str): Name of the file in the element folder (``info``, ``data``...).
+
+        Returns:
+            memoryview or file: the file content, or a binary file object if the files are not mapped.
+        """
+        if not self.map_files:
+            return self.open(item_id, file_name)
+        mapping = map_file(self.entries[item_id][file_name])
+        return memoryview(b'' if mapping is None else mapping)
+
+    def read(self, item_id: str, file_name: str):
+        """Read a file from an element folder, through a memory-mapped file if the files are mapped.
+
+        Args:
+            item_id (str): Element ID.
+            file_name (str): Name of the file in the element folder (``info``, ``data``...).
+
+        Returns:
+            bytes: the file content.
+        """
+        import mmap
+        with step("Zip read"), open(self.entries[item_id][file_name], 'rb') as element_file:
+            if not self.map_files:
+                return element_file.read()
+            if not os.fstat(element_file.fileno()).st_size:
+                return b''
+            with mmap.mmap(element_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                return mapped_file[:]
+
+    def info_key(self, item_id: str):
+        """Get a key of the ``info`` file of an element, that changes when it is modified.
+
+        Args:
+            item_id (str): Element ID.
+
+        Returns:
+            tuple: the path, size and modification time of the ``info`` file.
+        """
+        path = self.entries[item_id]['info']
+        stat = os.stat(path)
+        return (path, stat.st_size, stat.st_mtime_ns)
+
+    def fingerprint(self, item_id: str):
+        """Get the fingerprint of an element.
+
+        There is no CRC for the files of a folder: identical elements are never guessed.
+
+        Args:
+            item_id (str): Element ID.
+
+        Returns:
+            None: no fingerprint.
+        """
+        return None
+
+    def entry_signature(self, item_id: str):
+        """Get a signature of the files of an element, that changes when the element is modified.
+
+        Args:
+            item_id (str): Element ID.
+
+        Returns:
+            tuple: size and modification time of the element ``info`` and ``data`` files.
+        """
+        signature = []
+        for file_name, path in sorted(self.entries[item_id].items()):
+            if file_name in ('info', 'data'):
+                stat = os.stat(path)
+                signature.append((file_name, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+
+def map_file(source):
+    """Map a file in memory, read-only.
+
+    Args:
+        source (str or file): Path to a file or a binary file object.
+
+    Returns:
+        mmap.mmap: the mapping, or None if the file is empty or cannot be mapped.
+    """
+    import mmap
+    try:
+        if isinstance(source, str):
+            with open(source, 'rb') as source_file:
+                return mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None  # not a regular file, or an empty one
+
+
+def file_stat(source):
+    """Get the size and modification time of a file, to tell if it changed.
+
+    Args:
+        source (str or file): Path to a file or a binary file object.
+
+    Returns:
+        tuple: the size and modification time of the file, or None if it is missing or not a file.
+    """
+    try:
+        stat = os.stat(source) if isinstance(source, str) else os.fstat(source.fileno())
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def package_name(package):
+    """Get the name of a package, for messages.
+
+    Args:
+        package (str or file): Path to a package file or folder, or a binary file object.
+
+    Returns:
+        str: the path of the package, or the representation of the file object.
+    """
+    return getattr(package, 'name', package)
+
+
+def open_package(package, element_filter: ElementFilter = None, map_files: bool = True):
+    """Open a package file or an unpacked package folder.
+
+    Args:
+        package (str or file): Path to a package file or folder, or a binary file object.
+        element_filter (ElementFilter, optional): Only keep the elements selected by this filter (see
+            `VROPackageReader.select_elements`). Defaults to None: all the elements.
+        map_files (bool, optional): Memory-map the package files. Defaults to True: packages that can
+            change while they are read should not be mapped.
+
+    Raises:
+        PackageReadError: the package is missing or corrupt.
+
+    Returns:
+        VROPackageReader: the reader for the package.
+    """
+    try:
+        if isinstance(package, str) and os.path.isdir(package):
+            reader = VRODirectoryReader(package, element_filter=element_filter, map_files=map_files)
+        else:
+            reader = VROPackageReader(package, element_filter=element_filter, map_files=map_files)
+    except READ_ERRORS as error:
+        raise PackageReadError("Cannot open package %s: %s" % (package_name(package), error)) from error
+    if reader.element_filter.active:
+        try:
+            reader.select_elements()
+        except PackageReadError:
+            reader.close()
+            raise
+    return reader
+
+
+def _summarize_elements(package_path: str, items_id: list, map_files: bool = True):
+    """Build some elements of a package and summarize them (worker process side).
+
+    Args:
+        package_path (str): Path to the package file.
+        items_id (str[]): IDs of the elements to build.
+        map_files (bool, optional): Memory-map the package files. Defaults to True.
+
+    Returns:
+        tuple[]: the summary of each element.
+    """
+    # the elements to build were already selected by the main process
+    with open_package(package_path, map_files=map_files) as reader:
+        return [vro_item.summary() for vro_item in reader.build_elements(items_id)]
+
+
+def iter_vroitems_from_package(package, jobs: int = 1, reference_items: list = None, executor=None,
+                               prefetched: dict = None, element_filter: ElementFilter = None,
+                               map_files: bool = True):
+    """Iterate over the items from the vRO Package.
+
+    The package file stays open as long as the items may need to read their data content again: it
+    is only closed here when the reading fails, as no item is returned then.
+
+    Args:
+        package (str or file): Path to a package file or folder, or a binary file object.
+        jobs (int, optional): Number of worker processes used to read the items. Defaults to 1.
+        reference_items (VROElementMetadata[], optional): Items of the reference package: identical
+            items are not read again. Defaults to None.
+        executor (concurrent.futures.Executor, optional): Pool of processes used to read the items.
+            Defaults to None: a pool is created if jobs > 1.
+        prefetched (dict of VROElementMetadata, optional): Items already read, stored by id. Defaults
+            to None.
+        element_filter (ElementFilter, optional): Filter of the items. Defaults to None: all the items.
+        map_files (bool, optional): Memory-map the package files. Defaults to True.
+
+    Raises:
+        PackageReadError: the package is missing or corrupt.
+
+    Yields:
+        VROElementMetadata: the package items.
+    """
+    reader = open_package(package, element_filter=element_filter, map_files=map_files)
+    reference = None
+    if reference_items:
+        reference = {vro_item.id: vro_item for vro_item in reference_items}
+    try:
+        for vro_item in reader.iter_elements(jobs=jobs, reference=reference, executor=executor,
+                                             prefetched=prefetched):
+            logger.info("New item %s", vro_item)
+            yield vro_item
+    except Exception:
+        reader.close()
+        raise
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+"""Measure the resources used by each phase of a run."""
+
+# default python modules
+import contextlib
+import heapq
+import logging
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+_PHASE_HOOKS = []
+
+_STEP_HOOKS = []
+
+_cpu_time = getattr(time, 'thread_time', time.process_time)  # python 3.7+
+
+
+def add_phase_hook(hook):
+    """Register a hook notified at the start and at the end of each phase.
+
+    Args:
+        hook (object): An object with ``start_phase(name)`` and ``end_phase(name)`` methods.
+    """
+    _PHASE_HOOKS.append(hook)
+
+
+def remove_phase_hook(hook):
+    """Unregister a phase hook.
+
+    Args:
+        hook (object): A hook registered with `add_phase_hook`.
+    """
+    _PHASE_HOOKS.remove(hook)
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    """Run a phase of the diff process, and notify the registered hooks.
+
+    Args:
+        name (str): Name of the phase.
+    """
+    for hook in _PHASE_HOOKS:
+        hook.start_phase(name)
+    try:
+        yield
+    finally:
+        for hook in reversed(_PHASE_HOOKS):
+            hook.end_phase(name)
+
+
+def add_step_hook(hook):
+    """Register a hook notified at the start and at the end of each step.
+
+    Args:
+        hook (object): An object with ``start_step(name, item_id)``, ``end_step(name, item_id)`` and
+            ``record_element(vro_item)`` methods.
+    """
+    _STEP_HOOKS.append(hook)
+
+
+def remove_step_hook(hook):
+    """Unregister a step hook.
+
+    Args:
+        hook (object): A hook registered with `add_step_hook`.
+    """
+    _STEP_HOOKS.remove(hook)
+
+
+def record_element(vro_item):
+    """Notify the registered step hooks of a compared element.
+
+    Args:
+        vro_item (VROElementMetadata): A compared element.
+    """
+    for hook in _STEP_HOOKS:
+        hook.record_element(vro_item)
+
+
+class step():
+    """Run a step of the processing of the elements, and notify the registered hooks.
+
+    Steps are much shorter than phases and may be nested: nothing is done if no hook is registered.
+    """
+
+    __slots__ = ('name', 'item_id')
+
+    def __init__(self, name: str, item_id: str = None):
+        """Build a new step.
+
+        Args:
+            name (str): Name of the step.
+            item_id (str, optional): ID of the element processed by the step. Defaults to None.
+        """
+        self.name = name
+        self.item_id = item_id
+
+    def __enter__(self):
+        """Notify the hooks of the start of the step."""
+        for hook in _STEP_HOOKS:
+            hook.start_step(self.name, self.item_id)
+
+    def __exit__(self, *args):
+        """Notify the hooks of the end of the step."""
+        for hook in reversed(_STEP_HOOKS):
+            hook.end_step(self.name, self.item_id)
+
+
+def peak_rss():
+    """Get the peak resident set size of the current process.
+
+    Returns:
+        int: the peak RSS in bytes, or None if it is not available.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on MacOSX
+    return rss if rss > 1 << 32 else rss * 1024
+
+
+class MemoryReport():
+    """Measure the memory allocated by each phase, with tracemalloc.
+
+    The traced peak is reset at the start of each phase: the peak reached by the enclosing phases
+    before a nested one starts is kept aside, and added back to them when it ends.
+    """
+
+    def __init__(self):
+        """Build a new MemoryReport object."""
+        self.phases = []
+        self.open_peaks = []
+
+    def __enter__(self):
+        """Use the report as a context manager.
+
+        Returns:
+            MemoryReport: the current report.
+        """
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """Stop the report at the end of the context."""
+        self.stop()
+
+    def start(self):
+        """Start tracing the memory allocations and listen to the phases.
+
+        tracemalloc is only imported when a report is requested.
+        """
+        import tracemalloc
+        tracemalloc.start()
+        add_phase_hook(self)
+
+    def stop(self):
+        """Stop tracing the memory allocations."""
+        import tracemalloc
+        remove_phase_hook(self)
+        tracemalloc.stop()
+
+    def start_phase(self, name: str):
+        """Reset the peak of traced memory at the start of a phase.
+
+        The peak reached so far by the enclosing phase is saved before the reset.
+
+        Args:
+            name (str): Name of the phase.
+        """
+        import tracemalloc
+        if self.open_peaks:
+            self.open_peaks[-1] = max(self.open_peaks[-1], tracemalloc.get_traced_memory()[1])
+        self.open_peaks.append(0)
+        if hasattr(tracemalloc, 'reset_peak'):  # python 3.9+
+            tracemalloc.reset_peak()
+
+    def end_phase(self, name: str):
+        """Record the memory usage at the end of a phase.
+
+        Args:
+            name (str): Name of the phase.
+        """
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        if self.open_peaks:
+            peak = max(peak, self.open_peaks.pop())
+        if self.open_peaks:
+            self.open_peaks[-1] = max(self.open_peaks[-1], peak)
+        self.phases.append((name, current, peak))
+        logger.debug("Memory usage after phase %s: %d bytes (peak: %d bytes)", name, current, peak)
+
+    def table_data(self):
+        """Get the report as table rows.
+
+        Returns:
+            list: rows of the report, with a header.
+        """
+        data = [["Phase", "Memory at end (MB)", "Peak memory (MB)"]]
+        for name, current, peak in self.phases:
+            data.append([name, "%.1f" % (current / 1048576), "%.1f" % (peak / 1048576)])
+        rss = peak_rss()
+        if rss is not None:
+            data.append(["Process peak RSS", "", "%.1f" % (rss / 1048576)])
+        return data
+
+
+class Profiler():
+    """Measure the wall and CPU time of each phase and step, and the slowest elements.
+
+    The time of a step does not include the time of the steps nested in it. Steps run in worker
+    processes (with more than one job) are not measured.
+    """
+
+    def __init__(self, slowest: int = 10, pstats_file: str = None):
+        """Build a new Profiler object.
+
+        Args:
+            slowest (int, optional): Number of slowest elements to report. Defaults to 10.
+            pstats_file (str, optional): Path of a cProfile dump (pstats format) of the current
+                thread. Defaults to None: no dump.
+        """
+        self.slowest = slowest
+        self.pstats_file = pstats_file
+        self.phases = []
+        self.steps = {}
+        self.elements = {}
+        self.types = {}
+        self.names = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.phase_starts = {}
+        self.cprofile = None
+
+    def __enter__(self):
+        """Use the profiler as a context manager.
+
+        Returns:
+            Profiler: the current profiler.
+        """
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """Stop the profiler at the end of the context."""
+        self.stop()
+
+    def start(self):
+        """Listen to the phases and steps, and start cProfile if a dump is requested."""
+        add_phase_hook(self)
+        add_step_hook(self)
+        if self.pstats_file:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def stop(self):
+        """Stop listening, and write the cProfile dump."""
+        remove_step_hook(self)
+        remove_phase_hook(self)
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.pstats_file)
+            logger.info("cProfile dump written to %s", self.pstats_file)
+
+    def start_phase(self, name: str):
+        """Record the time at the start of a phase.
+
+        Args:
+            name (str): Name of the phase.
+        """
+        self.phase_starts[name] = (time.perf_counter(), time.process_time())
+
+    def end_phase(self, name: str):
+        """Record the duration of a phase.
+
+        Args:
+            name (str): Name of the phase.
+        """
+        wall_start, cpu_start = self.phase_starts.pop(name)
+        self.phases.append((name, time.perf_counter() - wall_start, time.process_time() - cpu_start))
+
+    def start_step(self, name: str, item_id: str = None):
+        """Record the time at the start of a step.
+
+        Args:
+            name (str): Name of the step.
+            item_id (str, optional): ID of the processed element. Defaults to None.
+        """
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append([time.perf_counter(), _cpu_time(), 0.0, 0.0])
+
+    def end_step(self, name: str, item_id: str = None):
+        """Record the duration of a step, without the nested steps.
+
+        Args:
+            name (str): Name of the step.
+            item_id (str, optional): ID of the processed element. Defaults to None.
+        """
+        stack = self.local.stack
+        wall_start, cpu_start, nested_wall, nested_cpu = stack.pop()
+        wall, cpu = time.perf_counter() - wall_start, _cpu_time() - cpu_start
+        if stack:
+            stack[-1][2] += wall
+            stack[-1][3] += cpu
+        with self.lock:
+            totals = self.steps.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wall - nested_wall
+            totals[2] += cpu - nested_cpu
+            if item_id is not None:
+                self.elements[item_id] = self.elements.get(item_id, 0.0) + wall
+
+    def record_element(self, vro_item):
+        """Count an element and its data volume by type, and remember its name.
+
+        Args:
+            vro_item (VROElementMetadata): A compared element.
+        """
+        with self.lock:
+            totals = self.types.setdefault(vro_item.type, [0, 0])
+            totals[0] += 1
+            totals[1] += vro_item.data_size or 0
+            self.names[vro_item.id] = (vro_item.type, vro_item.name)
+
+    def table_data(self):
+        """Get the time of each phase as table rows.
+
+        Returns:
+            list: rows of the report, with a header.
+        """
+        data = [["Phase", "Wall time (ms)", "CPU time (ms)"]]
+        for name, wall, cpu in self.phases:
+            data.append([name, "%.1f" % (wall * 1e3), "%.1f" % (cpu * 1e3)])
+        return data
+
+    def steps_table_data(self):
+        """Get the time of each step as table rows, the longest first.
+
+        Returns:
+            list: rows of the report, with a header.
+        """
+        data = [["Step", "Calls", "Wall time (ms)", "CPU time (ms)"]]
+        for name, (calls, wall, cpu) in sorted(self.steps.items(), key=lambda entry: -entry[1][1]):
+            data.append([name, calls, "%.1f" % (wall * 1e3), "%.1f" % (cpu * 1e3)])
+        return data
+
+    def types_table_data(self):
+        """Get the number and data volume of the elements of each type as table rows.
+
+        Returns:
+            list: rows of the report, with a header.
+        """
+        data = [["Type", "Elements", "Data (KB)"]]
+        for item_type, (count, size) in sorted(self.types.items()):
+            data.append([item_type, count, "%.1f" % (size / 1024)])
+        return data
+
+    def slowest_table_data(self):
+        """Get the slowest elements as table rows.
+
+        Returns:
+            list: rows of the report, with a header.
+        """
+        data = [["ID", "Name", "Type", "Time (ms)"]]
+        for item_id, duration in heapq.nlargest(self.slowest, self.elements.items(), key=lambda entry: entry[1]):
+            item_type, name = self.names.get(item_id, ("", ""))
+            data.append([item_id, name, item_type, "%.1f" % (duration * 1e3)])
+        return data
@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+"""Serve package comparisons over HTTP, keeping the items of the reference packages in memory."""
+
+# default python modules
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# external modules
+import click
+
+# local imports
+from . import __version__
+from .__main__ import configure_logging, LOG_LEVELS
+from .config import (CACHE_MAX_SIZE, CLI_CONTEXT_SETTINGS, CONTENT_MEMORY_BUDGET, LOGGING_FILE, LOGGING_LEVEL_FILE,
+                     REFERENCE_CACHE_SIZE, SERVER_ADDRESS)
+from .engine import PackageDiffEngine
+from .package import ElementFilter, PackageReadError
+from .vro_element import set_content_memory_budget
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 1000
+"""int: Number of recent requests used to compute the latency percentiles."""
+
+FILTER_FIELDS = ("include_types", "exclude_types", "ids", "name_globs")
+"""tuple: Fields of a comparison request that select the compared elements (see `ElementFilter`)."""
+
+
+class RequestError(Exception):
+    """A request to the server is invalid."""
+
+    def __init__(self, message: str, status: int = 400):
+        """Build a new RequestError object.
+
+        Args:
+            message (str): Description of the error, sent to the client.
+            status (int, optional): HTTP status code of the response. Defaults to 400.
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class ServerMetrics():
+    """Count the requests of the server and measure their latency."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        """Build a new ServerMetrics object.
+
+        Args:
+            window (int, optional): Number of recent requests used to compute the latency percentiles.
+                Defaults to LATENCY_WINDOW.
+        """
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.recent = deque(maxlen=window)
+
+    def record(self, duration: float, error: bool = False):
+        """Record a comparison request.
+
+        Args:
+            duration (float): Duration of the request in seconds.
+            error (bool, optional): The request failed. Defaults to False.
+        """
+        with self.lock:
+            self.requests += 1
+            self.errors += error
+            self.total_time += duration
+            self.max_time = max(self.max_time, duration)
+            self.recent.append(duration)
+
+    def snapshot(self):
+        """Get the current metrics.
+
+        Returns:
+            dict: the number of ``requests`` and ``errors``, and the ``latency_ms`` statistics.
+        """
+        with self.lock:
+            recent = sorted(self.recent)
+            latency = {
+                "mean": self.total_time / self.requests * 1e3 if self.requests else None,
+                "max": self.max_time * 1e3 if self.requests else None,
+            }
+            for name, quantile in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                latency[name] = recent[min(len(recent) - 1, int(len(recent) * quantile))] * 1e3 if recent else None
+            return {"requests": self.requests, "errors": self.errors, "latency_ms": latency}
+
+
+def _resolve_diff_folder(diff_folder, diff_root: str = None):
+    """Get the path of the diff folder of a request, that must be in the diff root folder of the server.
+
+    Args:
+        diff_folder (str): Diff folder of the request, relative to the diff root folder.
+        diff_root (str, optional): Folder where the diff files can be written. Defaults to None: no
+            diff files.
+
+    Raises:
+        RequestError: the diff folder is not allowed.
+
+    Returns:
+        str: the absolute path of the diff folder.
+    """
+    if not isinstance(diff_folder, str) or not diff_folder:
+        raise RequestError("Invalid diff folder")
+    if diff_root is None:
+        raise RequestError("Diff files are disabled on this server (see --diff-root)")
+    diff_root = os.path.realpath(diff_root)
+    path = os.path.realpath(os.path.join(diff_root, diff_folder))
+    if path == diff_root or os.path.commonpath([diff_root, path]) != diff_root:
+        raise RequestError("The diff folder must be in the diff root folder of the server")
+    return path
+
+
+def _parse_compare_request(body: bytes, diff_root: str = None):
+    """Check the body of a comparison request.
+
+    Args:
+        body (bytes): JSON object with a ``reference`` package, the ``packages`` (or a single
+            ``package``) to compare with it, and optional ``diff_folder`` (relative to the diff root
+            folder), ``records`` and element filter (FILTER_FIELDS lists) values.
+        diff_root (str, optional): Folder where the diff files can be written. Defaults to None: no
+            diff files.
+
+    Raises:
+        RequestError: the request is invalid.
+
+    Returns:
+        dict: the request values.
+    """
+    try:
+        request = json.loads(body.decode('utf-8'))
+    except ValueError as error:
+        raise RequestError("Invalid JSON body: %s" % error)
+    if not isinstance(request, dict):
+        raise RequestError("The body must be a JSON object")
+    packages = request.get("packages", [request["package"]] if "package" in request else None)
+    if not isinstance(request.get("reference"), str):
+        raise RequestError("Missing reference package")
+    if not packages or not isinstance(packages, list) or not all(isinstance(package, str) for package in packages):
+        raise RequestError("Missing compared packages")
+    request["packages"] = packages
+    for field in FILTER_FIELDS:
+        values = request.get(field) or []
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise RequestError("Invalid %s: a list of strings is expected" % field)
+    if any(request.get(field) for field in FILTER_FIELDS):
+        request["element_filter"] = ElementFilter(*(request.get(field) for field in FILTER_FIELDS))
+    if request.get("diff_folder") is not None:
+        request["diff_folder"] = _resolve_diff_folder(request["diff_folder"], diff_root)
+    return request
+
+
+def result_document(result, records: bool = False):
+    """Build the JSON document of a comparison result.
+
+    Args:
+        result (ComparisonResult): The comparison result.
+        records (bool, optional): Add the record of each element. Defaults to False.
+
+    Returns:
+        dict: the JSON document.
+    """
+    document = {
+        "package": result.compared_package,
+        "counts": result.counts,
+        "safe_to_import": result.safe_to_import,
+        "conflicts": [
+            {
+                "id": conflict.id,
+                "name": conflict.name,
+                "type": conflict.type,
+                "reference_version": str(conflict.reference_version),
+                "version": str(conflict.version),
+                "reason": conflict.reason,
+            }
+            for conflict in result.conflicts
+        ],
+    }
+    if records:
+        document["records"] = result.records()
+    return document
+
+
+class ComparisonRequestHandler(BaseHTTPRequestHandler):
+    """Handle the requests of the comparison server.
+
+    * ``POST /compare``: compare packages (see `_parse_compare_request`),
+    * ``GET /metrics``: requests, latency and reference cache metrics,
+    * ``GET /health``: check that the server is running.
+    """
+
+    server_version = "vro-diff-server/%s" % __version__
+
+    def address_string(self):
+        """Get the client address for the log messages (empty for Unix sockets).
+
+        Returns:
+            str: the client address.
+        """
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args):
+        """Write the access log in the package logger instead of the standard error."""
+        logger.debug("%s - " + format, self.address_string(), *args)
+
+    def send_json(self, status: int, document: dict):
+        """Send a JSON response.
+
+        Args:
+            status (int): HTTP status code.
+            document (dict): Content of the response.
+        """
+        body = json.dumps(document).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        """Read the body of the request, whose length must be given by its Content-Length header.
+
+        Raises:
+            RequestError: the Content-Length header is missing or invalid.
+
+        Returns:
+            bytes: the body.
+        """
+        length = self.headers.get("Content-Length")
+        if length is None:
+            raise RequestError("Missing Content-Length header", status=411)
+        try:
+            length = int(length)
+        except ValueError:
+            raise RequestError("Invalid Content-Length header: %s" % length)
+        if length < 0:
+            raise RequestError("Invalid Content-Length header: %d" % length)
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        """Send the metrics or the health of the server."""
+        if self.path == "/metrics":
+            metrics = self.server.metrics.snapshot()
+            metrics["reference_cache"] = self.server.engine.stats()
+            self.send_json(200, metrics)
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok", "version": __version__})
+        else:
+            self.send_json(404, {"error": "Unknown path: %s" % self.path})
+
+    def do_POST(self):
+        """Compare packages with a reference package."""
+        if self.path != "/compare":
+            self.send_json(404, {"error": "Unknown path: %s" % self.path})
+            return
+        start = time.perf_counter()
+        try:
+            request = _parse_compare_request(self.read_body(), diff_root=self.server.diff_root)
+            results = self.server.engine.compare_many(request["reference"], request["packages"],
+                                                      diff_folder=request.get("diff_folder"),
+                                                      element_filter=request.get("element_filter"))
+        except RequestError as error:
+            self.server.metrics.record(time.perf_counter() - start, error=True)
+            self.send_json(error.status, {"error": str(error)})
+            return
+        except PackageReadError as error:
+            logger.error("%s", error)
+            self.server.metrics.record(time.perf_counter() - start, error=True)
+            self.send_json(422, {"error": str(error)})
+            return
+        except Exception:
+            logger.exception("Cannot compare packages")
+            self.server.metrics.record(time.perf_counter() - start, error=True)
+            self.send_json(500, {"error": "Internal server error"})
+            return
+        duration = time.perf_counter() - start
+        self.server.metrics.record(duration)
+        logger.info("Compared %d package(s) with %s in %.1f ms", len(results), request["reference"], duration * 1e3)
+        self.send_json(200, {
+            "reference": request["reference"],
+            "results": [result_document(result, records=bool(request.get("records"))) for result in results],
+            "duration_ms": duration * 1e3,
+        })
+
+
+class ComparisonServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server handling each comparison request in a thread."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, engine: PackageDiffEngine, diff_root: str = None):
+        """Build a new ComparisonServer object.
+
+        Args:
+            address (tuple): Host and port to listen to.
+            engine (PackageDiffEngine): Engine used for the comparisons.
+            diff_root (str, optional): Folder where the diff files of the requests can be written.
+                Defaults to None: no diff files.
+        """
+        self.engine = engine
+        self.diff_root = diff_root
+        self.metrics = ServerMetrics()
+        super().__init__(address, ComparisonRequestHandler)
+
+
+class UnixComparisonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server over a Unix socket, handling each comparison request in a thread."""
+
+    daemon_threads = True
+
+    def __init__(self, address: str, engine: PackageDiffEngine, diff_root: str = None):
+        """Build a new UnixComparisonServer object.
+
+        Args:
+            address (str): Path of the Unix socket.
+            engine (PackageDiffEngine): Engine used for the comparisons.
+            diff_root (str, optional): Folder where the diff files of the requests can be written.
+                Defaults to None: no diff files.
+        """
+        self.engine = engine
+        self.diff_root = diff_root
+        self.metrics = ServerMetrics()
+        super().__init__(address, ComparisonRequestHandler)
+
+
+def make_server(address: str, engine: PackageDiffEngine, diff_root: str = None):
+    """Build a comparison server.
+
+    Args:
+        address (str): ``host:port`` to listen to, or ``unix:<path>`` for a Unix socket.
+        engine (PackageDiffEngine): Engine used for the comparisons.
+        diff_root (str, optional): Folder where the diff files of the requests can be written.
+            Defaults to None: no diff files.
+
+    Raises:
+        ValueError: the address is invalid.
+
+    Returns:
+        ComparisonServer or UnixComparisonServer: the server.
+    """
+    if address.startswith("unix:"):
+        return UnixComparisonServer(address[len("unix:"):], engine, diff_root=diff_root)
+    host, _, port = address.rpartition(":")
+    if not port.isdigit():
+        raise ValueError("Invalid server address: %s" % address)
+    return ComparisonServer((host or "127.0.0.1", int(port)), engine, diff_root=diff_root)
+
+
+@click.command(context_settings=CLI_CONTEXT_SETTINGS)
+@click.version_option(__version__)
+@click.option('--bind',
+              default=SERVER_ADDRESS,
+              show_default=True,
+              help="Address to listen to: host:port, or unix:<path> for a Unix socket")
+@click.option('-j', '--jobs',
+              type=click.IntRange(min=0),
+              default=1,
+              show_default=True,
+              help="Number of processes used to read the packages elements and to generate diff files "
+                   "(0 to use all the CPUs)")
+@click.option('--max-references',
+              type=click.IntRange(min=0),
+              default=REFERENCE_CACHE_SIZE,
+              show_default=True,
+              help="Number of reference packages whose items are kept in memory")
+@click.option('-m', '--memory-budget',
+              type=click.IntRange(min=0),
+              default=CONTENT_MEMORY_BUDGET // (1024 * 1024),
+              show_default=True,
+              help="Memory (MB) used to keep the content of the elements (0 to read it again when needed)")
+@click.option('-c', '--cache-dir',
+              type=click.Path(file_okay=False, resolve_path=True),
+              help="A folder where to cache the items read from the reference packages")
+@click.option('--cache-max-size',
+              type=click.IntRange(min=1),
+              default=CACHE_MAX_SIZE // (1024 * 1024),
+              show_default=True,
+              help="Maximum size (MB) of the cache")
+@click.option('--diff-root',
+              type=click.Path(file_okay=False, resolve_path=True),
+              help="A folder where the requests can write diff files, in the diff_folder sub folder they ask for")
+@click.option('--log-level',
+              type=click.Choice(LOG_LEVELS),
+              default=logging.getLevelName(LOGGING_LEVEL_FILE).lower(),
+              show_default=True,
+              help="Level of the messages written to the log file (off to disable logging)")
+@click.option('--log-file',
+              type=click.Path(dir_okay=False),
+              default=LOGGING_FILE,
+              show_default=True,
+              help="Log file location (an empty value to disable logging)")
+def cli(bind: str = SERVER_ADDRESS, jobs: int = 1, max_references: int = REFERENCE_CACHE_SIZE,
+        memory_budget: int = 256, cache_dir: str = None, cache_max_size: int = 64, diff_root: str = None,
+        log_level: str = 'debug', log_file: str = LOGGING_FILE):
+    """Serve vRealize Orchestrator package comparisons over HTTP.
+
+    POST a JSON object like {"reference": "ref.package", "packages": ["new.package"]} to /compare:
+    the items of the most recently used reference packages are kept in memory, so only the compared
+    packages are read. GET /metrics reports the requests latency and the reference cache hits.
+    Diff files are only written in a sub folder of the --diff-root folder.
+    """
+    configure_logging(log_level, log_file)
+    set_content_memory_budget(memory_budget * 1024 * 1024)
+    cache = None
+    if cache_dir:
+        from .cache import PackageCache
+        cache = PackageCache(cache_dir, max_size=cache_max_size * 1024 * 1024)
+    if not jobs:
+        jobs = os.cpu_count() or 1
+    with PackageDiffEngine(jobs=jobs, cache=cache, max_references=max_references) as engine:
+        try:
+            server = make_server(bind, engine, diff_root=diff_root)
+        except (OSError, ValueError) as error:
+            raise click.ClickException("Cannot listen to %s: %s" % (bind, error))
+        logger.info("Serving package comparisons on %s", bind)
+        click.echo("Serving package comparisons on %s" % bind, err=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if bind.startswith("unix:"):
+                os.unlink(bind[len("unix:"):])
+    logger.info("End of execution of the comparison server.")
+
+
+def main():
+    """Start the comparison server."""
+    cli(obj={})
+
+
+if __name__ == '__main__':
+    main()
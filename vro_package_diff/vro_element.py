@@ -2,9 +2,17 @@
 """Define VROElementMetadata object class."""
 
 # default python modules
+import codecs
+import collections
+import contextlib
+import copy
+import functools
 import hashlib
 import io
 import logging
+import sys
+import threading
+import weakref
 import xml.etree.ElementTree as Etree
 import zipfile
 
@@ -12,14 +20,318 @@ import zipfile
 from packaging import version
 
 # local imports
-from .config import SUPPORTED_ELEMENT_TYPES
+from .config import CONTENT_MEMORY_BUDGET, SUPPORTED_ELEMENT_TYPES
+from .profiling import step
 
 
 logger = logging.getLogger(__name__)
 
+HEADER_CHUNK_SIZE = 16384
+"""int: Size of the chunks of XML content fed to the parser when reading the element header."""
+
+XML_TREE_SIZE_FACTOR = 4
+"""int: Rough memory size of a parsed XML tree, relative to the size of its decoded content."""
+
+DECODING_FALLBACKS = ['utf-16-be', 'utf-8']
+"""list: Encodings to try when the detected one fails to decode a content."""
+
+RESOURCE_CHUNK_SIZE = 64 * 1024
+"""int: Size of the chunks read to hash the content of a ResourceElement."""
+
+RESOURCE_SPOOL_SIZE = 8 * 1024 * 1024
+"""int: Size beyond which a compressed ResourceElement is spooled to a temporary file to be read."""
+
+TEXT_MIMETYPES = ('text/', 'application/json', 'application/xml', 'application/javascript', 'application/x-sh')
+"""tuple: Prefixes of the MIME types of the ResourceElements with a text content."""
+
+_NOT_DECODED = object()
+
+
+def detect_encoding(data: bytes):
+    """Detect the encoding of a plain content from its BOM or from the position of NUL bytes.
+
+    Args:
+        data (bytes or memoryview): The content to decode.
+
+    Returns:
+        str: The name of the encoding.
+    """
+    data = bytes(data[:4])
+    if data.startswith(codecs.BOM_UTF16_BE):
+        return 'utf-16-be'
+    if data.startswith(codecs.BOM_UTF16_LE):
+        return 'utf-16-le'
+    if len(data) >= 2 and data[0] == 0 and data[1] != 0:
+        return 'utf-16-be'
+    if len(data) >= 2 and data[0] != 0 and data[1] == 0:
+        return 'utf-16-le'
+    return 'utf-8'
+
+
+def is_text_content(sample: bytes, mimetype: str = None):
+    """Guess if a content is text, from its MIME type or else from its first bytes.
+
+    Args:
+        sample (bytes): The first bytes of the content.
+        mimetype (str, optional): MIME type of the content. Defaults to None.
+
+    Returns:
+        bool: True for a text content.
+    """
+    if mimetype and (mimetype.startswith(TEXT_MIMETYPES) or mimetype.endswith(('+xml', '+json'))):
+        return True
+    if sample.startswith((codecs.BOM_UTF8, codecs.BOM_UTF16_BE, codecs.BOM_UTF16_LE)):
+        return True
+    if b'\0' in sample:
+        return False
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample)  # a truncated last character is allowed
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+class BufferReader(io.RawIOBase):
+    """Read a buffer (like a memory-mapped file) as a seekable binary file object.
+
+    The buffer is not copied: only the data returned by `read` is.
+    """
+
+    def __init__(self, buffer):
+        """Build a new BufferReader object.
+
+        Args:
+            buffer (bytes-like): The buffer to read.
+        """
+        self.buffer = memoryview(buffer)
+        self.position = 0
+
+    def readable(self):
+        """The buffer is readable."""
+        return True
+
+    def seekable(self):
+        """The buffer is seekable."""
+        return True
+
+    def tell(self):
+        """Get the current position.
+
+        Returns:
+            int: the position.
+        """
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+        """Change the current position.
+
+        Args:
+            offset (int): Offset, relative to whence.
+            whence (int, optional): io.SEEK_SET, io.SEEK_CUR or io.SEEK_END. Defaults to io.SEEK_SET.
+
+        Returns:
+            int: the new position.
+        """
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.buffer)
+        if offset < 0:
+            raise ValueError("negative seek position %d" % offset)
+        self.position = offset
+        return offset
+
+    def read(self, size: int = -1):
+        """Read some bytes from the current position.
+
+        Args:
+            size (int, optional): Number of bytes to read. Defaults to -1: up to the end.
+
+        Returns:
+            bytes: the data read.
+        """
+        end = len(self.buffer) if size is None or size < 0 else min(len(self.buffer), self.position + size)
+        data = self.buffer[self.position:end].tobytes()
+        self.position = max(self.position, end)
+        return data
+
+    readall = read
+
+    def readinto(self, target):
+        """Read some bytes from the current position into a writable buffer.
+
+        Args:
+            target (bytes-like): The writable buffer.
+
+        Returns:
+            int: the number of bytes read.
+        """
+        data = self.buffer[self.position:self.position + len(target)]
+        target[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def read_content(data_content):
+    """Read a whole data content.
+
+    Args:
+        data_content (bytes or file): The content (bytes or memoryview), or a binary file object to
+            read it from (closed once read).
+
+    Returns:
+        bytes: the content (a memoryview is returned as is).
+    """
+    if isinstance(data_content, (bytes, bytearray, memoryview)):
+        return data_content
+    with step("Zip read"), data_content:
+        return data_content.read()
+
+
+@contextlib.contextmanager
+def open_nested_zip(data_content, sha1=None):
+    """Open the nested zip file of a ResourceElement, without loading it in memory.
+
+    A file object that cannot be seeked cheaply (like a compressed member of the package) is
+    copied in chunks to a temporary file, only kept in memory up to RESOURCE_SPOOL_SIZE.
+
+    Args:
+        data_content (bytes or file): The content (bytes or memoryview, read without a copy), or a
+            binary file object to read it from (closed at the end of the context).
+        sha1 (hashlib.sha1, optional): A hash updated with the whole content. Defaults to None.
+
+    Yields:
+        zipfile.ZipFile: the nested zip file.
+    """
+    if isinstance(data_content, (bytes, bytearray, memoryview)):
+        data_content = BufferReader(data_content)
+    with contextlib.ExitStack() as stack:
+        source = stack.enter_context(data_content)
+        if not isinstance(source, (BufferReader, io.BytesIO, io.BufferedReader)):
+            import tempfile
+            source = stack.enter_context(tempfile.SpooledTemporaryFile(max_size=RESOURCE_SPOOL_SIZE))
+        if sha1 is not None or source is not data_content:
+            with step("Zip read"):
+                for chunk in iter(functools.partial(data_content.read, RESOURCE_CHUNK_SIZE), b''):
+                    if sha1 is not None:
+                        sha1.update(chunk)
+                    if source is not data_content:
+                        source.write(chunk)
+            source.seek(0)
+        with zipfile.ZipFile(source, 'r') as zip_data:
+            yield zip_data
+
+
+def read_zip_text(zip_data: zipfile.ZipFile, name: str, default: str = None):
+    """Read a small text file from a zip file.
+
+    Args:
+        zip_data (zipfile.ZipFile): The zip file.
+        name (str): Name of the file.
+        default (str, optional): Value returned if the file is missing. Defaults to None.
+
+    Returns:
+        str: the file content.
+    """
+    try:
+        with zip_data.open(name, 'r') as text_file:
+            return text_file.read().decode('utf-8')
+    except KeyError:
+        return default
+
+
+class ContentMemoryBudget():
+    """Release the content of the least recently used elements beyond a memory budget.
+
+    The budget can be used from several threads.
+    """
+
+    def __init__(self, budget: int):
+        """Build a new ContentMemoryBudget object.
+
+        Args:
+            budget (int): Memory budget in bytes.
+        """
+        self.budget = budget
+        self.size = 0
+        self.items = collections.OrderedDict()
+        self.lock = threading.RLock()  # released elements call forget()
+
+    def use(self, vro_item):
+        """Record that an element keeps some content in memory.
+
+        Args:
+            vro_item (VROElementMetadata): The element.
+        """
+        with self.lock:
+            _, size = self.items.pop(id(vro_item), (None, 0))
+            self.size -= size
+            size = vro_item.content_size()
+            self.items[id(vro_item)] = (weakref.ref(vro_item), size)
+            self.size += size
+            while self.size > self.budget and len(self.items) > 1:
+                _, (item_ref, size) = self.items.popitem(last=False)
+                self.size -= size
+                old_item = item_ref()
+                if old_item is not None:
+                    old_item.release_content()
+
+    def forget(self, vro_item):
+        """Stop tracking the content of an element.
+
+        Args:
+            vro_item (VROElementMetadata): The element.
+        """
+        with self.lock:
+            _, size = self.items.pop(id(vro_item), (None, 0))
+            self.size -= size
+
+
+CONTENT_BUDGET = ContentMemoryBudget(CONTENT_MEMORY_BUDGET)
+"""ContentMemoryBudget: Memory budget shared by the content of all elements."""
+
+
+def set_content_memory_budget(budget: int):
+    """Change the memory budget for the content of the elements.
+
+    Args:
+        budget (int): Memory budget in bytes.
+    """
+    CONTENT_BUDGET.budget = budget
+
+
+def read_item_type(xml_str: bytes):
+    """Read the type of an element from the content of its ``info`` file.
+
+    Args:
+        xml_str (bytes): The XML content for item info.
+
+    Returns:
+        tuple: the type name (``Action`` for a ScriptModule, ``Unsupported`` for an unsupported
+            type), and the type name written in the info file.
+    """
+    raw_type = None
+    for x in Etree.fromstring(xml_str).findall('entry'):
+        if x.get('key') == "type":
+            raw_type = x.text
+    if raw_type not in SUPPORTED_ELEMENT_TYPES:
+        return "Unsupported", raw_type
+    if raw_type == 'ScriptModule':
+        return "Action", raw_type  # rename scriptmodule --> action
+    return raw_type, raw_type
+
 
 class VROElementMetadata():
-    """Abstract class to represent vRealize Orchestrator elements extracted from a vRO package."""
+    """Abstract class to represent vRealize Orchestrator elements extracted from a vRO package.
+
+    Only the metadata and checksum of an element are kept for the whole run: its content is
+    read again from the package when it was released from memory.
+    """
+
+    __slots__ = (
+        'id', 'type', 'name', 'version', 'comp_version', 'checksum', 'data_size', 'valued_items',
+        'fingerprint', 'data_loader', '_data_content', '_dec_data_content', '_xml_tree', '_resource', '__weakref__'
+    )
 
     def __init__(self, id: str, xml_info: bytes, data_content: bytes):
         """Build a new VROElementMetadata object from id, xml_info, data_content.
@@ -27,20 +339,76 @@ class VROElementMetadata():
         Args:
             id (str): Object ID (from the folder name in zip-package file).
             xml_info (bytes): info file content.
-            data_content (bytes): data file content (could be a nested zip file or an XML one).
+            data_content (bytes or callable): data file content (could be a nested zip file or an XML
+                one), or a callable returning it or a binary file object to read it from: it is only
+                called for supported element types, and called again to read the content once it was
+                released from memory.
         """
         self.name = None  # populated with self.read_data later
         self.type = None  # populated with self.read_data later
         self.version = version.parse("0.0.0")  # populated with self.read_data later
-        self.dec_data_content = None  # populated with self.read_data later
-        self.valued_items = 0  # populated in count_values_from_configuration_elt later
+        self.data_loader = None  # populated with data_content later
+        self.checksum = None  # populated with data_content later
+        self.data_size = 0  # populated with data_content later
+        self.valued_items = None  # populated in count_values_from_configuration_elt later
+        self.fingerprint = None  # populated by the package reader
         self.id = id
         self.type = self.get_item_type(xml_info)
         self.comp_version = None
+        self._resource = None
+        self.clear_content()
         if self.type in SUPPORTED_ELEMENT_TYPES:
-            self.data_content = data_content
-            self.read_data()
-            self.checksum = hashlib.sha1(data_content).hexdigest()
+            if callable(data_content):
+                self.data_loader = data_content
+                data_content = data_content()
+            elif self.type == "ResourceElement":
+                # the nested zip file is opened again to read the resource content
+                self.data_loader = functools.partial(BufferReader, data_content)
+            self.read_data(data_content)
+
+    @classmethod
+    def from_summary(cls, summary: tuple, data_content):
+        """Build a new VROElementMetadata object from a summary, without reading the data content.
+
+        The data content is read on demand.
+
+        Args:
+            summary (tuple): Summary of the element, as returned by `summary`.
+            data_content (callable): callable returning the data file content.
+
+        Returns:
+            VROElementMetadata: the element.
+        """
+        vro_item = cls.__new__(cls)
+        (vro_item.id, vro_item.type, vro_item.name, vro_item.version,
+         vro_item.checksum, vro_item.data_size) = summary
+        vro_item.data_loader = data_content
+        vro_item.valued_items = None
+        vro_item.fingerprint = None
+        vro_item.comp_version = None
+        vro_item._resource = None
+        vro_item.clear_content()
+        return vro_item
+
+    def copy(self):
+        """Copy the element, to represent the same content in another package.
+
+        The data content is shared between both objects.
+
+        Returns:
+            VROElementMetadata: the copy of the element.
+        """
+        vro_item = copy.copy(self)
+        vro_item.comp_version = None
+        return vro_item
+
+    def summary(self):
+        """Get a compact summary of the element metadata.
+
+        Returns:
+            tuple: the id, type, name, version, checksum and data size of the element.
+        """
+        return (self.id, self.type, self.name, self.version, self.checksum, self.data_size)
 
     def __str__(self):
         """Define the string representation for object VROElementMetadata.
@@ -50,6 +418,67 @@ class VROElementMetadata():
         """
         return "[%s]%s" % (self.type, self.id)
 
+    @property
+    def data_content(self):
+        """bytes: The data content, or a memoryview of the package file when it is stored without
+        compression (for ResourceElements: the data of the nested resource, or None if it is binary)."""
+        if self._data_content is None and self.data_loader is not None:
+            if self.type == "ResourceElement":
+                self._data_content = self.read_resource_content()
+            else:
+                self._data_content = read_content(self.data_loader())
+            CONTENT_BUDGET.use(self)
+        return self._data_content
+
+    @property
+    def dec_data_content(self):
+        """str: The decoded data content, or None if it cannot be decoded."""
+        if self._dec_data_content is _NOT_DECODED:
+            self._dec_data_content = self.u_decode_plain_content()
+            CONTENT_BUDGET.use(self)
+        return self._dec_data_content
+
+    @property
+    def xml_tree(self):
+        """xml.etree.ElementTree.Element: The root of the parsed data content."""
+        if self._xml_tree is None:
+            with step("Element parse"):
+                self._xml_tree = Etree.fromstring(self.dec_data_content)
+            CONTENT_BUDGET.use(self)
+        return self._xml_tree
+
+    def clear_content(self):
+        """Forget the data content and the values derived from it."""
+        self._data_content = None
+        self._dec_data_content = _NOT_DECODED
+        self._xml_tree = None
+
+    def release_content(self):
+        """Release the memory used by the content: it is read, decoded and parsed again on demand.
+
+        Without a data loader, the data content itself is kept.
+        """
+        CONTENT_BUDGET.forget(self)
+        data_content = self._data_content
+        self.clear_content()
+        if self.data_loader is None:
+            self._data_content = data_content
+
+    def content_size(self):
+        """Estimate the memory used by the content that can be released.
+
+        Returns:
+            int: the size in bytes.
+        """
+        size = 0
+        if self.data_loader is not None and self._data_content is not None:
+            size += len(self._data_content)
+        if self._dec_data_content is not _NOT_DECODED and self._dec_data_content is not None:
+            size += sys.getsizeof(self._dec_data_content)
+            if self._xml_tree is not None:
+                size += XML_TREE_SIZE_FACTOR * len(self._dec_data_content)
+        return size
+
     def get_item_type(self, xml_str: bytes):
         """Get the item type.
 
@@ -59,84 +488,147 @@ class VROElementMetadata():
         Returns:
             str: The type name.
         """
-        root = Etree.fromstring(xml_str)
-        for x in root.findall('entry'):
-            if x.get('key') == "type":
-                raw_type = x.text
-        if raw_type in SUPPORTED_ELEMENT_TYPES:
-            if raw_type == 'ScriptModule':
-                return "Action"  # rename scriptmodule --> action
-            return raw_type
-        else:
-            logger.warning("Unsupported element type for item: %s (%s)" % (self.id, raw_type))
-            return "Unsupported"
+        item_type, raw_type = read_item_type(xml_str)
+        if item_type == "Unsupported":
+            logger.warning("Unsupported element type for item: %s (%s)", self.id, raw_type)
+        return item_type
 
     def u_decode_plain_content(self):
         """UTF-16 or UTF-8 decoding of plain files.
 
+        The encoding is detected first, so only one decoding is usually needed. The content is
+        only read once: another thread may release it from memory meanwhile.
+
         Returns:
             str: a decoded version of the input data.
         """
-        try:
-            dec_data = self.data_content.decode('utf-16-be')
-            logger.debug("UTF-16 decoding for item %s" % self.id)
-        except UnicodeDecodeError:
+        content = self.data_content
+        if content is None:
+            return None
+        encoding = detect_encoding(content)
+        encodings = [encoding] + [e for e in DECODING_FALLBACKS if e != encoding]
+        for encoding in encodings:
             try:
-                dec_data = self.data_content.decode('utf-8')
-                logger.debug("UTF-8 decoding failed for item %s" % self.id)
+                dec_data = codecs.decode(content, encoding)
+                logger.debug("%s decoding for item %s", encoding, self.id)
+                return dec_data
             except UnicodeDecodeError:
-                logger.error("Both UTF-16 and UTF-8 decoding failed for item %s" % self.id)
-                dec_data = None
-        return dec_data
+                logger.debug("%s decoding failed for item %s", encoding, self.id)
+        logger.error("Both UTF-16 and UTF-8 decoding failed for item %s", self.id)
+        return None
 
-    def read_data(self):
-        """Read data content to extract object name.
+    def read_data(self, data_content: bytes = None):
+        """Read data content to extract object name, and compute its checksum.
 
-        Populate self.name, self.version and self.type.
+        Populate self.name, self.version, self.checksum and self.data_size. The nested zip file of
+        a ResourceElement is read in chunks: its resource content is not loaded.
+
+        Args:
+            data_content (bytes or file, optional): data file content, or a binary file object to
+                read it from. Defaults to None: read with the data loader.
         """
+        if data_content is None:
+            data_content = self.data_loader()
+        self.clear_content()
         self.name = "Unsupported: %s" % self.type  # default value
         self.version = "n/a"  # default value
         # specific case of nested zip file for resourcesElements
         if self.type == "ResourceElement":
-            with zipfile.ZipFile(io.BytesIO(self.data_content), 'r') as zip_data:
-                with zip_data.open('VSO-RESOURCE-INF/attribute_name', 'r') as name_file:
-                    self.name = name_file.read().decode('utf-8')
-                try:
-                    with zip_data.open('VSO-RESOURCE-INF/attribute_version', 'r') as version_file:
-                        _version = version_file.read().decode('utf-8')
-                except KeyError:
-                    _version = "0.0.0"
-                self.version = version.parse(_version)
-                with zip_data.open('VSO-RESOURCE-INF/data', 'r') as data_file:
-                    self.data_content = data_file.read()
-                    self.dec_data_content = self.u_decode_plain_content()
+            sha1 = hashlib.sha1()
+            with open_nested_zip(data_content, sha1) as zip_data:
+                self.name = read_zip_text(zip_data, 'VSO-RESOURCE-INF/attribute_name')
+                self.version = version.parse(read_zip_text(zip_data, 'VSO-RESOURCE-INF/attribute_version', "0.0.0"))
+                self.data_size = zip_data.fp.seek(0, io.SEEK_END)  # size of the nested zip file
+            self.checksum = sha1.hexdigest()
         elif self.type in SUPPORTED_ELEMENT_TYPES:
-            self.dec_data_content = self.u_decode_plain_content()
-            root = Etree.fromstring(self.dec_data_content)
-            _version = root.get('version', "0.0.0")
-            if self.type == 'Workflow':
-                namespaces = {'workflow': 'http://vmware.com/vco/workflow'}
-                self.name = root.find('workflow:display-name', namespaces).text
-            elif self.type == 'Action' or self.type == "ScriptModule" or self.type == "PolicyTemplate":
-                self.name = root.get('name')
-            elif self.type == 'ConfigurationElement':
-                self.name = root.find('display-name').text
+            self._data_content = read_content(data_content)
+            self.checksum = hashlib.sha1(self._data_content).hexdigest()
+            self.data_size = len(self._data_content)
+            self.name, _version = self.read_header(self.dec_data_content)
             self.version = version.parse(_version)
 
+    def resource_summary(self):
+        """Summarize the content of a ResourceElement, reading it in chunks.
+
+        Returns:
+            tuple: the MIME type (or None), size, SHA-1 and text flag of the resource content.
+        """
+        if self._resource is None:
+            with open_nested_zip(self.data_loader()) as zip_data:
+                mimetype = read_zip_text(zip_data, 'VSO-RESOURCE-INF/attribute_mimetype')
+                sha1, size, sample = hashlib.sha1(), 0, None
+                with zip_data.open('VSO-RESOURCE-INF/data', 'r') as data_file:
+                    for chunk in iter(functools.partial(data_file.read, RESOURCE_CHUNK_SIZE), b''):
+                        if sample is None:
+                            sample = chunk[:HEADER_CHUNK_SIZE]
+                        sha1.update(chunk)
+                        size += len(chunk)
+            self._resource = (mimetype, size, sha1.hexdigest(), is_text_content(sample or b'', mimetype))
+        return self._resource
+
+    def read_resource_content(self):
+        """Read the content of a ResourceElement, if it is text.
+
+        Returns:
+            bytes: the resource content, or None if it is binary.
+        """
+        if not self.resource_summary()[3]:
+            logger.debug("Binary content for item %s is not loaded", self.id)
+            return None
+        with open_nested_zip(self.data_loader()) as zip_data:
+            with zip_data.open('VSO-RESOURCE-INF/data', 'r') as data_file:
+                return data_file.read()
+
+    def read_header(self, xml_str: str):
+        """Read the name and version of the element from its XML content.
+
+        The content is parsed incrementally: parsing stops as soon as both values are found, so
+        the full tree is never built.
+
+        Args:
+            xml_str (str): The XML content of the element.
+
+        Returns:
+            tuple: the name and the version (str) of the element.
+        """
+        name_tag = None
+        if self.type == 'Workflow':
+            name_tag = '{http://vmware.com/vco/workflow}display-name'
+        elif self.type == 'ConfigurationElement':
+            name_tag = 'display-name'
+        parser = Etree.XMLPullParser(events=('start', 'end'))
+        _version, depth = None, 0
+        for i in range(0, len(xml_str), HEADER_CHUNK_SIZE):
+            parser.feed(xml_str[i:i + HEADER_CHUNK_SIZE])
+            for event, elt in parser.read_events():
+                if event == 'end':
+                    depth -= 1
+                    if depth == 1 and elt.tag == name_tag:
+                        return elt.text, _version
+                    continue
+                depth += 1
+                if depth == 1:
+                    _version = elt.get('version', "0.0.0")
+                    if name_tag is None:
+                        return elt.get('name'), _version
+        return None, _version or "0.0.0"
+
     def count_values_from_configuration_elt(self):
         """Count the number of values found in a configurationElement.
 
+        Values are only counted once.
+
         Returns:
             int: number of values found in the configurationElement items.
         """
         if not self.type == 'ConfigurationElement':
             logger.warn("Invalid type to count values in")
             return 0
-        self.dec_data_content = self.u_decode_plain_content()
-        root = Etree.fromstring(self.dec_data_content)
-        atts = root.find('atts')
-        for att in atts.findall('att'):
-            if att.find('value') is not None:
-                self.valued_items += 1
-        logger.debug("Found %d values in %s" % (self.valued_items, self.name))
+        if self.valued_items is None:
+            atts = self.xml_tree.find('atts')
+            self.valued_items = 0
+            for att in atts.findall('att'):
+                if att.find('value') is not None:
+                    self.valued_items += 1
+            logger.debug("Found %d values in %s", self.valued_items, self.name)
         return self.valued_items